@@ -4,7 +4,9 @@ from argparse import Namespace
 import logging
 import zipfile
 import shutil
-from eric_oss_app_package_tool.generator import generate, product_report, hash_utils
+from multiprocessing import cpu_count
+from eric_oss_app_package_tool.generator import chart_inventory, generate, product_report, hash_utils, helm_template, \
+    layer_store, pull_leases, pull_scheduler, pull_telemetry, render_cache
 from vnfsdk_pkgtools.packager import csar
 from vnfsdk_pkgtools.packager import utils
 import os
@@ -51,12 +53,7 @@ def check_helm_arguments(args):
     if args.helm_dir is not None:
         if not os.path.isdir(args.helm_dir):
             raise ValueError("The specified helm directory is not a directory")
-        helm_charts_exist = False
-        for root, directories, files in os.walk(args.helm_dir):
-            for filename in files:
-                if '.tgz' in filename:
-                    helm_charts_exist = True
-        if not helm_charts_exist:
+        if not any(chart.in_helm_dir for chart in chart_inventory.get_inventory(args).charts):
             raise ValueError("The specified directory does not contain any helm charts")
 
 
@@ -166,6 +163,12 @@ def generate_option2(args, vnfd):
 
 
 def generate_func(args):
+    # The parse processes are forked before the render, pull and preflight threads start
+    with helm_template.parse_pool():
+        __generate(args)
+
+
+def __generate(args):
     logging.debug('Args: ' + str(args))
     __check_arguments(args)
     __docker_tar_generated = False
@@ -312,6 +315,14 @@ def parse_args(args_list):
         help='Yaml file containing values to be passed to the helm template during csar package generation',
         nargs='*'
     )
+    generate.add_argument(
+        '--values-profile',
+        type=convert_str_to_values_profile,
+        action='append',
+        help='A named deployment profile as <name>=<file>[,<file>...], the files are passed after --values. Can be '
+             'given several times, every chart is then rendered once per profile and the union of their images is '
+             'packaged'
+    )
     generate.add_argument(
         '-hs',
         '--history',
@@ -391,6 +402,150 @@ def parse_args(args_list):
         action='store_true',
         help='Run helm commands with debug option'
     )
+    generate.add_argument(
+        '--render-jobs',
+        type=convert_str_to_positive_int,
+        help='Number of helm charts to render in parallel while discovering images. '
+             'Set to the number of CPUs by default',
+        default=cpu_count()
+    )
+    generate.add_argument(
+        '--helm-timeout',
+        type=convert_str_to_positive_int,
+        help='Seconds a single helm command may run before it is killed and the build fails',
+        default=600
+    )
+    generate.add_argument(
+        '--helm-build-timeout',
+        type=convert_str_to_positive_int,
+        help='Seconds all helm commands of the build may run for in total, there is no limit by default'
+    )
+    generate.add_argument(
+        '--pull-concurrency',
+        type=convert_str_to_positive_int,
+        help='Number of images pulled at the same time from each registry at the start, it then adapts to the '
+             'throughput and throttling of the registry',
+        default=pull_scheduler.DEFAULT_CONCURRENCY
+    )
+    generate.add_argument(
+        '--max-pull-concurrency',
+        type=convert_str_to_positive_int,
+        help='Highest number of images pulled at the same time from each registry',
+        default=pull_scheduler.DEFAULT_MAX_CONCURRENCY
+    )
+    generate.add_argument(
+        '--registry-pull-concurrency',
+        type=convert_str_to_registry_limit,
+        action='append',
+        help='A fixed number of images pulled at the same time from a registry as <registry>=<number>. Can be '
+             'given several times'
+    )
+    generate.add_argument(
+        '--always-pull',
+        action='store_true',
+        help='Pull every image, even those the local docker daemon already has'
+    )
+    generate.add_argument(
+        '--verify-local-digests',
+        action='store_true',
+        help='Only use an image of the local docker daemon if its digest is the one in the registry'
+    )
+    generate.add_argument(
+        '--export-from-registry',
+        action='store_true',
+        help='Write docker.tar with the image layers downloaded straight from the registries, without a docker daemon'
+    )
+    generate.add_argument(
+        '--no-layer-store',
+        action='store_true',
+        help='Download every layer with --export-from-registry instead of reusing the layers of earlier builds'
+    )
+    generate.add_argument(
+        '--layer-store-dir',
+        help='The directory of the layers kept for later builds with --export-from-registry',
+        default=layer_store.DEFAULT_STORE_DIR
+    )
+    generate.add_argument(
+        '--layer-store-size',
+        type=convert_str_to_positive_int,
+        help='The maximum size of the layer store in MB',
+        default=layer_store.DEFAULT_STORE_SIZE_MB
+    )
+    generate.add_argument(
+        '--no-preflight',
+        action='store_true',
+        help='Pull images without checking first that they exist in their registries. With the check, each image '
+             'is pulled once its own manifest is found, which costs one manifest request per image, and the first '
+             'missing image stops further pulls and fails the build with all images that cannot be pulled. Without '
+             'it, a missing image is only found when its pull fails'
+    )
+    generate.add_argument(
+        '--images-lock',
+        help='Path to a lockfile of the digests of the images. The images it locks are pulled by digest, and the '
+             'digests of all images of the build are written to it'
+    )
+    generate.add_argument(
+        '--refresh-lock',
+        action='store_true',
+        help='Resolve the tags of all images again instead of using the digests in the --images-lock file'
+    )
+    generate.add_argument(
+        '--registry-mirror',
+        type=convert_str_to_registry_mirror,
+        action='append',
+        help='A mirror of a registry as <registry>=<mirror>, images of the registry are pulled and looked up in the '
+             'mirror but keep their names in the package. Can be given several times'
+    )
+    generate.add_argument(
+        '--pull-summary',
+        help='Path of a JSON file to write the bytes, duration and throughput of every pulled image and layer to'
+    )
+    generate.add_argument(
+        '--pull-progress-interval',
+        type=convert_str_to_positive_int,
+        help='Seconds between the log lines with the aggregate progress of the pulls',
+        default=pull_telemetry.DEFAULT_PROGRESS_INTERVAL
+    )
+    generate.add_argument(
+        '--pull-lease-dir',
+        help='Directory of the leases on image pulls shared by the builds using the same docker daemon, an empty '
+             'value turns the leases off',
+        default=pull_leases.DEFAULT_LEASE_DIR
+    )
+    generate.add_argument(
+        '--pull-lease-stale-after',
+        type=convert_str_to_positive_int,
+        help='Seconds after which the lease of a build that stopped touching it is removed',
+        default=pull_leases.DEFAULT_STALE_AFTER
+    )
+    generate.add_argument(
+        '--product-info-images',
+        action='store_true',
+        help='Read the images of charts shipping eric-product-info.yaml, and all of their subcharts, straight from '
+             'the chart instead of rendering them with helm'
+    )
+    generate.add_argument(
+        '--no-render-cache',
+        action='store_true',
+        help='Always run helm template instead of reusing renders from the render cache'
+    )
+    generate.add_argument(
+        '--render-cache-dir',
+        help='Directory holding the render cache of helm template output',
+        default=render_cache.DEFAULT_CACHE_DIR
+    )
+    generate.add_argument(
+        '--render-cache-size',
+        type=convert_str_to_positive_int,
+        help='Maximum size of the render cache in MB, least recently used renders are evicted above it',
+        default=render_cache.DEFAULT_CACHE_SIZE_MB
+    )
+    generate.add_argument(
+        '--parallel-parse-threshold',
+        type=convert_str_to_positive_int,
+        help='Size in MB of helm template output above which its documents are parsed in parallel processes',
+        default=8
+    )
     generate.add_argument(
         '--product-report',
         help='To generate product report YAML file'
@@ -412,6 +567,41 @@ def convert_str_to_bool(arg):
         raise argparse.ArgumentTypeError('Boolean value expected.')
 
 
+def convert_str_to_positive_int(arg):
+    try:
+        value = int(arg)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Integer value expected.')
+    if value < 1:
+        raise argparse.ArgumentTypeError('Value must be at least 1.')
+    return value
+
+
+def convert_str_to_values_profile(arg):
+    name, separator, files = arg.partition('=')
+    values = [values_file for values_file in files.split(',') if values_file]
+    if not separator or not name or not values:
+        raise argparse.ArgumentTypeError('Values profile expected as <name>=<file>[,<file>...].')
+    for values_file in values:
+        if not os.path.exists(values_file):
+            raise argparse.ArgumentTypeError("The values file, " + values_file + ", doesn't exist")
+    return name, values
+
+
+def convert_str_to_registry_limit(arg):
+    registry, separator, limit = arg.rpartition('=')
+    if not separator or not registry:
+        raise argparse.ArgumentTypeError('Registry limit expected as <registry>=<number>.')
+    return registry, convert_str_to_positive_int(limit)
+
+
+def convert_str_to_registry_mirror(arg):
+    registry, separator, mirror = arg.partition('=')
+    if not separator or not registry or not mirror:
+        raise argparse.ArgumentTypeError('Registry mirror expected as <registry>=<mirror>.')
+    return registry, mirror
+
+
 def __configure_logging(logging, level):
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=level.upper())
 
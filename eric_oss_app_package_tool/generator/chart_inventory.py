@@ -0,0 +1,72 @@
+'''Inventory of the Helm charts given to a run'''
+
+import os
+import threading
+
+from eric_oss_app_package_tool.generator import hash_utils
+from eric_oss_app_package_tool.generator.utils import Memo
+
+
+class ChartEntry(object):
+    '''A chart archive with the size and modification time it had when it was inventoried'''
+    def __init__(self, path, in_helm_dir):
+        stat = os.stat(path)
+        self.path = path
+        self.name = os.path.basename(path)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.in_helm_dir = in_helm_dir
+
+    def __repr__(self):
+        return 'ChartEntry({0}, size={1}, mtime={2})'.format(self.path, self.size, self.mtime)
+
+
+class ChartInventory(object):
+    '''The charts of a run, found with a single walk of the helm directory.
+
+       The argument checks, image discovery, staging of the source folder and the
+       product report all read the charts from here instead of walking the helm
+       directory again. Content digests are computed on first use and kept while
+       the size and modification time of the file stay the same, so the render
+       cache and any other digest keyed lookup hash each file once per run.'''
+    def __init__(self, helm=None, helm_dir=None):
+        self.lock = threading.Lock()
+        self.digests = {}
+        self.charts = []
+        if helm_dir is not None:
+            for root, directories, files in os.walk(helm_dir):
+                for filename in sorted(files):
+                    if '.tgz' in filename:
+                        self.charts.append(ChartEntry(os.path.join(root, filename), True))
+        for chart in helm or []:
+            self.charts.append(ChartEntry(chart, False))
+
+    def paths(self):
+        '''Return the paths of the charts in the order they were given'''
+        return [chart.path for chart in self.charts]
+
+    def digest(self, path):
+        '''Return the sha256 digest of a file, hashing it only if it changed since it was last hashed'''
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        with self.lock:
+            known = self.digests.get(key)
+        if known is not None and known[:2] == (stat.st_size, stat.st_mtime):
+            return known[2]
+        digest = hash_utils.sha256(path)
+        with self.lock:
+            self.digests[key] = (stat.st_size, stat.st_mtime, digest)
+        return digest
+
+
+_inventories = Memo()
+
+
+def get_inventory(args):
+    '''Return the chart inventory of the helm and helm_dir arguments, built on the first call of the run'''
+    return _inventories.get((tuple(args.helm or ()), args.helm_dir), ChartInventory)
+
+
+def clear():
+    '''Forget all inventories'''
+    _inventories.clear()
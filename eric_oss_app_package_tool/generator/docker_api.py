@@ -1,19 +1,35 @@
 '''Docker API'''
 
 from base64 import b64decode
+import hashlib
 import json
 import os
 import logging
+import re
+import threading
 import requests
 
+from registry_mirror import mirror_name
+
 
 API_MANIFEST = "https://{server}/v2/{path}/manifests/{version}"
 API_BLOB = "https://{server}/v2/{path}/blobs/{digest}"
+DOCKER_HUB = "registry-1.docker.io"
+MANIFEST_TYPES = ", ".join(["application/vnd.docker.distribution.manifest.v2+json",
+                            "application/vnd.docker.distribution.manifest.list.v2+json",
+                            "application/vnd.oci.image.manifest.v1+json",
+                            "application/vnd.oci.image.index.v1+json"])
+
+_CHALLENGE_PARAMETER = re.compile(r'(\w+)="([^"]*)"')
+# Connections kept open per registry, as many as the preflight checks running at the same time
+_CONNECTIONS = 32
 
 
 class DockerError(Exception):
-    '''Docker Exception'''
-    pass
+    '''Docker Exception, with the HTTP status the registry answered if it answered with an error'''
+    def __init__(self, message, status=None):
+        super(DockerError, self).__init__(message)
+        self.status = status
 
 
 # pylint: disable=too-few-public-methods
@@ -40,43 +56,166 @@ class DockerConfig(object):
 
 # pylint: disable=too-few-public-methods
 class DockerApi(object):
-    '''Docker API v2 client'''
-    def __init__(self, docker_config_path, timeout=15):
+    '''Docker API v2 client, calling the mirror of a registry instead of the registry if it has one.
+       Connections are kept open in one session, and the bearer token of a registry is asked for once per realm and
+       scope and then sent with every request of the repository up front.'''
+    def __init__(self, docker_config_path, timeout=15, mirrors=None):
         self.docker_config = DockerConfig(docker_config_path)
         self.timeout = timeout
+        self.mirrors = mirrors or {}
+        self.session = requests.Session()
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=_CONNECTIONS))
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.scopes = {}
 
-    def get_labels(self, image_path):
-        '''Return labels dictionary for an image'''
+    @staticmethod
+    def split_image_path(image_path):
+        '''Split an image URL to separate variables e.g. <server>/<path>/<image>:<version>,
+           the version of <server>/<path>/<image>@<digest> is the digest'''
         path_components = image_path.split("/")
-
-        # Split image URL to separate variables e.g. <server>/<path>/<image>:<version>
         server = path_components[0]
-        path, version = "/".join(path_components[1:]).split(":")
+        reference = "/".join(path_components[1:])
+        if "@" in reference:
+            path, version = reference.split("@")
+        else:
+            path, version = reference.split(":")
+        return server, path, version
+
+    def get_manifest(self, image_path):
+        '''Return the v2 manifest of an image, the linux/amd64 one of an image with a manifest list'''
+        return self.get_platform_manifest(image_path)[1]
+
+    def get_compressed_size(self, image_path):
+        '''Return the size in bytes of the compressed layers and the config of an image'''
+        try:
+            manifest = self.get_manifest(image_path)
+            return manifest["config"]["size"] + sum(layer["size"] for layer in manifest["layers"])
+        except (DockerError, KeyError) as exc:
+            logging.debug("Could not get the size of %s (%s)", image_path, exc)
+            raise DockerError("Failed to get image size for {}".format(image_path), getattr(exc, "status", None))
 
-        credentials = self.docker_config.get_credentials(server)
+    def get_labels(self, image_path):
+        '''Return labels dictionary for an image'''
+        server, path, _, credentials = self.__locate(image_path)
         try:
-            manifest = requests.get(
-                API_MANIFEST.format(server=server,
-                                    path=path,
-                                    version=version),
-                auth=credentials,
-                headers={
-                    "Accept":
-                    "application/vnd.docker.distribution.manifest.v2+json"
-                },
-                timeout=self.timeout
-            )
-            manifest.raise_for_status()
-            digest = manifest.json()["config"]["digest"]
-            media_type = manifest.json()["config"]["mediaType"]
-
-            blob = requests.get(API_BLOB.format(server=server,
-                                                path=path,
-                                                digest=digest),
-                                auth=credentials,
-                                headers={"Accept": media_type},
-                                timeout=self.timeout)
+            manifest = self.get_manifest(image_path)
+            digest = manifest["config"]["digest"]
+            media_type = manifest["config"]["mediaType"]
+
+            blob = self.__request("GET", API_BLOB.format(server=server, path=path, digest=digest), (server, path),
+                                  credentials, {"Accept": media_type})
+            blob.raise_for_status()
             return blob.json()["config"]["Labels"] or {}
-        except (requests.exceptions.RequestException, KeyError) as exc:
+        except (DockerError, requests.exceptions.RequestException, KeyError, ValueError) as exc:
             logging.error("Could not get labels for %s (%s)", image_path, exc)
             raise DockerError("Failed to get image labels for {}".format(image_path))
+
+    def __locate(self, image_path):
+        '''Return the server, path, version and credentials of an image.
+           Images without a registry are in Docker Hub, registries without credentials in the docker config, like
+           mirrors or registries of a credential helper, are called anonymously.'''
+        server, path, version = self.split_image_path(
+            mirror_name(mirror_name(image_path, self.mirrors), {"docker.io": DOCKER_HUB}))
+        try:
+            credentials = self.docker_config.get_credentials(server)
+        except KeyError:
+            credentials = None
+        return server, path, version, credentials
+
+    def has_credentials(self, image_path):
+        '''Return True if the docker config has credentials for the registry of an image'''
+        return self.__locate(image_path)[3] is not None
+
+    def check_manifest(self, image_path):
+        '''Return the HTTP status of the manifest of an image, e.g. 404 if it does not exist, and the compressed size
+           of the image if it exists, or None. Both come from the same GET, so the size of a checked image costs no
+           further request against the pull quota of the registry.'''
+        try:
+            return 200, self.get_compressed_size(image_path)
+        except DockerError as exc:
+            if exc.status is None:
+                raise
+            return exc.status, None
+
+    def get_platform_manifest(self, image_path, platform=("linux", "amd64")):
+        '''Return the digest of the manifest of an image and its v2 manifest for the platform.
+           The digest of an image with a manifest list is the one of the list, as docker records it on pull.'''
+        server, path, version, credentials = self.__locate(image_path)
+        try:
+            response = self.__request("GET", API_MANIFEST.format(server=server, path=path, version=version),
+                                      (server, path), credentials, {"Accept": MANIFEST_TYPES})
+            self.__check_status(response, image_path)
+            digest = response.headers.get("Docker-Content-Digest") or \
+                "sha256:" + hashlib.sha256(response.content).hexdigest()
+            manifest = response.json()
+            if "manifests" in manifest:
+                entries = [entry["digest"] for entry in manifest["manifests"]
+                           if (entry.get("platform", {}).get("os"),
+                               entry.get("platform", {}).get("architecture")) == tuple(platform)]
+                if not entries:
+                    raise DockerError("{} has no manifest for {}".format(image_path, "/".join(platform)))
+                response = self.__request("GET", API_MANIFEST.format(server=server, path=path, version=entries[0]),
+                                          (server, path), credentials, {"Accept": MANIFEST_TYPES})
+                self.__check_status(response, image_path)
+                manifest = response.json()
+            return digest, manifest
+        except (requests.exceptions.RequestException, KeyError, ValueError) as exc:
+            raise DockerError("Failed to get the manifest of {} ({})".format(image_path, exc))
+
+    @staticmethod
+    def __check_status(response, image_path):
+        if response.status_code != 200:
+            raise DockerError("Failed to get the manifest of {} (HTTP {})".format(image_path, response.status_code),
+                              response.status_code)
+
+    def download_blob(self, image_path, digest, target):
+        '''Download a config or layer blob of an image to the target file, verifying its digest'''
+        server, path, _, credentials = self.__locate(image_path)
+        checksum = hashlib.sha256()
+        try:
+            response = self.__request("GET", API_BLOB.format(server=server, path=path, digest=digest), (server, path),
+                                      credentials, {}, stream=True)
+            response.raise_for_status()
+            with open(target, "wb") as blob:
+                for chunk in response.iter_content(1024 * 1024):
+                    checksum.update(chunk)
+                    blob.write(chunk)
+        except (requests.exceptions.RequestException, EnvironmentError, KeyError, ValueError) as exc:
+            raise DockerError("Failed to download {} of {} ({})".format(digest, image_path, exc))
+        if "sha256:" + checksum.hexdigest() != digest:
+            raise DockerError("Downloaded {} of {} has the digest sha256:{}".format(
+                digest, image_path, checksum.hexdigest()))
+
+    def __request(self, method, url, repository, credentials, headers, stream=False):
+        '''Send a request to a registry, answering its challenge for a bearer token if it asks for one.
+           The token is cached and sent up front with the next requests of the repository, it is only asked for
+           again when the registry rejects it.'''
+        with self.lock:
+            scope = self.scopes.get(repository)
+            token = self.tokens.get(scope)
+        if token is not None:
+            response = self.session.request(method, url, headers=dict(headers, Authorization="Bearer " + token),
+                                            timeout=self.timeout, stream=stream)
+        else:
+            response = self.session.request(method, url, auth=credentials, headers=headers, timeout=self.timeout,
+                                            stream=stream)
+        challenge = response.headers.get("WWW-Authenticate", "")
+        if response.status_code != 401 or not challenge.lower().startswith("bearer "):
+            return response
+        parameters = dict(_CHALLENGE_PARAMETER.findall(challenge))
+        realm = parameters.pop("realm")
+        scope = (realm, parameters.get("scope"))
+        with self.lock:
+            cached = self.tokens.get(scope)
+        if cached is None or cached == token:
+            answer = self.session.get(realm, params=parameters, auth=credentials, timeout=self.timeout)
+            if answer.status_code != 200:
+                return answer
+            answer = answer.json()
+            cached = answer.get("token") or answer["access_token"]
+        with self.lock:
+            self.tokens[scope] = cached
+            self.scopes[repository] = scope
+        return self.session.request(method, url, headers=dict(headers, Authorization="Bearer " + cached),
+                                    timeout=self.timeout, stream=stream)
@@ -0,0 +1,47 @@
+'''Pool of Docker clients'''
+
+import threading
+from contextlib import contextmanager
+from Queue import Queue
+
+import docker
+
+DOCKER_TIMEOUT = 600
+
+
+class DockerClientPool(object):
+    '''A bounded pool of Docker clients shared by the workers of a build.
+
+       Clients are created on demand up to the size of the pool and handed back
+       after every use, so the connections to the daemon are reused by all pulls
+       and tags instead of opening one per image.'''
+    def __init__(self, size, timeout=DOCKER_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle = Queue()
+        self.clients = []
+
+    @contextmanager
+    def client(self):
+        '''Borrow a client, waiting for one to be handed back if all of them are in use'''
+        client = self.__take()
+        try:
+            yield client
+        finally:
+            self.idle.put(client)
+
+    def __take(self):
+        with self.lock:
+            if self.idle.empty() and len(self.clients) < self.size:
+                client = docker.from_env(timeout=self.timeout)
+                self.clients.append(client)
+                return client
+        return self.idle.get()
+
+    def close(self):
+        '''Close all clients of the pool'''
+        with self.lock:
+            for client in self.clients:
+                client.close()
+            self.clients = []
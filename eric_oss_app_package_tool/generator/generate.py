@@ -1,5 +1,5 @@
 #!/usr/bin/python
-import docker
+import atexit
 import itertools
 import json
 import logging
@@ -8,16 +8,34 @@ import shutil
 import sys
 import tarfile
 import tempfile
+import threading
+import time
 import fnmatch
 import os.path
 import yaml
 from contextlib import contextmanager
-from multiprocessing import cpu_count
+from docker.errors import DockerException, ImageNotFound
 from multiprocessing.pool import ThreadPool
 from subprocess import Popen, PIPE, check_output
 
+from chart_inventory import get_inventory
+from docker_api import DockerApi, DockerError
+from docker_pool import DockerClientPool
+from pull_leases import PullLeases
+from pull_scheduler import PullScheduler, Throttled
+from pull_telemetry import PullTelemetry
+from registry_export import RegistryExport
+from registry_mirror import mirror_name
+from helm_runner import HelmCancelled, get_runner
+from image_lock import get_lock, get_repo_digest
+from image_pipeline import ImagePipeline
+from layer_store import LayerStore
+from preflight import Preflight
 from helm_template import HelmTemplate
-from image import Image
+from image import Image, get_registry
+from render_cache import RenderCache
+from render_registry import REGISTRY
+from utils import read_chart_file, read_chart_tree
 
 try:
     from yaml import CLoader as Loader
@@ -28,6 +46,8 @@ from datetime import datetime
 import re
 
 _DOCKER_SAVE_FILENAME = 'docker.tar'
+_PRODUCT_INFO_FILENAME = 'eric-product-info.yaml'
+_DEFAULT_PROFILE = 'default'
 REL_PATH_TO_HELM_CHART = 'OtherDefinitions/'
 TAGGED_IMAGES = ' '
 
@@ -37,85 +57,309 @@ METADATA_KEYS = ['vnf_product_name',
                  'vnf_release_date_time']
 SOURCE = './'
 
+_HELM_VERSIONS = {}
+_HELM_WARNING = re.compile('^(\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}|coalesce\.go:[0-9]*:) [W|w]arning')
+_PULL_ATTEMPTS = 4
+_RENDER_DIR = None
+_RENDER_DIR_LOCK = threading.Lock()
+
 
 def __set__command(helm, values, set_parameters, helm3, helm_debug):
-    fullCommand = []
-    helm_options = "--debug" if helm_debug else ""
-    start_cmd = ('{} template {} {}'.format("helm3" if helm3 else "helm",
-                                            helm_options,
-                                            helm))
-    fullCommand.append(start_cmd)
+    fullCommand = ["helm3" if helm3 else "helm", 'template']
+    if helm_debug:
+        fullCommand.append('--debug')
+    fullCommand.append(helm)
     if values:
-        fullCommand.append(' --values ' + ','.join(values))
+        fullCommand.extend(['--values', ','.join(values)])
     if set_parameters:
-        fullCommand.append(' --set ' + ','.join(set_parameters))
+        fullCommand.extend(['--set', ','.join(set_parameters)])
     if not set_parameters and not values and not helm3:
         logging.warning("""This is adding '--set ingress.hostname=a' to the helm template command, if you have not specified any set/values. 
                            This is now deprecated and will be removed.
                            If you rely on it please update your execution of the tool to add this set/value""")
-        fullCommand.append(' --set ingress.hostname=a')
-    return ''.join(fullCommand)
+        fullCommand.extend(['--set', 'ingress.hostname=a'])
+    return fullCommand
+
+
+def get_values_profiles(args):
+    """
+    Returns the values profiles every chart is rendered with.
+    Without --values-profile this is a single profile of the --values files.
+    :param args: the parsed command line arguments
+    :return: a list of (name, values files) tuples
+    """
+    profiles = args.values_profile
+    if not profiles:
+        return [(_DEFAULT_PROFILE, args.values)]
+    return [(name, (args.values or []) + values) for name, values in profiles]
 
 
-def __get_images(args):
+def __get_images(args, on_images=None):
+    """
+    Renders every chart in every values profile and returns the union of their images.
+    :param args: the parsed command line arguments
+    :param on_images: called with the images of each render as soon as the render is done, from the render workers
+    :return: a set of Images
+    """
     helm_chart_paths = get_charts(args)
     image_list = set()
-    for chart in helm_chart_paths:
-        command = __set__command(chart, args.values, args.set, args.helm3, args.helm_debug)
-        logging.info('Command is: ' + str(command))
-        helm_template = Popen(command, shell=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        helm_template_output, err = helm_template.communicate()
-        __parse_std_err_for_errors(err)
-        image_list.update(__parse_helm_template(helm_template_output))
-        if __images_in_scalar_values(helm_template_output):
-            images_from_scalar_values = __handle_images_in_scalar_values(chart, args)
-            if len(images_from_scalar_values) == 0:
-                logging.warning(
-                    "Could not parse the image urls from the values.yaml file at root of chart. Please check the logs below to ensure all images have been packaged into the csar")
-            image_list.update(images_from_scalar_values)
+    if not helm_chart_paths:
+        return image_list
+    profiles = get_values_profiles(args)
+    renders = [(chart, profile) for chart in helm_chart_paths for profile in profiles]
+    render_jobs = min(args.render_jobs, len(renders))
+    logging.info('Rendering {0} helm chart(s) in {1} values profile(s) with {2} parallel job(s)'.format(
+        len(helm_chart_paths), len(profiles), render_jobs))
+    runner = get_runner(args)
+    render_cache = __get_render_cache(args)
+
+    def render(chart_profile):
+        chart, profile = chart_profile
+        try:
+            images = __get_chart_images(chart, args, render_cache, *profile)
+            if on_images is not None:
+                on_images(images)
+            return images
+        except Exception as e:
+            runner.cancel(e)
+            raise
+
+    pool = ThreadPool(render_jobs)
+    try:
+        render_images = pool.map(render, renders)
+    except HelmCancelled:
+        # Report the error that cancelled the build rather than a render it cancelled
+        raise runner.error
+    finally:
+        pool.close()
+        pool.join()
+        runner.log_wall_times()
+    profile_images = {}
+    for (chart, (name, values)), images in zip(renders, render_images):
+        profile_images.setdefault(name, set()).update(images)
+        image_list.update(images)
+    if len(profiles) > 1:
+        __log_profile_images(profile_images)
     return image_list
 
 
-def __parse_std_err_for_errors(err):
-    if str(err):
-        logging.warn('Std err was not empty: \n {0}'.format(str(err)))
-        lines = err.splitlines()
-        for line in lines:
-            x = re.search('^(\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}|coalesce\.go:[0-9]*:) [W|w]arning', line)
-            if x is None:
-                raise EnvironmentError('Helm command failed with error message: {0}'.format(str(err)))
+def __log_profile_images(profile_images):
+    for name, images in sorted(profile_images.items()):
+        other_images = set().union(*[other for other_name, other in profile_images.items() if other_name != name])
+        only_in_profile = sorted(str(image) for image in images - other_images)
+        logging.info('Values profile {0} has {1} image(s), {2} of them only in this profile{3}'.format(
+            name, len(images), len(only_in_profile), ': ' + ', '.join(only_in_profile) if only_in_profile else ''))
+
+
+def __get_chart_images(chart, args, render_cache=None, profile=_DEFAULT_PROFILE, values=None):
+    """
+    Renders a single helm chart in one values profile and returns the images found in it.
+    Runs in a worker of the render pool, so every log message names the chart and profile it belongs to.
+    :param chart: the path to the helm chart
+    :param args: the parsed command line arguments
+    :param render_cache: the RenderCache of this run, or None to always render
+    :param profile: the name of the values profile
+    :param values: the values files of the profile
+    :return: a set of Images
+    """
+    chart_name = os.path.basename(chart)
+    if profile != _DEFAULT_PROFILE:
+        chart_name = '{0} ({1})'.format(chart_name, profile)
+    if args.product_info_images:
+        image_list = __get_product_info_images(chart)
+        if image_list is not None:
+            logging.info('[{0}] Found {1} image(s) in {2} files'.format(chart_name, len(image_list),
+                                                                       _PRODUCT_INFO_FILENAME))
+            return image_list
+    helm_template = get_helm_template(chart, args, values, render_cache)
+    image_list = set(__extract_image_information(helm_template.get_all_images(), chart_name))
+    if helm_template.has_images_in_scalar_values():
+        images_from_scalar_values = __handle_images_in_scalar_values(chart)
+        if len(images_from_scalar_values) == 0:
+            logging.warning(
+                "[{0}] Could not parse the image urls from the values.yaml file at root of chart. "
+                "Please check the logs below to ensure all images have been packaged into the csar".format(chart_name))
+        image_list.update(images_from_scalar_values)
+    logging.info('[{0}] Found {1} image(s)'.format(chart_name, len(image_list)))
+    return image_list
+
+
+def __get_product_info_images(chart):
+    """
+    Builds the images of a chart from the eric-product-info.yaml files of the chart and all of its subcharts,
+    read straight from the chart archive as defined by DR-D1121-067.
+    Here follows an example of an eric-product-info.yaml file which will be parsed correctly:
+    ```
+        productName: "CM Mediator HELM"
+        productNumber: "CXC 201 1506"
+        images:
+          eric-cm-mediator:
+            productName: "CM Mediator Image"
+            productNumber: "CXC 201 1452"
+            registry: "armdocker.rnd.ericsson.se"
+            repoPath: "proj-common-assets-cd-released/control/cm/eric-cm-mediator"
+            name: eric-cm-mediator
+            tag: "7.6.0-11"
+    ```
+    Unlike helm template, this also returns the images of subcharts which the values of this run disable.
+    :param chart: the path to the helm chart
+    :return: a set of Images, or None if a chart does not ship a complete eric-product-info.yaml
+    """
+    chart_name = os.path.basename(chart)
+    image_list = set()
+    for chart_path, files in sorted(read_chart_tree(chart, [_PRODUCT_INFO_FILENAME]).items()):
+        product_info = files.get(_PRODUCT_INFO_FILENAME)
+        if product_info is None:
+            logging.info('[{0}] {1} has no {2}, rendering the chart'.format(chart_name, chart_path,
+                                                                          _PRODUCT_INFO_FILENAME))
+            return None
+        images = (safe_load(product_info) or {}).get('images') or {}
+        for key, image in images.items():
+            if not all(image.get(field) for field in ('registry', 'repoPath', 'name', 'tag')):
+                logging.info('[{0}] Image {1} in {2} is incomplete, rendering the chart'.format(
+                    chart_name, key, chart_path))
+                return None
+            __image = Image(repo='{0}/{1}/{2}'.format(image['registry'], image['repoPath'], image['name']),
+                            tag=str(image['tag']))
+            logging.info('[{0}] Repo is: {1}'.format(chart_name, __image))
+            image_list.add(__image)
+    return image_list
+
+
+def get_helm_template(chart, args, values=None, render_cache=None):
+    """
+    Returns the parsed helm template of a chart archive rendered with the values and set parameters of this run.
+    The render is shared through the render registry, so image discovery and the product report render each chart once.
+    :param chart: the path to the helm chart
+    :param args: the parsed command line arguments
+    :param values: the values files to render with instead of those of the --values argument
+    :param render_cache: the RenderCache of this run, or None to always render
+    :return: a HelmTemplate
+    """
+    if values is None:
+        values = args.values
+    key = (os.path.abspath(chart), tuple(values or ()), tuple(args.set or ()), args.helm3, args.helm_debug)
+    return REGISTRY.get(key, lambda: HelmTemplate(parallel_parse_threshold=args.parallel_parse_threshold * 1024 * 1024,
+                                                  path=__render_chart(chart, args, values, render_cache)))
 
 
-def __images_in_scalar_values(helm_template_output):
+def get_helm_templates(chart, args):
     """
-    This method gets the "image:" lines from the helm template output and checks to see if any line contains {{
-    :param helm_template_output:
-    :return: True if the image tags contain {{
+    Returns the parsed helm templates of a chart archive in every values profile of this run.
+    These are the renders of image discovery, looked up in the render registry under the same keys.
+    :param chart: the path to the helm chart
+    :param args: the parsed command line arguments
+    :return: a list of HelmTemplates, one per values profile
     """
-    return [line for line in re.findall(".*image:.*", helm_template_output) if "{{" in line]
+    return [get_helm_template(chart, args, values) for name, values in get_values_profiles(args)]
+
+
+def __render_chart(chart, args, values, render_cache):
+    """
+    Renders a chart into a file of the render directory, streaming the output of helm template to the file and
+    checking its std err line by line, so the render is never held in memory.
+    :return: the path to the rendered chart
+    """
+    chart_name = os.path.basename(chart)
+    handle, path = tempfile.mkstemp(dir=__get_render_dir(), suffix='.yaml')
+    os.close(handle)
+    if render_cache:
+        cache_key = render_cache.key(chart, values, args.set, args.helm_debug)
+        if render_cache.get_file(cache_key, path):
+            logging.info('[{0}] Using cached helm template {1}'.format(chart_name, cache_key))
+            return path
+    command = __set__command(chart, values, args.set, args.helm3, args.helm_debug)
+    logging.info('[{0}] Command is: {1}'.format(chart_name, ' '.join(command)))
+    with open(path, 'wb') as helm_template_output:
+        get_runner(args).run(command, chart_name, stdout=helm_template_output,
+                             parse_std_err=lambda lines: __parse_std_err_lines(lines, chart_name))
+    if render_cache:
+        render_cache.put_file(cache_key, path)
+    return path
+
+
+def __get_render_dir():
+    """Returns the temporary directory holding the renders of this run, it is removed when the run exits"""
+    global _RENDER_DIR
+    with _RENDER_DIR_LOCK:
+        if _RENDER_DIR is None:
+            _RENDER_DIR = tempfile.mkdtemp(prefix='helm-templates-')
+            atexit.register(shutil.rmtree, _RENDER_DIR, True)
+        return _RENDER_DIR
+
+
+def __get_render_cache(args):
+    """
+    Returns the render cache of this run, keyed on the version of the helm binary in use.
+    :param args: the parsed command line arguments
+    :return: a RenderCache, or None if the cache is disabled or the helm version cannot be determined
+    """
+    if args.no_render_cache:
+        return None
+    helm_version = __get_helm_version(args)
+    if helm_version is None:
+        logging.warning('Could not determine the helm version, the render cache will not be used')
+        return None
+    logging.debug('Using render cache ' + args.render_cache_dir)
+    return RenderCache(args.render_cache_dir, args.render_cache_size * 1024 * 1024, helm_version,
+                       get_inventory(args).digest)
+
+
+def __get_helm_version(args):
+    helm3 = args.helm3
+    if helm3 not in _HELM_VERSIONS:
+        command = ["helm3", "version", "--short"] if helm3 else ["helm", "version", "--client", "--short"]
+        try:
+            output = get_runner(args).run(command, 'helm version')
+        except EnvironmentError as e:
+            logging.debug('Command "{0}" failed: {1}'.format(' '.join(command), str(e)))
+            return None
+        if not output.strip():
+            return None
+        _HELM_VERSIONS[helm3] = output.strip()
+    return _HELM_VERSIONS[helm3]
+
+
+def __parse_std_err_for_errors(err, chart_name=None):
+    __parse_std_err_lines(str(err).splitlines(), chart_name)
+
+
+def __parse_std_err_lines(lines, chart_name=None):
+    """
+    Logs the warnings of helm std err as they arrive and raises an error after the last line if any line was not a
+    warning.
+    :param lines: an iterable of std err lines
+    :param chart_name: the chart helm was run on, for the messages
+    """
+    source = ' for chart {0}'.format(chart_name) if chart_name else ''
+    errors = []
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line:
+            continue
+        if _HELM_WARNING.search(line):
+            logging.warn('Std err{0} was not empty: {1}'.format(source, line))
+        else:
+            errors.append(line)
+    if errors:
+        raise EnvironmentError('Helm command{0} failed with error message: {1}'.format(source, '\n'.join(errors)))
 
 
 def get_charts(args):
-    helm_chart_paths = []
-    if args.helm_dir is not None:
-        for root, directories, files in os.walk(args.helm_dir):
-            for filepath in files:
-                if '.tgz' in filepath:
-                    helm_chart_paths.append(args.helm_dir + '/' + filepath)
-    if args.helm is not None:
-        for chart in args.helm:
-            helm_chart_paths.append(chart)
-    return helm_chart_paths
-
-def __handle_images_in_scalar_values(helm_chart, args):
+    return get_inventory(args).paths()
+
+def __handle_images_in_scalar_values(helm_chart):
+    chart_name = os.path.basename(helm_chart)
     logging.info(
-        "Helm template contains images in a scalar value, will parse the values file for the remaining images")
-    command = ("helm3 show values " + helm_chart) if args.helm3 else ("helm inspect values " + helm_chart)
-    logging.info("Command is: " + command)
-    helm_inspect = Popen(command, shell=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    values, err = helm_inspect.communicate()
-    if str(err):
-        raise EnvironmentError('Helm command failed with error message: {0}'.format(str(err)))
+        "[" + chart_name + "] Helm template contains images in a scalar value, "
+        "will parse the values file for the remaining images")
+    try:
+        values = read_chart_file(helm_chart, 'values.yaml')
+    except (IOError, tarfile.TarError) as e:
+        raise EnvironmentError('Could not read the values file of chart {0}: {1}'.format(chart_name, str(e)))
+    if values is None:
+        logging.warning("[" + chart_name + "] Chart does not contain a values.yaml file")
+        return set()
     return __parse_values_file_for_images(values)
 
 
@@ -255,7 +499,7 @@ def __parse_helm_template(helm_template):
     return __extract_image_information(helm_template_obj.get_all_images())
 
 
-def __extract_image_information(images):
+def __extract_image_information(images, chart_name=None):
     image_list = []
     for image in images:
         stripped = image.strip()
@@ -266,38 +510,336 @@ def __extract_image_information(images):
             __image = Image(repo=split[0], tag=split[1])
         else:
             __image = Image(repo=split[0])
-        logging.info('Repo is: ' + __image.__str__())
+        logging.info(('[{0}] '.format(chart_name) if chart_name else '') + 'Repo is: ' + __image.__str__())
         image_list.append(__image)
     return image_list
 
 
-def __pull_images(images):
-    logging.info('Pulling the images')
-    pool = ThreadPool(cpu_count())
-    pool.map(__pull, images)
-    pool.close()
-    pool.join()
-    logging.info('Images pulled')
+def __pull_discovered_images(discover, tagged_images, args):
+    """
+    Pulls the images with a pool of docker clients while they are being discovered, and retags each image as soon as
+    its pull finishes. Images the local daemon already has are not pulled again, unless --always-pull is given.
+    Unless --no-preflight is given, the images are checked in their registries while they are discovered, and each
+    of them is pulled once its own check passed.
+    :param discover: called with a function that queues images for pulling, it returns once discovery is done
+    :param tagged_images: the names of already tagged images, the names of the retagged images are appended
+    :param args: the parsed command line arguments
+    :return: the names of the tagged images
+    """
+    start = time.time()
+    scheduler = PullScheduler(args.pull_concurrency, args.max_pull_concurrency,
+                              dict(args.registry_pull_concurrency or []))
+    workers = scheduler.workers()
+    clients = DockerClientPool(workers)
+    telemetry = PullTelemetry(args.pull_progress_interval)
+    try:
+        local_images = {} if args.always_pull else __get_local_images(clients)
+        sizes = {}
+        mirrors = __get_registry_mirrors(args)
+        image_lock = get_lock(args)
+        docker_api = __get_docker_api(args)
+        leases = __get_pull_leases(args)
+        pipeline = ImagePipeline(workers,
+                                 lambda image: __pull_and_tag(image, clients, scheduler, leases, local_images,
+                                                              args.verify_local_digests, sizes, mirrors, image_lock,
+                                                              telemetry),
+                                 lambda image: __get_image_size(image, docker_api, local_images, sizes, image_lock,
+                                                                preflight))
+        preflight = __get_preflight(args, docker_api, image_lock, pipeline.submit)
+        try:
+            if preflight is None:
+                logging.info('Pulling the images as they are discovered')
+                discover(pipeline.submit)
+            else:
+                logging.info('Pulling the images as they are discovered and found in their registries')
+                __discover_and_check(discover, preflight, local_images, pipeline.submit)
+            logging.info('Image discovery done after {0:.1f}s'.format(time.time() - start))
+            names = pipeline.finish()
+            if image_lock is not None:
+                image_lock.save()
+        except BaseException:
+            pipeline.terminate()
+            raise
+    finally:
+        clients.close()
+        scheduler.log_levels()
+        telemetry.stop()
+        if args.pull_summary:
+            telemetry.write(args.pull_summary)
+    logging.info('{0} image(s) pulled after {1:.1f}s'.format(len(names), time.time() - start))
+    for name in names:
+        tagged_images += ' ' + name
+    logging.info("List of Re-tagged images : " + str(tagged_images))
+    return tagged_images
 
 
-def __pull(image):
-    client = docker.from_env(timeout=int(600))
-    logging.info("Pulling {0}".format(image.__str__()))
-    client.images.pull(repository=image.repo, tag=image.tag)
-    client.close()
+def __get_preflight(args, docker_api, image_lock, on_passed=None):
+    if args.no_preflight or docker_api is None:
+        return None
+    return Preflight(docker_api, str if image_lock is None else lambda image: image_lock.pin(str(image)),
+                     on_passed=on_passed)
 
-def __tag_images(images, tagged_images):
-    client = docker.from_env(timeout=int(600))
-    for image in images:
-        if "/" in image.repo:
-            images_less_repo = re.sub('^(.*?/)',"", image.repo,1)
-            client.images.get(image.repo +':' + image.tag).tag(images_less_repo +':' + image.tag)
-            tagged_images += ' ' + images_less_repo +':'+ image.tag
-        else:
-            tagged_images += ' ' + image.repo +':'+ image.tag
-    logging.info("List of Re-tagged images : "  + str(tagged_images))
-    client.close()
-    return tagged_images
+
+def __discover_and_check(discover, preflight, local_images, submit):
+    """
+    Checks the images in their registries while they are discovered, the preflight queues each image for pulling
+    once its own check passed. Images of the local daemon are not checked and are queued right away.
+    Raises PreflightError with every image that cannot be pulled once discovery and all checks are done.
+    """
+    def check(images):
+        images = list(images)
+        submit([image for image in images if str(image) in local_images])
+        preflight.submit([image for image in images if str(image) not in local_images])
+    try:
+        discover(check)
+        preflight.finish()
+    except BaseException:
+        preflight.terminate()
+        raise
+
+
+def __get_local_images(clients):
+    """
+    Lists the images of the local daemon with a single API call, without inspecting each of them.
+    :return: the RepoDigests of the images keyed by each of their repository tags
+    """
+    local_images = {}
+    with clients.client() as client:
+        for local_image in client.api.images():
+            for repo_tag in local_image.get('RepoTags') or []:
+                if repo_tag != '<none>:<none>':
+                    local_images[repo_tag] = local_image.get('RepoDigests') or []
+    logging.info('Found {0} image tag(s) in the local daemon'.format(len(local_images)))
+    return local_images
+
+
+def __is_local(image, local_images, clients, verify_digest, mirrors=None, locked_digest=None):
+    """
+    Checks if the local daemon has the image, and optionally if its digest is still the one in the registry.
+    An image with a locked digest is only used if it has that digest, without asking the registry.
+    :return: True if the image does not have to be pulled
+    """
+    repo_digests = local_images.get(str(image))
+    if repo_digests is None:
+        return False
+    if locked_digest is not None:
+        return __has_digest(repo_digests, locked_digest)
+    if not verify_digest:
+        return True
+    try:
+        with clients.client() as client:
+            digest = client.images.get_registry_data(mirror_name(str(image), mirrors)).id
+    except DockerException as e:
+        logging.warning('Could not get the registry digest of {0}, pulling it: {1}'.format(image, e))
+        return False
+    return __has_digest(repo_digests, digest)
+
+
+def __has_digest(repo_digests, digest):
+    return any(repo_digest.endswith('@' + digest) for repo_digest in repo_digests or [])
+
+
+def __get_registry_mirrors(args):
+    return dict(args.registry_mirror or [])
+
+
+def __get_docker_api(args):
+    try:
+        return DockerApi(args.docker_config, mirrors=__get_registry_mirrors(args))
+    except (EnvironmentError, ValueError, KeyError) as e:
+        logging.warning('Image sizes cannot be looked up, images are pulled in the order they are found: ' + str(e))
+        return None
+
+
+def __get_pull_leases(args):
+    lease_dir = args.pull_lease_dir
+    if not lease_dir:
+        return None
+    try:
+        return PullLeases(lease_dir, args.pull_lease_stale_after)
+    except EnvironmentError as e:
+        logging.warning('Pulls are not coordinated with other builds on this host: ' + str(e))
+        return None
+
+
+def __get_image_size(image, docker_api, local_images, sizes, image_lock=None, preflight=None):
+    """
+    Looks up the compressed size of an image in its registry manifest, the pull priority of the image.
+    The size of an image the preflight found comes from the manifest it got.
+    Images of the local daemon and images whose size cannot be looked up get 0.
+    :return: the size in bytes
+    """
+    if docker_api is None or str(image) in local_images:
+        return 0
+    name = str(image) if image_lock is None else image_lock.pin(str(image))
+    size = preflight.sizes.get(name) if preflight is not None else None
+    if size is None:
+        try:
+            size = docker_api.get_compressed_size(name)
+        except DockerError:
+            return 0
+    sizes[image] = size
+    return size
+
+
+def __pull_and_tag(image, clients, scheduler, leases, local_images, verify_digest, sizes, mirrors=None,
+                   image_lock=None, telemetry=None):
+    locked_digest = image_lock.get(image) if image_lock is not None else None
+    if __is_local(image, local_images, clients, verify_digest, mirrors, locked_digest):
+        logging.info("Using local image {0}".format(image.__str__()))
+        repo_digests = local_images[str(image)]
+    elif leases is None:
+        repo_digests = __pull(image, clients, scheduler, sizes.get(image), mirrors, locked_digest,
+                              telemetry).attrs.get('RepoDigests')
+    else:
+        repo_digests = __pull_under_lease(image, clients, scheduler, leases, sizes.get(image), mirrors, locked_digest,
+                                          telemetry).attrs.get('RepoDigests')
+    if image_lock is not None:
+        __lock_digest(image, repo_digests, image_lock, locked_digest, mirrors)
+    return __tag(image, clients)
+
+
+def __lock_digest(image, repo_digests, image_lock, locked_digest, mirrors):
+    """Records the digest an image resolved to, images without a registry digest are left out of the lock"""
+    digest = locked_digest or get_repo_digest(repo_digests, [image.repo, mirror_name(image.repo, mirrors)])
+    if digest is None:
+        logging.warning('{0} has no registry digest, it is not locked'.format(image))
+    else:
+        image_lock.set(image, digest)
+
+
+def __pull_under_lease(image, clients, scheduler, leases, size=None, mirrors=None, digest=None, telemetry=None):
+    """
+    Pulls an image while holding its host wide lease, so builds sharing the docker daemon pull it only once.
+    When another build held the lease first, the image it pulled is used if the daemon has it.
+    :return: the docker image
+    """
+    with leases.lease(str(image)) as waited:
+        docker_image = __get_from_daemon(image, clients, digest) if waited else None
+        if docker_image is not None:
+            logging.info("Using {0} pulled by another build".format(image.__str__()))
+            return docker_image
+        return __pull(image, clients, scheduler, size, mirrors, digest, telemetry)
+
+
+def __get_from_daemon(image, clients, digest=None):
+    """Returns the image from the docker daemon if it has the image with the digest, if one is given, or None"""
+    try:
+        with clients.client() as client:
+            docker_image = client.images.get(str(image))
+    except ImageNotFound:
+        return None
+    if digest is not None and not __has_digest(docker_image.attrs.get('RepoDigests'), digest):
+        return None
+    return docker_image
+
+
+def __pull(image, clients, scheduler, size=None, mirrors=None, digest=None, telemetry=None):
+    """
+    Pulls an image in a slot of its registry, retrying with a backoff when the registry throttles.
+    The predicted duration of the pull comes from the compressed size of the image and the throughput of the registry,
+    and larger images get a slot before smaller ones.
+    An image of a registry with a mirror is pulled from the mirror, and an image with a locked digest is pulled by
+    that digest, both are then tagged with their original name.
+    The progress events of the pull are recorded in the telemetry.
+    :return: the pulled docker image
+    """
+    telemetry = telemetry or PullTelemetry(None)
+    repo = mirror_name(image.repo, mirrors)
+    registry = get_registry(repo)
+    source = repo + ('@' + digest if digest else ':' + image.tag)
+    for attempt in range(_PULL_ATTEMPTS):
+        try:
+            with scheduler.slot(registry, size or 0) as pulled, telemetry.track(str(image)) as progress:
+                predicted = scheduler.predict(registry, size)
+                with clients.client() as client:
+                    logging.info("Pulling {0}{1}{2}".format(image.__str__(), '' if source == str(image) else
+                                                            ' from ' + source, __describe_pull(size, predicted)))
+                    for event in client.api.pull(repo, tag=digest or image.tag, stream=True, decode=True):
+                        if 'error' in event:
+                            raise DockerException(event['error'])
+                        progress.record(event)
+                    pulled_image = client.images.get(source)
+                    if source != str(image):
+                        pulled_image.tag(image.repo, image.tag)
+                pulled(size)
+                logging.info("Pulled {0} in {1:.1f}s{2}".format(image.__str__(), progress.seconds(),
+                                                                 __describe_pull(None, predicted, progress)))
+            return pulled_image
+        except Throttled as e:
+            if attempt + 1 == _PULL_ATTEMPTS:
+                raise
+            delay = 2 ** attempt
+            logging.warning('Pull of {0} was throttled, retrying in {1}s: {2}'.format(image, delay, e))
+            time.sleep(delay)
+
+
+def __describe_pull(size, predicted, progress=None):
+    details = []
+    if size:
+        details.append('{0:.1f} MB'.format(size / 2.0 ** 20))
+    if progress is not None and progress.throughput():
+        details.append('{0:.1f} MB downloaded at {1:.1f} MB/s'.format(progress.downloaded() / 2.0 ** 20,
+                                                                     progress.throughput() / 2.0 ** 20))
+    if predicted is not None:
+        details.append('predicted {0:.1f}s'.format(predicted))
+    return ' ({0})'.format(', '.join(details)) if details else ''
+
+
+def __tag(image, clients):
+    """Retags a pulled image without its registry and returns the name it is saved as"""
+    saved_name = __get_saved_name(image)
+    if saved_name != str(image):
+        with clients.client() as client:
+            client.images.get(image.repo + ':' + image.tag).tag(saved_name)
+    return saved_name
+
+
+def __get_saved_name(image):
+    """Returns the name an image is saved as in docker.tar, the name without its registry"""
+    if "/" not in image.repo:
+        return image.repo + ':' + image.tag
+    return re.sub('^(.*?/)', "", image.repo, 1) + ':' + image.tag
+
+
+def __get_layer_store(args):
+    if args.no_layer_store:
+        return None
+    try:
+        return LayerStore(args.layer_store_dir, args.layer_store_size * 1024 * 1024)
+    except EnvironmentError as e:
+        logging.warning('Every layer is downloaded, the layer store cannot be used: ' + str(e))
+        return None
+
+
+def __export_images_from_registry(args, docker_save_filename):
+    """
+    Writes the images of the charts to a docker save compatible archive straight from their registries,
+    without a docker daemon.
+    """
+    logging.info('Exporting the images from their registries')
+    images = sorted(__get_images(args), key=str)
+    docker_api = __get_docker_api(args)
+    if docker_api is None:
+        raise DockerError('The images cannot be exported from their registries without a docker config')
+    image_lock = get_lock(args)
+    preflight = __get_preflight(args, docker_api, image_lock)
+    if preflight is not None:
+        preflight.submit(images)
+        preflight.finish()
+    references = [str(image) if image_lock is None else image_lock.pin(str(image)) for image in images]
+    layer_store = __get_layer_store(args)
+    export = RegistryExport(docker_api, args.max_pull_concurrency, layer_store=layer_store)
+    try:
+        digests = export.export([(reference, __get_saved_name(image)) for reference, image in zip(references, images)],
+                                docker_save_filename)
+    finally:
+        if layer_store is not None:
+            layer_store.log_stats()
+    if image_lock is not None:
+        for reference, image in zip(references, images):
+            image_lock.set(image, digests[reference])
+        image_lock.save()
 
 
 def __save_images_to_tar(images, docker_save_filename):
@@ -319,9 +861,10 @@ def __save_images_to_tar(images, docker_save_filename):
 
 def create_docker_tar(args):
     logging.debug('Helm chart: ' + str(args.helm))
-    images = __get_images(args)
-    __pull_images(images)
-    tagged_images = __tag_images(images, TAGGED_IMAGES)
+    if args.export_from_registry:
+        __export_images_from_registry(args, _DOCKER_SAVE_FILENAME)
+        return _DOCKER_SAVE_FILENAME
+    tagged_images = __pull_discovered_images(lambda submit: __get_images(args, submit), TAGGED_IMAGES, args)
     __save_images_to_tar(tagged_images, _DOCKER_SAVE_FILENAME)
     return _DOCKER_SAVE_FILENAME
 
@@ -349,17 +892,10 @@ def create_source(args):
             shutil.copy(args.definitions, SOURCE + 'Definitions')
     if args.scripts:
         shutil.copytree(args.scripts, SOURCE + 'Scripts')
-    if args.helm is not None:
-        for helm in args.helm:
-            shutil.copy(helm, path_to_chart_in_source)
-    if args.helm_dir is not None:
-        for root, directories, files in os.walk(args.helm_dir):
-            for filepath in files:
-                if '.tgz' in filepath:
-                    if os.path.exists(path_to_chart_in_source + '/' + filepath):
-                        os.path.isfile(path_to_chart_in_source + '/' + filepath)
-                    else:
-                        shutil.copy(args.helm_dir + '/' + filepath, path_to_chart_in_source)
+    for chart in get_inventory(args).charts:
+        if chart.in_helm_dir and os.path.exists(path_to_chart_in_source + '/' + chart.name):
+            continue
+        shutil.copy(chart.path, path_to_chart_in_source)
     if args.scale_mapping is not None:
         shutil.copy(args.scale_mapping, path_to_chart_in_source)
 
@@ -0,0 +1,137 @@
+'''Runs the helm commands of a build'''
+
+import logging
+import threading
+import time
+from subprocess import Popen, PIPE
+
+from eric_oss_app_package_tool.generator.utils import Memo
+
+
+class HelmTimeout(EnvironmentError):
+    '''A helm command ran past its own timeout or the deadline of the build'''
+
+
+class HelmCancelled(EnvironmentError):
+    '''A helm command was cancelled because other work of the build failed'''
+
+
+class HelmRunner(object):
+    '''Runs helm commands as argument lists, without a shell, for a whole build.
+
+       Every command is killed once it runs longer than the per call timeout or past
+       the deadline of the build. The first fatal error cancels the build: running
+       commands are killed and commands started afterwards fail straight away, so a
+       broken chart does not wait for its siblings to finish rendering. The wall time
+       of every command is kept by name for the summary of the build.'''
+    def __init__(self, timeout=None, build_timeout=None):
+        self.timeout = timeout
+        self.deadline = time.time() + build_timeout if build_timeout else None
+        self.lock = threading.Lock()
+        self.processes = set()
+        self.cancelled = threading.Event()
+        self.error = None
+        self.wall_times = {}
+
+    def run(self, command, name, stdout=PIPE, parse_std_err=None):
+        '''Run a helm command.
+
+           :param command: the argument list of the command
+           :param name: the name of the chart or task the command runs for, used in messages and wall times
+           :param stdout: where the output goes, PIPE to return it
+           :param parse_std_err: called with an iterator of std err lines while the command runs, it may raise
+           :return: the output of the command if stdout is PIPE, otherwise None
+           :raises EnvironmentError: if the command fails, times out or is cancelled'''
+        if self.cancelled.is_set():
+            raise HelmCancelled('Helm command for {0} was cancelled: {1}'.format(name, self.error))
+        timeout = self.__remaining(name)
+        start = time.time()
+        process = Popen(command, stdin=PIPE, stdout=stdout, stderr=PIPE)
+        killed = []
+        timer = threading.Timer(timeout, self.__kill, [process, killed]) if timeout is not None else None
+        with self.lock:
+            self.processes.add(process)
+        if timer is not None:
+            timer.start()
+        try:
+            if stdout == PIPE:
+                output, err = process.communicate()
+                if parse_std_err is not None:
+                    parse_std_err(iter(err.splitlines()))
+            else:
+                output = None
+                try:
+                    if parse_std_err is not None:
+                        parse_std_err(iter(process.stderr.readline, b''))
+                    else:
+                        process.stderr.read()
+                finally:
+                    process.stderr.close()
+                    process.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            with self.lock:
+                self.processes.discard(process)
+            self.__record(name, time.time() - start)
+        if killed:
+            raise HelmTimeout('Helm command for {0} was killed after {1:.0f} seconds'.format(name, timeout))
+        if process.returncode != 0:
+            if self.cancelled.is_set():
+                raise HelmCancelled('Helm command for {0} was cancelled: {1}'.format(name, self.error))
+            raise EnvironmentError('Helm command for {0} exited with code {1}'.format(name, process.returncode))
+        return output
+
+    def cancel(self, error):
+        '''Cancel the build because of error, killing the helm commands that are running'''
+        with self.lock:
+            if self.cancelled.is_set():
+                return
+            self.error = error
+            self.cancelled.set()
+            processes = list(self.processes)
+        if processes:
+            logging.warning('Cancelling {0} running helm command(s): {1}'.format(len(processes), error))
+        for process in processes:
+            self.__kill(process)
+
+    def log_wall_times(self):
+        '''Log the wall time of every command, slowest first'''
+        for name, wall_time in sorted(self.wall_times.items(), key=lambda item: -item[1]):
+            logging.info('[{0}] helm ran for {1:.1f}s'.format(name, wall_time))
+
+    def __remaining(self, name):
+        if self.deadline is None:
+            return self.timeout
+        remaining = self.deadline - time.time()
+        if remaining <= 0:
+            raise HelmTimeout('Helm command for {0} was not started, the build ran out of time'.format(name))
+        return remaining if self.timeout is None else min(self.timeout, remaining)
+
+    def __record(self, name, wall_time):
+        logging.debug('[{0}] helm command took {1:.1f}s'.format(name, wall_time))
+        with self.lock:
+            self.wall_times[name] = self.wall_times.get(name, 0) + wall_time
+
+    @staticmethod
+    def __kill(process, killed=None):
+        if process.poll() is None:
+            try:
+                process.kill()
+            except OSError:
+                return
+            if killed is not None:
+                killed.append(process)
+
+
+_runners = Memo()
+
+
+def get_runner(args):
+    '''Return the helm runner of the build, its deadline starts at the first call'''
+    return _runners.get((args.helm_timeout, args.helm_build_timeout), HelmRunner)
+
+
+def clear():
+    '''Forget all runners'''
+    _runners.clear()
@@ -1,37 +1,501 @@
 import yaml
 import logging
-from utils import find_key_in_dictionary
+import os
+import re
+from contextlib import contextmanager
+from multiprocessing import Pool, cpu_count
+from yaml.events import (AliasEvent, CollectionEndEvent, CollectionStartEvent, DocumentEndEvent, DocumentStartEvent,
+                         MappingStartEvent, ScalarEvent, StreamEndEvent, StreamStartEvent)
+from yaml.nodes import ScalarNode
+
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+PARALLEL_PARSE_THRESHOLD = 8 * 1024 * 1024
+
+_STR_TAG = u'tag:yaml.org,2002:str'
+_RESOLVER = yaml.resolver.Resolver()
+_DOCUMENT_START = re.compile(r'^---(?=\s|$)', re.MULTILINE)
+_SOURCE = re.compile(r'(?:---[^\n]*\n)?(?:[ ]*(?:#[^\n]*)?\n)*?[ ]*# Source: ([^\n]*)')
+# Comments are not parser events, an image: comment with a {{ expression is found in the text
+_COMMENTED_IMAGE = re.compile(r'^[ ]*#[^\n]*image:[^\n]*{{', re.MULTILINE)
+_CHUNKS_PER_PROCESS = 4
+
+_parse_pool = None
 
 
 class HelmTemplate(object):
-    """This class contains methods for retrieving information from the rendered chart."""
+    """This class contains methods for retrieving information from the rendered chart.
+    The render is parsed once into an index of its documents by kind, metadata.name and source template,
+    so any number of questions can be asked of it without parsing it again.
+    A render written to a file is read one document at a time and documents are loaded back from the file on demand,
+    so only the index is kept in memory. Renders above the parallel parse threshold are scanned in the worker
+    processes of parse_pool while it is open, otherwise in this process."""
 
-    def __init__(self, helm_template):
+    def __init__(self, helm_template=None, parallel_parse_threshold=PARALLEL_PARSE_THRESHOLD, path=None):
         self.helm_template = helm_template
-        self.templates = self.__load_into_yaml()
+        self.path = path
+        if path is not None:
+            if os.path.getsize(path) > parallel_parse_threshold and _parse_pool is not None:
+                self.templates = scan_file_in_processes(path)
+            else:
+                self.templates = scan_file(path)
+        else:
+            stream = self.helm_template.replace('\t', ' ').rstrip()
+            if len(stream) > parallel_parse_threshold and _parse_pool is not None:
+                self.templates = scan_documents_in_processes(stream)
+            else:
+                self.templates = scan_template(stream)
+        self.__index()
+
+    def __index(self):
+        self.images = set()
+        self.by_kind = {}
+        self.by_name = {}
+        self.by_source = {}
+        for template in self.templates:
+            if template.images:
+                logging.debug("value found is: " + str(template.images))
+                self.images.update(template.images)
+            for index, value in ((self.by_kind, template.kind),
+                                 (self.by_name, template.name),
+                                 (self.by_source, template.source)):
+                if value is not None:
+                    index.setdefault(value, []).append(template)
+
+    def find(self, kind=None, name=None, source=None):
+        """
+        Returns the documents matching all of the given criteria, in the order they were rendered.
+        Only the documents indexed under the most selective criterion are visited.
+        :param kind: the kind of the document
+        :param name: the metadata.name of the document
+        :param source: the template the document was rendered from, e.g. chart/templates/deployment.yaml
+        :return: a list of ScannedDocuments
+        """
+        criteria = [(index.get(value, []), attribute, value)
+                    for index, attribute, value in ((self.by_kind, 'kind', kind),
+                                                    (self.by_name, 'name', name),
+                                                    (self.by_source, 'source', source))
+                    if value is not None]
+        if not criteria:
+            return list(self.templates)
+        candidates = min(criteria, key=lambda criterion: len(criterion[0]))[0]
+        return [template for template in candidates
+                if all(getattr(template, attribute) == value for _, attribute, value in criteria)]
+
+    def get(self, kind=None, name=None, source=None):
+        """Returns the first document matching all of the given criteria, or None"""
+        matches = self.find(kind=kind, name=name, source=source)
+        return matches[0] if matches else None
 
-    def __load_into_yaml(self):
-        return yaml.load_all(self.helm_template.decode('utf-8').replace('\t', ' ').rstrip(),
-                             Loader=yaml.SafeLoader)
+    def get_kinds(self):
+        return list(self.by_kind)
+
+    def get_sources(self):
+        return list(self.by_source)
 
     def get_all_images(self):
-        images = set()
-        for template in self.templates:
-            value = list(find_key_in_dictionary(input_key="image", wanted_type=str, dictionary=template))
-            if value:
-                logging.debug("value found is: " + str(value))
-                images.update(value)
-        logging.debug("Images are: " + str(images))
-        return images
+        logging.debug("Images are: " + str(self.images))
+        return set(self.images)
+
+    def has_images_in_scalar_values(self):
+        """Returns True if an "image:" line with a {{ template expression is embedded in a scalar value"""
+        return any(template.images_in_scalar_values for template in self.templates)
 
     def get_annotations(self, kind="ConfigMap"):
         annotations = {}
 
-        try:
-            # Get the first template of the specified "kind"
-            template = next(t for t in self.templates if t.get("kind") == kind)
-            annotations = template.get("metadata", {}).get("annotations", {})
-        except StopIteration:
+        # Get the first template of the specified "kind"
+        template = self.get(kind=kind)
+        if template is None:
             logging.warning("Annotations could not be found")
+        else:
+            annotations = template.get_annotations()
+
+        return annotations
+
+
+class ScannedDocument(object):
+    """The parts of one rendered Kubernetes document that the tool needs, collected from its parser events.
+    The whole document is only loaded when it is asked for."""
+
+    def __init__(self):
+        self.kind = None
+        self.name = None
+        self.source = None
+        self.images = []
+        self.containers = []
+        self.images_in_scalar_values = False
+        self.annotations = None
+        self.text = None
+        self.path = None
+        self.offset = 0
+        self.length = 0
+        self.index = 0
+        self.__content = None
+        self.__loaded = False
+
+    def get_annotations(self):
+        if self.annotations is None:
+            return {}
+        return yaml.load(self.annotations, Loader=SafeLoader)
+
+    def load(self):
+        """Returns the document as constructed by the safe loader"""
+        if not self.__loaded:
+            self.__content = list(yaml.load_all(self.__read(), Loader=SafeLoader))[self.index]
+            self.__loaded = True
+        return self.__content
+
+    def __read(self):
+        if self.text is not None:
+            return self.text
+        with open(self.path, 'rb') as helm_template:
+            helm_template.seek(self.offset)
+            return helm_template.read(self.length).replace('\t', ' ')
+
+
+class _Collection(object):
+    """A mapping or sequence the scanner is inside of"""
+
+    def __init__(self, is_mapping, key):
+        self.is_mapping = is_mapping
+        self.key = key
+        self.expecting_key = True
+        self.current_key = None
+        self.name = None
+        self.images = []
+
+
+def scan_documents(stream):
+    """
+    Walks the parser events of a multi-document YAML stream in a single pass and yields a ScannedDocument per
+    document, without constructing the documents. String values of "image" keys at any depth are collected in the
+    order of the document, and each of them is also recorded in containers together with the "name" of the mapping
+    it was found in, the container name for the images of a pod spec.
+    :param stream: the YAML text or a file like object
+    :return: a generator of ScannedDocuments
+    """
+    document = None
+    stack = []
+    anchors = {}
+    capture = None
+    capture_depth = 0
+    for event in yaml.parse(stream, Loader=SafeLoader):
+        if capture is not None:
+            capture.append(event)
+            if isinstance(event, CollectionStartEvent):
+                capture_depth += 1
+            elif isinstance(event, CollectionEndEvent):
+                capture_depth -= 1
+            if capture_depth == 0:
+                document.annotations = _emit(capture)
+                capture = None
+
+        if isinstance(event, DocumentStartEvent):
+            document = ScannedDocument()
+            stack = []
+            anchors = {}
+        elif isinstance(event, DocumentEndEvent):
+            yield document
+        elif isinstance(event, CollectionStartEvent):
+            parent = stack[-1] if stack else None
+            key = None
+            if parent is not None and parent.is_mapping:
+                if parent.expecting_key:
+                    parent.current_key = None
+                else:
+                    key = parent.current_key
+                    if capture is None and key == u'annotations' and _is_metadata(stack):
+                        capture = [event]
+                        capture_depth = 1
+            stack.append(_Collection(isinstance(event, MappingStartEvent), key))
+        elif isinstance(event, CollectionEndEvent):
+            collection = stack.pop()
+            document.containers.extend((collection.name, image) for image in collection.images)
+            _advance(stack)
+        elif isinstance(event, (ScalarEvent, AliasEvent)):
+            if isinstance(event, AliasEvent):
+                value = anchors.get(event.anchor)
+            else:
+                value = _str_value(event)
+                if event.anchor is not None:
+                    anchors[event.anchor] = value
+                if value is not None and u'{{' in value and u'image:' in value:
+                    document.images_in_scalar_values = True
+            parent = stack[-1] if stack else None
+            if parent is not None and parent.is_mapping:
+                if parent.expecting_key:
+                    parent.current_key = value
+                else:
+                    _scan_pair(document, stack, parent.current_key, value, event)
+            _advance(stack)
+
+
+def scan_template(stream):
+    """
+    Scans the rendered documents of a helm template one at a time and records the template each of them was
+    rendered from, as named by the "# Source:" comment helm writes after the "---" marker.
+    :param stream: the YAML text
+    :return: a list of ScannedDocuments
+    """
+    documents = []
+    for text in iter_document_texts(stream):
+        for document in _scan_text(text):
+            document.text = text
+            documents.append(document)
+    return documents
+
+
+def scan_file(path, start=0, end=None):
+    """
+    Scans the rendered documents of a helm template written to a file, reading one document at a time.
+    The documents record where they are in the file instead of their text.
+    :param path: the path to the file
+    :param start: the offset to start at, which must be at the start of a document
+    :param end: the offset to stop at, or None to read to the end of the file
+    :return: a list of ScannedDocuments
+    """
+    documents = []
+    for offset, text in iter_file_documents(path, start, end):
+        for document in _scan_text(text.replace('\t', ' ')):
+            document.path = path
+            document.offset = offset
+            document.length = len(text)
+            documents.append(document)
+    return documents
+
+
+def _scan_text(text):
+    source = _SOURCE.match(text)
+    commented_image = _COMMENTED_IMAGE.search(text) is not None
+    for index, document in enumerate(scan_documents(text)):
+        document.source = source.group(1).strip() if source else None
+        document.index = index
+        document.images_in_scalar_values = document.images_in_scalar_values or commented_image
+        yield document
+
+
+def iter_document_texts(stream):
+    """
+    Yields the text of each document of a multi-document YAML text, split at its "---" markers.
+    :param stream: the YAML text
+    :return: a generator of YAML texts
+    """
+    if stream.lstrip().startswith('%'):
+        # Directives apply to the documents that follow them, keep them together
+        yield stream
+        return
+    start = 0
+    for boundary in _DOCUMENT_START.finditer(stream):
+        if boundary.start() > start:
+            yield stream[start:boundary.start()]
+        start = boundary.start()
+    if start < len(stream):
+        yield stream[start:]
+
+
+def iter_file_documents(path, start=0, end=None):
+    """
+    Yields the offset and text of each document of a multi-document YAML file, split at its "---" markers.
+    Only one document is held in memory at a time.
+    :param path: the path to the file
+    :param start: the offset to start at
+    :param end: the offset to stop at, or None to read to the end of the file
+    :return: a generator of (offset, text) tuples
+    """
+    with open(path, 'rb') as helm_template:
+        helm_template.seek(start)
+        if start == 0 and _has_directives(helm_template):
+            # Directives apply to the documents that follow them, keep them together
+            yield 0, helm_template.read()
+            return
+        lines = []
+        document_start = position = start
+        for line in iter(helm_template.readline, b''):
+            if end is not None and position >= end:
+                break
+            if lines and _DOCUMENT_START.match(line):
+                yield document_start, b''.join(lines)
+                lines = []
+                document_start = position
+            lines.append(line)
+            position += len(line)
+        if lines:
+            yield document_start, b''.join(lines)
+
+
+def _has_directives(helm_template):
+    for line in iter(helm_template.readline, b''):
+        if line.strip():
+            helm_template.seek(0)
+            return line.lstrip().startswith('%')
+    helm_template.seek(0)
+    return False
+
+
+def split_file(path, parts):
+    """
+    Splits a multi-document YAML file into about the given number of ranges of similar size.
+    Every range starts at a "---" document marker, so each of them parses on its own into whole documents.
+    :param path: the path to the file
+    :param parts: the wanted number of parts
+    :return: a list of (start, end) offsets, the end of the last range is None
+    """
+    size = os.path.getsize(path)
+    starts = [0]
+    with open(path, 'rb') as helm_template:
+        if _has_directives(helm_template):
+            return [(0, None)]
+        for part in range(1, parts):
+            target = part * size // parts
+            if target <= starts[-1]:
+                continue
+            helm_template.seek(target)
+            helm_template.readline()
+            while True:
+                position = helm_template.tell()
+                line = helm_template.readline()
+                if not line:
+                    break
+                if _DOCUMENT_START.match(line):
+                    starts.append(position)
+                    break
+    return zip(starts, starts[1:] + [None])
+
+
+def scan_file_in_processes(path):
+    """
+    Splits a multi-document YAML file at its document boundaries and scans the ranges in the worker processes of
+    parse_pool, each of which reads its own range of the file. The documents are returned in their original order.
+    :param path: the path to the file
+    :return: a list of ScannedDocuments
+    """
+    pool = _parse_pool
+    ranges = split_file(path, cpu_count() * _CHUNKS_PER_PROCESS)
+    logging.debug("Scanning {0} in {1} parts".format(path, len(ranges)))
+    documents = []
+    for scanned in pool.map(_scan_file_range, [(path, start, end) for start, end in ranges]):
+        documents.extend(scanned)
+    return documents
+
+
+def scan_documents_in_processes(stream):
+    """
+    Splits a multi-document YAML text at its document boundaries and scans the parts in the worker processes of
+    parse_pool. The documents are returned in their original order, so the result is the same as from scan_documents.
+    :param stream: the YAML text
+    :return: a list of ScannedDocuments
+    """
+    pool = _parse_pool
+    chunks = split_documents(stream, cpu_count() * _CHUNKS_PER_PROCESS)
+    logging.debug("Scanning {0} bytes of helm template in {1} parts".format(len(stream), len(chunks)))
+    documents = []
+    for scanned in pool.map(_scan_chunk, chunks):
+        documents.extend(scanned)
+    return documents
+
+
+def split_documents(stream, parts):
+    """
+    Splits a multi-document YAML text into about the given number of parts of similar size.
+    Every part starts at a "---" document marker, so each of them parses on its own into whole documents.
+    :param stream: the YAML text
+    :param parts: the wanted number of parts
+    :return: a list of YAML texts
+    """
+    if stream.lstrip().startswith('%'):
+        # Directives apply to the documents that follow them, keep them together
+        return [stream]
+    part_size = max(len(stream) // parts, 1)
+    chunks = []
+    start = 0
+    while True:
+        boundary = _DOCUMENT_START.search(stream, start + part_size)
+        if boundary is None:
+            chunks.append(stream[start:])
+            return chunks
+        chunks.append(stream[start:boundary.start()])
+        start = boundary.start()
+
+
+@contextmanager
+def parse_pool():
+    """
+    Starts the worker processes that scan large renders, and stops them when the block is left.
+    It is entered in the main thread before any other thread starts, as forking a process with other threads copies
+    the locks they hold. On a single CPU no processes are started and renders are scanned in this process.
+    """
+    global _parse_pool
+    if cpu_count() < 2:
+        yield
+        return
+    _parse_pool = Pool(cpu_count())
+    try:
+        yield
+    finally:
+        pool, _parse_pool = _parse_pool, None
+        pool.close()
+        pool.join()
+
+
+def _scan_chunk(chunk):
+    # Runs in a worker process of parse_pool
+    return scan_template(chunk)
+
+
+def _scan_file_range(file_range):
+    # Runs in a worker process like _scan_chunk
+    return scan_file(*file_range)
+
+
+def _advance(stack):
+    if stack and stack[-1].is_mapping:
+        stack[-1].expecting_key = not stack[-1].expecting_key
+
+
+def _is_metadata(stack):
+    return len(stack) == 2 and stack[0].is_mapping and stack[1].is_mapping and stack[1].key == u'metadata'
+
+
+def _scan_pair(document, stack, key, value, event):
+    if key is None:
+        return
+    if key == u'annotations' and _is_metadata(stack) and isinstance(event, ScalarEvent):
+        document.annotations = _emit([event])
+    if value is None:
+        return
+    if key == u'image':
+        document.images.append(_native(value))
+        stack[-1].images.append(_native(value))
+    elif key == u'name':
+        stack[-1].name = _native(value)
+    if key.endswith(u'image') and u'{{' in value:
+        document.images_in_scalar_values = True
+    if len(stack) == 1 and key == u'kind':
+        document.kind = _native(value)
+    elif key == u'name' and _is_metadata(stack):
+        document.name = _native(value)
+
+
+def _emit(events):
+    # Captured events are kept as the YAML text of the annotations, which is far smaller than the events themselves
+    return yaml.emit([StreamStartEvent(), DocumentStartEvent()] + events + [DocumentEndEvent(), StreamEndEvent()],
+                     Dumper=SafeDumper)
+
+
+def _str_value(event):
+    """Returns the value of a scalar that the safe loader would construct as a string, otherwise None"""
+    tag = event.tag
+    if tag is None or tag == u'!':
+        tag = _RESOLVER.resolve(ScalarNode, event.value, event.implicit)
+    return event.value if tag == _STR_TAG else None
+
 
-        return annotations
\ No newline at end of file
+def _native(value):
+    try:
+        return str(value)
+    except UnicodeEncodeError:
+        return value
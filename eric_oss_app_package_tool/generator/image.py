@@ -16,3 +16,11 @@ class Image(object):
             return self.__str__() == other.__str__()
         else:
             return False
+
+
+def get_registry(repo):
+    """Return the registry of an image repository, docker.io if it has none"""
+    first, _, rest = repo.partition('/')
+    if rest and ('.' in first or ':' in first or first == 'localhost'):
+        return first
+    return 'docker.io'
@@ -0,0 +1,91 @@
+'''Lockfile of the manifest digests of the discovered images'''
+
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from eric_oss_app_package_tool.generator.utils import Memo
+
+
+class ImageLock(object):
+    '''The manifest digest of every image of a build, keyed by repo:tag.
+
+       A build pulls the images locked by an earlier build by their digest, so a
+       moved tag does not change what is packaged and a local image is reused
+       only if it has the locked digest. Once the pulls are done the digests of
+       all images of the build are written back, images that were not discovered
+       any more are dropped. With refresh the locked digests are not used and
+       every tag is resolved again.'''
+    def __init__(self, path, refresh=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.locked = {} if refresh else self.__read()
+        self.resolved = {}
+
+    def __read(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as lock_file:
+                return dict(json.load(lock_file)['images'])
+        except (ValueError, KeyError, TypeError) as exc:
+            raise ValueError('Invalid images lock file {0}: {1}'.format(self.path, exc))
+
+    def get(self, image):
+        '''Return the locked digest of an image, or None if it is not locked'''
+        return self.locked.get(str(image))
+
+    def pin(self, name):
+        '''Return repo@digest for a repo:tag name resolved by this build or locked by an earlier one,
+           or the name itself if it has no digest'''
+        with self.lock:
+            digest = self.resolved.get(name) or self.get(name)
+        if digest is None:
+            return name
+        return name.rpartition(':')[0] + '@' + digest
+
+    def set(self, image, digest):
+        '''Record the digest an image of this build resolved to'''
+        with self.lock:
+            self.resolved[str(image)] = digest
+
+    def save(self):
+        '''Write the digests of this build, replacing the lockfile in one step'''
+        with self.lock:
+            images = dict(self.resolved)
+        changed = sorted(name for name, digest in images.items() if self.locked.get(name) != digest)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.images-lock-')
+        with os.fdopen(handle, 'w') as lock_file:
+            json.dump({'images': images}, lock_file, indent=2, sort_keys=True, separators=(',', ': '))
+            lock_file.write('\n')
+        os.rename(temp_path, self.path)
+        logging.info('Locked the digests of {0} image(s) in {1}, {2} changed'.format(
+            len(images), self.path, len(changed)))
+
+
+_locks = Memo()
+
+
+def get_lock(args):
+    '''Return the images lock of the build, or None if it has no lockfile'''
+    path = args.images_lock
+    if not path:
+        return None
+    return _locks.get((path, args.refresh_lock), ImageLock)
+
+
+def clear():
+    '''Forget all locks'''
+    _locks.clear()
+
+
+def get_repo_digest(repo_digests, repos):
+    '''Return the digest in the RepoDigests of a docker image of the first of the repos it has one of, or None'''
+    digests = dict(repo_digest.split('@', 1) for repo_digest in repo_digests or [] if '@' in repo_digest)
+    for repo in repos:
+        if repo in digests:
+            return digests[repo]
+    return None
@@ -0,0 +1,101 @@
+'''Pipeline from image discovery to pulling'''
+
+import itertools
+import sys
+import threading
+from multiprocessing.pool import ThreadPool
+from Queue import PriorityQueue
+
+# Priorities of the images submitted together are looked up by this many threads
+_PRIORITY_LOOKUPS = 16
+
+
+class _Result(object):
+    '''The outcome of processing one image'''
+    def __init__(self):
+        self.value = None
+        self.error = None
+
+
+class ImagePipeline(object):
+    '''Processes images in a pool of workers as soon as they are discovered.
+
+       Discovery submits the images of every chart while the other charts are
+       still rendering, each image is processed once however often it is submitted,
+       and finish waits for the work of all of them. Queued images with the
+       highest priority are processed first, so the longest pulls start early and
+       do not hold up the end of the build. The priorities of the images submitted
+       together are all looked up before any of them is queued.'''
+    def __init__(self, workers, process, priority=None):
+        self.process = process
+        self.priority = priority
+        self.lock = threading.Lock()
+        self.submitted = set()
+        self.results = []
+        self.queue = PriorityQueue()
+        self.order = itertools.count()
+        self.stopped = threading.Event()
+        self.workers = [threading.Thread(target=self.__work) for _ in range(workers)]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+
+    def submit(self, images):
+        '''Queue the images which were not submitted before, the highest priority first'''
+        queued = []
+        with self.lock:
+            for image in images:
+                if image in self.submitted:
+                    continue
+                self.submitted.add(image)
+                result = _Result()
+                self.results.append(result)
+                queued.append((image, result))
+        priorities = self.__priorities([image for image, _ in queued])
+        for priority, order, image, result in sorted((-priority, next(self.order), image, result)
+                                                     for priority, (image, result) in zip(priorities, queued)):
+            self.queue.put((priority, order, image, result))
+
+    def __priorities(self, images):
+        if self.priority is None:
+            return [0] * len(images)
+        if len(images) < 2:
+            return [self.priority(image) for image in images]
+        pool = ThreadPool(min(len(images), _PRIORITY_LOOKUPS))
+        try:
+            return pool.map(self.priority, images)
+        finally:
+            pool.close()
+            pool.join()
+
+    def finish(self):
+        '''Wait for all submitted images and return their results in the order they were submitted'''
+        self.__stop()
+        for result in self.results:
+            if result.error is not None:
+                raise result.error[0], result.error[1], result.error[2]
+        return [result.value for result in self.results]
+
+    def terminate(self):
+        '''Stop without processing the images that are still queued'''
+        self.stopped.set()
+        self.__stop()
+
+    def __stop(self):
+        for _ in self.workers:
+            # Sentinels sort after every image
+            self.queue.put((float('inf'), None, None, None))
+        for worker in self.workers:
+            worker.join()
+
+    def __work(self):
+        while True:
+            _, _, image, result = self.queue.get()
+            if result is None:
+                return
+            if self.stopped.is_set():
+                continue
+            try:
+                result.value = self.process(image)
+            except Exception:
+                result.error = sys.exc_info()
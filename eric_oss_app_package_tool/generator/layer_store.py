@@ -0,0 +1,138 @@
+'''Persistent store of image layers'''
+
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+DEFAULT_STORE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'eric-oss-app-package-tool', 'layers')
+DEFAULT_STORE_SIZE_MB = 10240
+
+_TMP_SUFFIX = '.tmp'
+# Temporary files of builds that died while writing to the store are removed after this many seconds
+_STALE_TMP = 3600
+
+
+def _file_digest(path):
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as blob:
+        for chunk in iter(lambda: blob.read(1024 * 1024), b''):
+            checksum.update(chunk)
+    return 'sha256:' + checksum.hexdigest()
+
+
+class LayerStore(object):
+    '''Content addressed store of the layer and config blobs of images, keyed by their digest.
+
+       Builds on one host can share the store: blobs are written to a temporary
+       file and renamed into place, and a blob is handed out as a hard link, which
+       stays readable when another build evicts the blob. Every blob handed out is
+       verified against its digest first, a corrupt blob is removed and counts as
+       a miss. The modification time of a blob is bumped on every hit, so eviction
+       of the oldest blobs above the size cap is least recently used first.'''
+    def __init__(self, store_dir, max_size):
+        self.store_dir = store_dir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+        try:
+            os.makedirs(store_dir)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+    def _path(self, digest):
+        return os.path.join(self.store_dir, digest.replace(':', '-'))
+
+    def fetch(self, digest, target):
+        '''Put the stored blob at the target path, return False on a miss'''
+        path = self._path(digest)
+        try:
+            self.__link_or_copy(path, target)
+            os.utime(path, None)
+        except (IOError, OSError):
+            self.__count(False)
+            return False
+        if _file_digest(target) != digest:
+            logging.warning('Removing corrupt blob {0} from the layer store'.format(digest))
+            for corrupt in (path, target):
+                try:
+                    os.remove(corrupt)
+                except OSError:
+                    pass
+            self.__count(False)
+            return False
+        self.__count(True, os.path.getsize(target))
+        return True
+
+    def put(self, digest, path):
+        '''Store the verified blob at path, evicting old blobs if the store grows above its size cap'''
+        handle, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix=_TMP_SUFFIX)
+        os.close(handle)
+        try:
+            os.remove(tmp_path)
+            self.__link_or_copy(path, tmp_path)
+            os.rename(tmp_path, self._path(digest))
+        except (IOError, OSError):
+            logging.warning('Could not write {0} to the layer store'.format(digest), exc_info=True)
+            return
+        finally:
+            # rename does nothing if the blob is already stored as a link to the same file
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+
+    @staticmethod
+    def __link_or_copy(source, target):
+        try:
+            os.link(source, target)
+        except OSError as exc:
+            if exc.errno != errno.EXDEV:
+                raise
+            shutil.copyfile(source, target)
+
+    def __count(self, hit, size=0):
+        with self.lock:
+            if hit:
+                self.hits += 1
+                self.hit_bytes += size
+            else:
+                self.misses += 1
+
+    def log_stats(self):
+        '''Log the hits and misses of this build'''
+        logging.info('Layer store: {0} hit(s), {1:.1f} MB not downloaded, {2} miss(es)'.format(
+            self.hits, self.hit_bytes / 2.0 ** 20, self.misses))
+
+    def evict(self):
+        '''Remove the least recently used blobs until the store fits in its size cap'''
+        with self.lock:
+            entries = []
+            for filename in os.listdir(self.store_dir):
+                path = os.path.join(self.store_dir, filename)
+                try:
+                    stat = os.stat(path)
+                    if filename.endswith(_TMP_SUFFIX):
+                        if time.time() - stat.st_mtime > _STALE_TMP:
+                            os.remove(path)
+                        continue
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                    logging.debug('Evicted %s from the layer store', path)
+                except OSError:
+                    pass
+                total_size -= size
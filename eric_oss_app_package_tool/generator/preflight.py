@@ -0,0 +1,89 @@
+'''Check that every image exists in its registry before pulling it'''
+
+import logging
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from docker_api import DockerError
+
+PREFLIGHT_CONCURRENCY = 32
+
+_PROBLEMS = {401: 'unauthorised', 403: 'unauthorised', 404: 'missing'}
+
+
+class PreflightError(DockerError):
+    '''Images are missing from their registry or may not be pulled'''
+    def __init__(self, problems):
+        self.problems = problems
+        super(PreflightError, self).__init__('{0} image(s) cannot be pulled:\n{1}'.format(
+            len(problems), '\n'.join('  {0}: {1}'.format(name, problem) for name, problem in sorted(problems.items()))))
+
+
+class Preflight(object):
+    '''Gets the manifest of every image as soon as it is submitted, all of them at the same time.
+
+       finish fails with the full list of the images that are missing or that the
+       credentials of the docker config may not pull. An image whose check could
+       not be done is left to its pull: the registry did not answer, or refused
+       an anonymous check because the docker config has no credentials for it,
+       which the docker daemon may still get from a credential helper. The
+       compressed sizes of the images found are kept in sizes by image name, so
+       their pulls are ordered without getting the manifests again.
+       on_passed is called with each image whose check passed, or was left to
+       its pull, until the check of any image fails.'''
+    def __init__(self, docker_api, name=str, concurrency=PREFLIGHT_CONCURRENCY, on_passed=None):
+        self.docker_api = docker_api
+        self.name = name
+        self.on_passed = on_passed
+        self.failed = False
+        self.pool = ThreadPool(concurrency)
+        self.lock = threading.Lock()
+        self.checks = {}
+        self.sizes = {}
+        self.start = time.time()
+
+    def submit(self, images):
+        '''Check the images which were not submitted before'''
+        for image in images:
+            name = self.name(image)
+            with self.lock:
+                if name in self.checks:
+                    continue
+                self.checks[name] = self.pool.apply_async(self.__check, (image, name))
+
+    def __check(self, image, name):
+        problem = self.__problem(name)
+        if problem is not None:
+            self.failed = True
+        elif self.on_passed is not None and not self.failed:
+            self.on_passed([image])
+        return problem
+
+    def __problem(self, name):
+        try:
+            status, size = self.docker_api.check_manifest(name)
+            if size is not None:
+                self.sizes[name] = size
+            if status in (401, 403) and not self.docker_api.has_credentials(name):
+                logging.info('Could not check {0} before pulling it, the docker config has no credentials for its '
+                             'registry'.format(name))
+                return None
+            return _PROBLEMS.get(status)
+        except DockerError as exc:
+            logging.warning('Could not check {0} before pulling it: {1}'.format(name, exc))
+            return None
+
+    def finish(self):
+        '''Wait for the checks of all submitted images, raise PreflightError if any image cannot be pulled'''
+        self.pool.close()
+        self.pool.join()
+        problems = dict((name, check.get()) for name, check in self.checks.items() if check.get() is not None)
+        if problems:
+            raise PreflightError(problems)
+        logging.info('Checked {0} image(s) in their registries in {1:.1f}s'.format(
+            len(self.checks), time.time() - self.start))
+
+    def terminate(self):
+        '''Stop without waiting for the checks'''
+        self.pool.terminate()
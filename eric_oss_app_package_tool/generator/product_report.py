@@ -4,14 +4,16 @@
 import sys
 import os
 import logging
-from subprocess import check_output, CalledProcessError
 from collections import OrderedDict
 import re
 import yaml
 
+from eric_oss_app_package_tool.generator.helm_runner import get_runner
 from eric_oss_app_package_tool.generator.helm_template import HelmTemplate
-from eric_oss_app_package_tool.generator.generate import get_charts
+from eric_oss_app_package_tool.generator.generate import get_charts, get_helm_templates
 from eric_oss_app_package_tool.generator.docker_api import DockerApi, DockerError
+from eric_oss_app_package_tool.generator.image_lock import get_lock
+from eric_oss_app_package_tool.generator.render_registry import REGISTRY
 from eric_oss_app_package_tool.generator.utils import extract, list_item
 
 logging.getLogger("urllib3").setLevel(logging.WARNING)
@@ -102,13 +104,14 @@ class ImageData(ProductInfo):
 # pylint: disable=too-many-instance-attributes, too-many-arguments
 class HelmChart(object):
     '''Helm Chart'''
-    def __init__(self, helmdir, parent, package, args, include_report=False):
+    def __init__(self, helmdir, parent, package, args, include_report=False, archive=None):
         self.path = os.path.join(parent, package)
         self.data = HelmData(package=package, path=self.path)
         self.helmdir = helmdir
+        self.archive = archive
         self.include_report = include_report
         self.args = args
-        self.docker_api = DockerApi(args.docker_config)
+        self.docker_api = DockerApi(args.docker_config, mirrors=dict(args.registry_mirror or []))
 
         self.images = []
         self.packages = []
@@ -167,8 +170,9 @@ class HelmChart(object):
         '''Extract Product information from a Docker image'''
         labels = {}
 
+        image_lock = get_lock(self.args)
         try:
-            labels = self.docker_api.get_labels(image_name)
+            labels = self.docker_api.get_labels(image_name if image_lock is None else image_lock.pin(image_name))
         except DockerError as exc:
             self.errors.append(exc.message)
 
@@ -226,30 +230,37 @@ class HelmChart(object):
         return eric_info_data
 
     def _get_annotations(self):
-        '''Get annotations'''
-        if self.template:
-            return self.template.get_annotations()
+        '''Get annotations of the first Helm template'''
+        if self.templates:
+            return self.templates[0].get_annotations()
         return {}
 
     def _get_images_from_helm_template(self):
-        '''Return list of images from Helm template'''
-        if self.template:
-            return self.template.get_all_images()
-        return []
+        '''Return the images of the Helm templates of every values profile'''
+        return set().union(*[template.get_all_images() for template in self.templates])
 
     def _get_helm_template(self):
-        '''Parse Helm template YAML'''
-        helm_command = "helm3" if self.args.helm3 else "helm"
-        helm_options = "--debug" if self.args.helm_debug else ""
-
+        '''Parse Helm template YAML, reusing the renders of image discovery in every values profile for chart
+           archives'''
         try:
-            helm_output = check_output("{} template {} {}".format(helm_command,
-                                                                  helm_options,
-                                                                  self.helmdir).split())
-            self.template = HelmTemplate(helm_output)
-        except CalledProcessError:
+            if self.archive:
+                self.templates = get_helm_templates(self.archive, self.args)
+            else:
+                self.templates = [REGISTRY.get((self.helmdir, self.args.helm3, self.args.helm_debug),
+                                               self._render_helm_dir)]
+        except EnvironmentError:
             self.errors.append("Cannot get Helm template for: {}".format(self.path))
-            self.template = None
+            self.templates = []
+
+    def _render_helm_dir(self):
+        '''Render the extracted chart directory'''
+        helm_command = ["helm3" if self.args.helm3 else "helm", "template"]
+        if self.args.helm_debug:
+            helm_command.append("--debug")
+        helm_command.append(self.helmdir)
+
+        helm_output = get_runner(self.args).run(helm_command, self.path)
+        return HelmTemplate(helm_output, self.args.parallel_parse_threshold * 1024 * 1024)
 
     def _extract_chart_data(self):
         '''Return Helm chart metadata as dictionaries'''
@@ -465,7 +476,8 @@ def create_product_report(args):
                              "",
                              os.path.basename(chart),
                              args=args,
-                             include_report=True)
+                             include_report=True,
+                             archive=chart)
             packages, images = helm.get_components()
             output["includes"]["packages"] = packages
             output["includes"]["images"] = images
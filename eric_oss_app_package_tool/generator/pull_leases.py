@@ -0,0 +1,139 @@
+'''Host wide leases on image pulls'''
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_LEASE_DIR = '/tmp/eric-oss-app-package-tool/pull-leases'
+DEFAULT_STALE_AFTER = 120
+
+_LEASE_SUFFIX = '.lease'
+
+
+def _make_shared_dirs(path):
+    '''Create a directory and its missing parents writable by every user, with the sticky bit as on /tmp,
+       so that the builds of all users on the host can share it'''
+    if not path or os.path.isdir(path):
+        return
+    _make_shared_dirs(os.path.dirname(path))
+    try:
+        os.mkdir(path)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+        return
+    # mkdir applies the umask of the user that happens to create the directory
+    os.chmod(path, 0o1777)
+
+
+class PullLeases(object):
+    '''Leases on the images being pulled, shared by all builds on a host through a directory.
+
+       A build creates the lease file of an image before pulling it and removes it
+       afterwards. A build that finds the lease of another build waits for it to go
+       away and then reuses the image, which the other build pulled into the same
+       docker daemon. The holder touches its lease files while it pulls, so a lease
+       that has not been touched for stale_after seconds belongs to a build that
+       died, and it is removed by whichever build finds it. A build that cannot
+       create or remove a lease pulls without one.'''
+    def __init__(self, lease_dir, stale_after=DEFAULT_STALE_AFTER, poll_interval=1.0):
+        self.lease_dir = lease_dir
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self.owner = json.dumps({'host': socket.gethostname(), 'pid': os.getpid()})
+        self.lock = threading.Lock()
+        self.held = set()
+        self.heartbeat = None
+        _make_shared_dirs(lease_dir)
+
+    def _path(self, name):
+        return os.path.join(self.lease_dir, hashlib.sha256(name).hexdigest() + _LEASE_SUFFIX)
+
+    @contextmanager
+    def lease(self, name):
+        '''Hold the lease of name, waiting while another build holds it.
+           Yields True if another build held the lease first, so the image may already be there.'''
+        path = self._path(name)
+        waited = False
+        try:
+            while not self.__create(path):
+                if not waited:
+                    logging.info('Waiting for another build to pull {0}'.format(name))
+                    waited = True
+                self.__remove_if_stale(path)
+                time.sleep(self.poll_interval)
+        except OSError as exc:
+            logging.warning('Pulling {0} without coordinating with other builds: {1}'.format(name, exc))
+            yield waited
+            return
+        with self.lock:
+            self.held.add(path)
+            self.__start_heartbeat()
+        try:
+            yield waited
+        finally:
+            with self.lock:
+                self.held.discard(path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __create(self, path):
+        try:
+            handle = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except OSError as exc:
+            if exc.errno == errno.EEXIST:
+                return False
+            raise
+        with os.fdopen(handle, 'w') as lease:
+            lease.write(self.owner)
+        return True
+
+    def __is_stale(self, path):
+        return time.time() - os.stat(path).st_mtime > self.stale_after
+
+    def __remove_if_stale(self, path):
+        '''Remove a stale lease without ever removing a lease that another build has just created'''
+        try:
+            if not self.__is_stale(path):
+                return
+            claimed = '{0}.{1}.{2}.stale'.format(path, socket.gethostname(), os.getpid())
+            os.rename(path, claimed)
+        except OSError as exc:
+            if exc.errno == errno.ENOENT:
+                # The lease went away in the meantime
+                return
+            raise
+        if self.__is_stale(claimed):
+            logging.warning('Removing stale pull lease {0}'.format(path))
+        else:
+            # Another build replaced the stale lease after it was checked, put its lease back
+            try:
+                os.link(claimed, path)
+            except OSError:
+                pass
+        os.remove(claimed)
+
+    def __start_heartbeat(self):
+        if self.heartbeat is None:
+            self.heartbeat = threading.Thread(target=self.__beat)
+            self.heartbeat.daemon = True
+            self.heartbeat.start()
+
+    def __beat(self):
+        while True:
+            time.sleep(self.stale_after / 4.0)
+            with self.lock:
+                held = list(self.held)
+            for path in held:
+                try:
+                    os.utime(path, None)
+                except OSError:
+                    pass
@@ -0,0 +1,208 @@
+'''Per registry concurrency of image pulls'''
+
+import heapq
+import itertools
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_CONCURRENCY = 16
+
+# Share of the best observed aggregate throughput of a registry below which the registry is considered saturated
+_SATURATION = 0.5
+_SMOOTHING = 0.3
+# Pulls of fewer bytes are bound by latency rather than by the bandwidth of the registry
+_MIN_SIZE = 16 * 2 ** 20
+# The best aggregate throughput is halved every this many seconds, so a limit that was cut grows again
+_BEST_HALF_LIFE = 60.0
+_THROTTLED = re.compile(r'toomanyrequests|too many requests|unexpected http status: 5\d\d|'
+                        r'\b50[0-4] (internal server error|bad gateway|service unavailable|gateway timeout)',
+                        re.IGNORECASE)
+
+
+class Throttled(Exception):
+    '''The registry answered a pull with 429 or a server error'''
+
+
+def is_throttled(error):
+    '''Return True if a pull error is a 429 or 5xx response of the registry'''
+    response = getattr(error, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+    if status_code == 429:
+        return True
+    return _THROTTLED.search(str(error)) is not None
+
+
+def _smooth(average, value):
+    return value if average is None else _SMOOTHING * value + (1 - _SMOOTHING) * average
+
+
+class AdaptiveLimit(object):
+    '''The number of pulls allowed to run at the same time against one registry.
+
+       The limit follows the aggregate throughput of the registry, the bytes per
+       second of all its pulls together: it grows by one while the aggregate
+       throughput is still close to the best one seen, and is halved when it
+       drops below half of that, or when the registry throttles with 429 or fails
+       with 5xx. Pulls of small images are bound by latency, they may grow the
+       limit but never shrink it. The best throughput decays over time and starts
+       over from the latest pull after a cut, so a limit that was cut grows again.
+       A fixed limit is never changed. Pulls waiting for a slot get it in the
+       order of their priority, the highest first.'''
+    def __init__(self, registry, initial, maximum, fixed=False):
+        self.registry = registry
+        self.limit = min(initial, maximum)
+        self.maximum = maximum
+        self.fixed = fixed
+        self.active = 0
+        self.best_throughput = None
+        self.throughput = None
+        self.pull_throughput = None
+        self.peak = self.limit
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.order = itertools.count()
+        self.busy_seconds = 0.0
+        self.ticked = time.time()
+        self.recorded = None
+
+    def acquire(self, priority=0):
+        with self.condition:
+            waiter = (-priority, next(self.order))
+            heapq.heappush(self.waiting, waiter)
+            while self.active >= self.limit or self.waiting[0] != waiter:
+                self.condition.wait()
+            heapq.heappop(self.waiting)
+            self.__tick()
+            self.active += 1
+            # The next waiter may take a slot that is still free
+            self.condition.notify_all()
+
+    def release(self):
+        with self.condition:
+            self.__tick()
+            self.active -= 1
+            self.condition.notify_all()
+
+    def busy(self):
+        '''Return the seconds of all pulls in a slot so far, the integral of the active pulls over time'''
+        with self.condition:
+            self.__tick()
+            return self.busy_seconds
+
+    def __tick(self):
+        now = time.time()
+        self.busy_seconds += self.active * (now - self.ticked)
+        self.ticked = now
+
+    def record(self, size, duration, concurrency=1.0):
+        '''Record a successful pull of size bytes, which ran alongside concurrency pulls on average, itself included'''
+        if not size or duration <= 0:
+            return
+        with self.condition:
+            if size < _MIN_SIZE:
+                if self.active >= self.limit:
+                    self.__set(min(self.maximum, self.limit + 1), 'small images pulling in every slot')
+                return
+            self.pull_throughput = _smooth(self.pull_throughput, float(size) / duration)
+            throughput = float(size) / duration * max(1.0, concurrency)
+            self.throughput = _smooth(self.throughput, throughput)
+            self.__decay()
+            if self.best_throughput is None or throughput > self.best_throughput:
+                self.best_throughput = throughput
+            if self.throughput < _SATURATION * self.best_throughput:
+                self.__set(max(1, self.limit // 2), 'throughput fell to {0:.1f} MB/s'.format(self.throughput / 2 ** 20))
+                # Fewer pulls bring less aggregate throughput, the next cut needs a drop below the latest pull
+                self.best_throughput = throughput
+                self.throughput = None
+            elif self.active >= self.limit:
+                self.__set(min(self.maximum, self.limit + 1),
+                           'throughput {0:.1f} MB/s'.format(self.throughput / 2 ** 20))
+
+    def __decay(self):
+        now = time.time()
+        if self.recorded is not None and self.best_throughput is not None:
+            self.best_throughput *= 0.5 ** ((now - self.recorded) / _BEST_HALF_LIFE)
+        self.recorded = now
+
+    def throttle(self, error):
+        '''Record a pull the registry throttled or failed'''
+        with self.condition:
+            self.__set(max(1, self.limit // 2), 'registry answered {0}'.format(error))
+
+    def __set(self, limit, reason):
+        if self.fixed or limit == self.limit:
+            return
+        logging.info('Pull concurrency for {0}: {1} -> {2} ({3})'.format(self.registry, self.limit, limit, reason))
+        self.limit = limit
+        self.peak = max(self.peak, limit)
+        self.condition.notify_all()
+
+
+class PullScheduler(object):
+    '''Hands out pull slots per registry, each registry with its own AdaptiveLimit'''
+    def __init__(self, initial=DEFAULT_CONCURRENCY, maximum=DEFAULT_MAX_CONCURRENCY, fixed_limits=None):
+        self.initial = initial
+        self.maximum = maximum
+        self.fixed_limits = dict(fixed_limits or {})
+        self.lock = threading.Lock()
+        self.limits = {}
+
+    def get_limit(self, registry):
+        with self.lock:
+            limit = self.limits.get(registry)
+            if limit is None:
+                if registry in self.fixed_limits:
+                    fixed = self.fixed_limits[registry]
+                    limit = AdaptiveLimit(registry, fixed, fixed, fixed=True)
+                else:
+                    limit = AdaptiveLimit(registry, self.initial, self.maximum)
+                self.limits[registry] = limit
+                logging.info('Pull concurrency for {0} starts at {1}{2}'.format(
+                    registry, limit.limit, ' (fixed)' if limit.fixed else ', at most {0}'.format(limit.maximum)))
+            return limit
+
+    def workers(self):
+        '''Return the number of pull workers needed to fill the slots of one registry without a fixed limit
+           and of every registry with a fixed limit'''
+        return self.maximum + sum(self.fixed_limits.values())
+
+    @contextmanager
+    def slot(self, registry, priority=0):
+        '''Hold a pull slot of the registry while pulling, pulls with a higher priority get a slot first.
+           The caller reports the size of the pulled image through the yielded function.'''
+        limit = self.get_limit(registry)
+        limit.acquire(priority)
+        start = time.time()
+        busy = limit.busy()
+        pulled = []
+        try:
+            yield pulled.append
+        except Exception as e:
+            if is_throttled(e):
+                limit.throttle(e)
+                raise Throttled(str(e))
+            raise
+        else:
+            duration = time.time() - start
+            concurrency = (limit.busy() - busy) / duration if duration > 0 else 1.0
+            limit.record(pulled[0] if pulled else None, duration, concurrency)
+        finally:
+            limit.release()
+
+    def predict(self, registry, size):
+        '''Return the predicted duration in seconds of pulling size bytes from the registry, or None if unknown'''
+        with self.lock:
+            limit = self.limits.get(registry)
+        throughput = limit and limit.pull_throughput
+        if not size or not throughput:
+            return None
+        return size / throughput
+
+    def log_levels(self):
+        '''Log the concurrency every registry ended with'''
+        for registry, limit in sorted(self.limits.items()):
+            logging.info('Pull concurrency for {0} ended at {1}, peak {2}'.format(registry, limit.limit, limit.peak))
@@ -0,0 +1,166 @@
+'''Progress and throughput of image pulls'''
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+DEFAULT_PROGRESS_INTERVAL = 30
+
+_MB = 2.0 ** 20
+
+
+def _throughput(size, seconds):
+    return size / seconds if size and seconds else None
+
+
+class LayerProgress(object):
+    '''The download of one layer of an image'''
+    def __init__(self, layer):
+        self.layer = layer
+        self.size = 0
+        self.current = 0
+        self.start = None
+        self.end = None
+        self.cached = False
+
+    def downloaded(self):
+        return self.size if self.end is not None else self.current
+
+    def summary(self):
+        seconds = self.end - self.start if self.start is not None and self.end is not None else None
+        return OrderedDict([('layer', self.layer), ('cached', self.cached), ('bytes', self.downloaded()),
+                            ('seconds', seconds), ('throughput', _throughput(self.downloaded(), seconds))])
+
+
+class ImageProgress(object):
+    '''The progress of the pull of one image, fed with the events the docker daemon streams while pulling'''
+    def __init__(self, name):
+        self.name = name
+        self.layers = OrderedDict()
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.end = None
+
+    def record(self, event):
+        '''Record a progress event of the pull, events without a layer are ignored'''
+        status = event.get('status', '')
+        layer_id = event.get('id')
+        if not layer_id or status.startswith('Pulling from'):
+            return
+        now = time.time()
+        with self.lock:
+            layer = self.layers.get(layer_id)
+            if layer is None:
+                layer = self.layers[layer_id] = LayerProgress(layer_id)
+            if status == 'Already exists':
+                layer.cached = True
+            elif status == 'Downloading':
+                detail = event.get('progressDetail') or {}
+                if layer.start is None:
+                    layer.start = now
+                layer.current = detail.get('current', layer.current)
+                layer.size = detail.get('total', layer.size)
+            elif status in ('Download complete', 'Pull complete') and layer.end is None and layer.start is not None:
+                layer.end = now
+
+    def downloaded(self):
+        '''Return the number of bytes downloaded so far'''
+        with self.lock:
+            return sum(layer.downloaded() for layer in self.layers.values())
+
+    def seconds(self):
+        return (self.end or time.time()) - self.start
+
+    def throughput(self):
+        '''Return the bytes downloaded per second, or None if nothing was downloaded'''
+        return _throughput(self.downloaded(), self.seconds())
+
+    def summary(self):
+        with self.lock:
+            layers = [layer.summary() for layer in self.layers.values()]
+        downloaded = sum(layer['bytes'] for layer in layers)
+        return OrderedDict([('image', self.name), ('bytes', downloaded), ('seconds', self.seconds()),
+                            ('throughput', _throughput(downloaded, self.seconds())),
+                            ('cached_layers', sum(1 for layer in layers if layer['cached'])),
+                            ('layers', layers)])
+
+
+class PullTelemetry(object):
+    '''Collects the progress of all pulls of a build.
+
+       A line with the aggregate progress of the pulls is logged every interval
+       seconds while they run, and the bytes, duration and throughput of every
+       image and layer can be written as JSON once they are done.'''
+    def __init__(self, interval=DEFAULT_PROGRESS_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.active = []
+        self.finished = []
+        self.start = time.time()
+        self.stopped = threading.Event()
+        self.reporter = None
+
+    @contextmanager
+    def track(self, name):
+        '''Track the pull of an image, the yielded ImageProgress is fed with its events.
+           The progress of a pull that fails is dropped.'''
+        progress = ImageProgress(name)
+        with self.lock:
+            self.active.append(progress)
+            self.__start_reporter()
+        try:
+            yield progress
+            progress.end = time.time()
+        finally:
+            with self.lock:
+                self.active.remove(progress)
+                if progress.end is not None:
+                    self.finished.append(progress)
+
+    def __start_reporter(self):
+        if self.reporter is None and self.interval:
+            self.reporter = threading.Thread(target=self.__report)
+            self.reporter.daemon = True
+            self.reporter.start()
+
+    def __report(self):
+        last = 0
+        while not self.stopped.wait(self.interval):
+            downloaded = self.downloaded()
+            with self.lock:
+                active = len(self.active)
+                finished = len(self.finished)
+            logging.info('Pull progress: {0} image(s) pulling, {1} pulled, {2:.1f} MB downloaded, '
+                         '{3:.1f} MB/s over the last {4}s'.format(active, finished, downloaded / _MB,
+                                                                   max(0, downloaded - last) / _MB / self.interval,
+                                                                   self.interval))
+            last = downloaded
+
+    def downloaded(self):
+        '''Return the number of bytes downloaded by all pulls so far'''
+        with self.lock:
+            progresses = self.active + self.finished
+        return sum(progress.downloaded() for progress in progresses)
+
+    def stop(self):
+        '''Stop logging the progress'''
+        self.stopped.set()
+
+    def summary(self):
+        '''Return the bytes, duration and throughput of the build and of each pulled image and its layers'''
+        with self.lock:
+            finished = list(self.finished)
+        images = [progress.summary() for progress in finished]
+        downloaded = sum(image['bytes'] for image in images)
+        seconds = time.time() - self.start
+        return OrderedDict([('bytes', downloaded), ('seconds', seconds),
+                            ('throughput', _throughput(downloaded, seconds)), ('images', images)])
+
+    def write(self, path):
+        '''Write the summary as JSON'''
+        with open(path, 'w') as summary_file:
+            json.dump(self.summary(), summary_file, indent=2, separators=(',', ': '))
+        logging.info('Wrote the pull summary to {0}'.format(path))
@@ -0,0 +1,174 @@
+'''docker save compatible archives of images downloaded straight from their registries'''
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
+
+from docker_api import DockerError
+
+DEFAULT_DOWNLOADS = 8
+
+_BLOB_DIR = 'blobs/sha256/'
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def _blob_name(digest):
+    return _BLOB_DIR + digest.split(':', 1)[1]
+
+
+def _staged(staging_dir, digest):
+    return os.path.join(staging_dir, digest.split(':', 1)[1])
+
+
+def _unpack(source, diff_id):
+    '''Yield the uncompressed tar of a layer blob in chunks, verifying it against the diff_id of the image config
+       once all of it is read'''
+    with open(source, 'rb') as blob:
+        magic = blob.read(4)
+    if magic.startswith(_ZSTD_MAGIC):
+        raise DockerError('Layer {0} is zstd compressed, which cannot be exported without docker'.format(diff_id))
+    checksum = hashlib.sha256()
+    layer = gzip.open(source, 'rb') if magic.startswith(_GZIP_MAGIC) else open(source, 'rb')
+    try:
+        for chunk in iter(lambda: layer.read(1024 * 1024), b''):
+            checksum.update(chunk)
+            yield chunk
+    finally:
+        layer.close()
+    if 'sha256:' + checksum.hexdigest() != diff_id:
+        raise DockerError('Uncompressed layer has the digest sha256:{0} instead of {1}'.format(
+            checksum.hexdigest(), diff_id))
+
+
+class RegistryExport(object):
+    '''Writes images to a docker save compatible archive without a docker daemon.
+
+       The manifests of all images are fetched first, then their config and
+       layer blobs are downloaded concurrently into a staging directory, each
+       blob once however many images share it, and verified against their
+       digest. The layers are uncompressed straight into the archive and
+       verified against the diff_ids of the image configs while they are
+       written, so no uncompressed copy is staged. As in the archives of docker
+       save since docker 25, the
+       configs and the layer tars are under blobs/sha256, named by their digest,
+       with a manifest.json listing the RepoTags the images are saved as and a
+       repositories file naming the top layer of each tag. Blobs in the layer
+       store, if one is given, are not downloaded, and downloaded blobs are added
+       to it, compressed as they are in the registry.'''
+    def __init__(self, docker_api, downloads=DEFAULT_DOWNLOADS, staging_dir=None, layer_store=None):
+        self.docker_api = docker_api
+        self.downloads = downloads
+        self.staging_dir = staging_dir
+        self.layer_store = layer_store
+
+    def export(self, images, archive_path):
+        '''Write the images to the archive.
+           :param images: (reference, saved name) pairs, the reference is the name of the image in its registry
+           :return: the manifest digest of each reference'''
+        start = time.time()
+        pool = ThreadPool(self.downloads)
+        staging_dir = tempfile.mkdtemp(prefix='registry-export-', dir=self.staging_dir)
+        try:
+            manifests = pool.map(lambda image: self.docker_api.get_platform_manifest(image[0]), images)
+            blobs = OrderedDict()
+            for (reference, _), (_, manifest) in zip(images, manifests):
+                for descriptor in [manifest['config']] + manifest['layers']:
+                    blobs.setdefault(descriptor['digest'], (reference, descriptor['size']))
+            logging.info('Downloading {0} blob(s), {1:.1f} MB, of {2} image(s)'.format(
+                len(blobs), sum(size for _, size in blobs.values()) / 2.0 ** 20, len(images)))
+            pool.map(lambda blob: self.__stage(blob[1][0], blob[0], _staged(staging_dir, blob[0])), blobs.items())
+            diff_ids = [self.__get_diff_ids(manifest, staging_dir) for _, manifest in manifests]
+            layers = OrderedDict()
+            for (_, manifest), image_diff_ids in zip(manifests, diff_ids):
+                for layer, diff_id in zip(manifest['layers'], image_diff_ids):
+                    layers.setdefault(diff_id, layer['digest'])
+            configs = OrderedDict.fromkeys(manifest['config']['digest'] for _, manifest in manifests)
+            self.__write(archive_path, images, [manifest for _, manifest in manifests], diff_ids,
+                         [_staged(staging_dir, digest) for digest in configs],
+                         [(diff_id, _staged(staging_dir, digest)) for diff_id, digest in layers.items()])
+        finally:
+            pool.close()
+            pool.join()
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        logging.info('Exported {0} image(s) from their registries in {1:.1f}s'.format(len(images), time.time() - start))
+        return dict((reference, digest) for (reference, _), (digest, _) in zip(images, manifests))
+
+    def __stage(self, reference, digest, target):
+        if self.layer_store is not None and self.layer_store.fetch(digest, target):
+            return
+        self.docker_api.download_blob(reference, digest, target)
+        if self.layer_store is not None:
+            self.layer_store.put(digest, target)
+
+    @staticmethod
+    def __get_diff_ids(manifest, staging_dir):
+        with open(_staged(staging_dir, manifest['config']['digest'])) as config:
+            diff_ids = json.load(config)['rootfs']['diff_ids']
+        if len(diff_ids) != len(manifest['layers']):
+            raise DockerError('The config {0} has {1} diff_ids for {2} layers'.format(
+                manifest['config']['digest'], len(diff_ids), len(manifest['layers'])))
+        return diff_ids
+
+    @staticmethod
+    def __write(archive_path, images, manifests, diff_ids, config_paths, layer_paths):
+        entries = []
+        repositories = OrderedDict()
+        for (_, saved_name), manifest, image_diff_ids in zip(images, manifests, diff_ids):
+            layers = [_blob_name(diff_id) for diff_id in image_diff_ids]
+            entries.append(OrderedDict([('Config', _blob_name(manifest['config']['digest'])),
+                                        ('RepoTags', [saved_name]), ('Layers', layers)]))
+            repo, _, tag = saved_name.rpartition(':')
+            repositories.setdefault(repo, OrderedDict())[tag] = layers[-1].split('/')[-1] if layers else ''
+        try:
+            with tarfile.open(archive_path, 'w') as archive:
+                for path in config_paths:
+                    archive.add(path, _BLOB_DIR + os.path.basename(path))
+                for diff_id, path in layer_paths:
+                    RegistryExport.__add_layer(archive, _blob_name(diff_id), _unpack(path, diff_id))
+                RegistryExport.__add_json(archive, 'manifest.json', entries)
+                RegistryExport.__add_json(archive, 'repositories', repositories)
+        except BaseException:
+            # A layer is only verified once it is in the archive, an archive with a layer that failed is removed
+            if os.path.exists(archive_path):
+                os.remove(archive_path)
+            raise
+
+    @staticmethod
+    def __add_layer(archive, name, chunks):
+        '''Stream a member of unknown size into the archive.
+           The header is written with a size of 0 first and written again once all of the member is written.'''
+        info = tarfile.TarInfo(name)
+        info.mtime = time.time()
+        header_offset = archive.offset
+        header = info.tobuf(archive.format, archive.encoding, archive.errors)
+        archive.fileobj.write(header)
+        for chunk in chunks:
+            archive.fileobj.write(chunk)
+            info.size += len(chunk)
+        remainder = info.size % tarfile.BLOCKSIZE
+        if remainder:
+            archive.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+        end = archive.fileobj.tell()
+        archive.fileobj.seek(header_offset)
+        archive.fileobj.write(info.tobuf(archive.format, archive.encoding, archive.errors))
+        archive.fileobj.seek(end)
+        archive.offset = end
+        archive.members.append(info)
+
+    @staticmethod
+    def __add_json(archive, name, content):
+        data = json.dumps(content)
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        archive.addfile(info, StringIO(data))
@@ -0,0 +1,30 @@
+'''Registry mirrors of image pulls and registry API calls'''
+
+from image import get_registry
+
+
+def mirror_name(name, mirrors):
+    '''Return the name of an image in the mirror of its registry, or the name itself if its registry has no mirror.
+       A mirror is a host with an optional port and path prefix, e.g. mirror.example.com:5000/proxy.'''
+    registry = get_registry(name)
+    mirror = (mirrors or {}).get(registry)
+    if not mirror:
+        return name
+    if name.startswith(registry + '/'):
+        path = name[len(registry) + 1:]
+    else:
+        path = name if '/' in name.partition(':')[0] else 'library/' + name
+    return _strip_scheme(mirror).rstrip('/') + '/' + path
+
+
+def mirror_server(mirror):
+    '''Return the host and port of a mirror'''
+    return _strip_scheme(mirror).split('/')[0]
+
+
+def _strip_scheme(mirror):
+    '''Return a mirror URL without its http:// or https:// scheme'''
+    for scheme in ('https://', 'http://'):
+        if mirror.startswith(scheme):
+            return mirror[len(scheme):]
+    return mirror
@@ -0,0 +1,101 @@
+'''Persistent cache of rendered Helm templates'''
+
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+from eric_oss_app_package_tool.generator import hash_utils
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'eric-oss-app-package-tool', 'helm-templates')
+DEFAULT_CACHE_SIZE_MB = 512
+
+_ENTRY_SUFFIX = '.yaml'
+
+
+class RenderCache(object):
+    '''Content addressed store of "helm template" output.
+
+       Entries are keyed on everything that influences the render: the chart digest,
+       the values file digests, the set parameters, the debug flag and the helm version.
+       The modification time of an entry is bumped on every hit, so eviction of the
+       oldest entries above the size cap is least recently used first.
+       File digests come from the digest function, e.g. the one of the chart inventory.'''
+    def __init__(self, cache_dir, max_size, helm_version, digest=hash_utils.sha256):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.helm_version = helm_version
+        self.digest = digest
+        self.lock = threading.Lock()
+        try:
+            os.makedirs(cache_dir)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+    def key(self, chart, values, set_parameters, helm_debug):
+        '''Return the cache key of a render'''
+        key = hashlib.sha256()
+        key.update('chart={}\n'.format(self.digest(chart)))
+        for values_file in values or []:
+            key.update('values={}\n'.format(self.digest(values_file)))
+        for set_parameter in set_parameters or []:
+            key.update('set={}\n'.format(set_parameter))
+        key.update('debug={}\n'.format(bool(helm_debug)))
+        key.update('helm={}\n'.format(self.helm_version))
+        return key.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + _ENTRY_SUFFIX)
+
+    def get_file(self, key, path):
+        '''Copy the stored template output to path, return False on a miss'''
+        entry = self._path(key)
+        try:
+            shutil.copyfile(entry, path)
+            os.utime(entry, None)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def put_file(self, key, path):
+        '''Store the template output written to path, evicting old entries if the cache grows above its size cap'''
+        handle, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as entry, open(path, 'rb') as output:
+                shutil.copyfileobj(output, entry)
+            os.rename(tmp_path, self._path(key))
+        except (IOError, OSError):
+            logging.warning('Could not write helm template to the render cache', exc_info=True)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        '''Remove the least recently used entries until the cache fits in its size cap'''
+        with self.lock:
+            entries = []
+            for filename in os.listdir(self.cache_dir):
+                if not filename.endswith(_ENTRY_SUFFIX):
+                    continue
+                path = os.path.join(self.cache_dir, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                    logging.debug('Evicted %s from the render cache', path)
+                except OSError:
+                    pass
+                total_size -= size
@@ -0,0 +1,56 @@
+'''In-process registry of rendered Helm charts'''
+
+import threading
+
+
+class _Render(object):
+    '''A render that is in progress or done'''
+    def __init__(self):
+        self.done = threading.Event()
+        self.template = None
+        self.error = None
+
+
+class RenderRegistry(object):
+    '''Hands out one parsed HelmTemplate per render for the whole run.
+
+       Image discovery and the product report look up the same keys, so a chart
+       is rendered by whichever asks first and the other reuses the result.
+       Concurrent lookups of a key that is being rendered wait for that render
+       instead of starting another one.'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.renders = {}
+
+    def get(self, key, render):
+        '''Return the HelmTemplate for key, calling render() to create it on the first lookup'''
+        with self.lock:
+            entry = self.renders.get(key)
+            owner = entry is None
+            if owner:
+                entry = self.renders[key] = _Render()
+
+        if not owner:
+            entry.done.wait()
+            if entry.error is not None:
+                raise entry.error
+            return entry.template
+
+        try:
+            entry.template = render()
+        except Exception as exc:
+            entry.error = exc
+            with self.lock:
+                del self.renders[key]
+            raise
+        finally:
+            entry.done.set()
+        return entry.template
+
+    def clear(self):
+        '''Forget all renders'''
+        with self.lock:
+            self.renders.clear()
+
+
+REGISTRY = RenderRegistry()
@@ -2,22 +2,80 @@ import shutil
 import tempfile
 import tarfile
 import textwrap
+import threading
 from contextlib import contextmanager
 import os
 
 
-def find_key_in_dictionary(input_key, wanted_type, dictionary):
-    if hasattr(dictionary, 'items'):
-        for k, v in dictionary.items():
-            if k == input_key and isinstance(v, wanted_type):
-                yield v
-            if isinstance(v, dict):
-                for result in find_key_in_dictionary(input_key, wanted_type, v):
-                    yield result
-            elif isinstance(v, list):
-                for item in v:
-                    for result in find_key_in_dictionary(input_key, wanted_type, item):
-                        yield result
+def read_chart_file(chart, filename):
+    '''Read a file from the root of a Helm chart.
+       Packaged charts are streamed with tarfile and only read up to the file, without unpacking the chart.
+       Returns None if the chart does not contain the file.'''
+    if os.path.isdir(chart):
+        path = os.path.join(chart, filename)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as chart_file:
+            return chart_file.read()
+
+    with tarfile.open(chart, 'r|gz') as tar:
+        for member in tar:
+            parts = member.name.split('/')
+            if parts[0] == '.':
+                parts = parts[1:]
+            if len(parts) == 2 and parts[1] == filename and member.isfile():
+                return tar.extractfile(member).read()
+    return None
+
+
+def read_chart_tree(chart, filenames):
+    '''Read files from the root of a Helm chart and of all its subcharts under "charts",
+       including subcharts packaged as archives inside the chart archive.
+       Returns a dictionary of each chart found, identified by its path inside the package e.g. "top/charts/sub",
+       to a dictionary of the requested files it contains to their contents.
+       Only directories with a Chart.yaml are charts.'''
+    tree = {}
+    if os.path.isdir(chart):
+        _read_chart_dir(chart, os.path.basename(os.path.normpath(chart)), filenames, tree)
+    else:
+        with open(chart, 'rb') as archive:
+            _read_chart_archive(archive, '', filenames, tree)
+    return dict((path, files) for path, files in tree.items() if files.pop('Chart.yaml', None) is not None)
+
+
+def _read_chart_dir(directory, path, filenames, tree):
+    files = tree.setdefault(path, {})
+    for filename in os.listdir(directory):
+        full_path = os.path.join(directory, filename)
+        if os.path.isfile(full_path) and (filename in filenames or filename == 'Chart.yaml'):
+            with open(full_path, 'rb') as chart_file:
+                files[filename] = chart_file.read()
+    charts_dir = os.path.join(directory, 'charts')
+    if os.path.isdir(charts_dir):
+        for dependency in sorted(os.listdir(charts_dir)):
+            dependency_path = os.path.join(charts_dir, dependency)
+            if os.path.isdir(dependency_path):
+                _read_chart_dir(dependency_path, path + '/charts/' + dependency, filenames, tree)
+            elif dependency.endswith('.tgz'):
+                with open(dependency_path, 'rb') as archive:
+                    _read_chart_archive(archive, path + '/charts/', filenames, tree)
+
+
+def _read_chart_archive(archive, prefix, filenames, tree):
+    with tarfile.open(fileobj=archive, mode='r|gz') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            parts = [part for part in member.name.split('/') if part not in ('', '.')]
+            depth = 1
+            while depth + 2 < len(parts) and parts[depth] == 'charts':
+                depth += 2
+            chart_path = prefix + '/'.join(parts[:depth])
+            rest = parts[depth:]
+            if len(rest) == 1 and (rest[0] in filenames or rest[0] == 'Chart.yaml'):
+                tree.setdefault(chart_path, {})[rest[0]] = tar.extractfile(member).read()
+            elif len(rest) == 2 and rest[0] == 'charts' and rest[1].endswith('.tgz'):
+                _read_chart_archive(tar.extractfile(member), chart_path + '/charts/', filenames, tree)
 
 
 @contextmanager
@@ -48,4 +106,25 @@ def list_item(text, title='-', width=160):
         lines.append(wrapped_line)
     output = '  {} '.format(title) + '\n'.join(line for line in lines).lstrip()
 
-    return output
\ No newline at end of file
+    return output
+
+
+class Memo(object):
+    '''Thread safe memo of the objects a run shares, built on the first get of their key'''
+
+    def __init__(self):
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, create):
+        '''Return the object of the key, calling create(*key) when there is none yet'''
+        with self.lock:
+            obj = self.objects.get(key)
+            if obj is None:
+                obj = self.objects[key] = create(*key)
+            return obj
+
+    def clear(self):
+        '''Forget all objects'''
+        with self.lock:
+            self.objects.clear()
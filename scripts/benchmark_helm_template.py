@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+#
+#  Compares the event scanner of HelmTemplate with loading every rendered document and searching it with
+#  find_key_in_dictionary plus the "image:" regex, on synthetic multi-megabyte helm template output.
+#
+#  Usage:    ./scripts/benchmark_helm_template.py [--size <MB> ...] [--repeat <count>]
+#  Example:  ./scripts/benchmark_helm_template.py --size 2 8 --repeat 3
+#
+
+import argparse
+import re
+import time
+
+import yaml
+
+from eric_oss_app_package_tool.generator.helm_template import HelmTemplate, parse_pool
+
+DEPLOYMENT = """---
+# Source: umbrella/charts/service-{index}/templates/deployment.yaml
+apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: service-{index}
+  labels:
+    app.kubernetes.io/name: service-{index}
+    app.kubernetes.io/instance: umbrella
+  annotations:
+    ericsson.com/product-name: "Service {index}"
+    ericsson.com/product-number: "CXC 201 {index}"
+    ericsson.com/product-revision: 1.0.0
+spec:
+  replicas: 2
+  selector:
+    matchLabels:
+      app.kubernetes.io/name: service-{index}
+  template:
+    metadata:
+      labels:
+        app.kubernetes.io/name: service-{index}
+    spec:
+      initContainers:
+      - name: init
+        image: "registry.example.com/proj/service-{index}-init:1.0.0-{index}"
+        args: ["--wait", "--timeout", "300"]
+      containers:
+      - name: main
+        image: "registry.example.com/proj/service-{index}:1.0.0-{index}"
+        imagePullPolicy: IfNotPresent
+        env:
+        - name: LOG_LEVEL
+          value: info
+        - name: SERVICE_NAME
+          value: service-{index}
+        resources:
+          limits:
+            cpu: 500m
+            memory: 512Mi
+          requests:
+            cpu: 100m
+            memory: 128Mi
+      - name: sidecar
+        image: "registry.example.com/proj/sidecar:2.1.0"
+        ports:
+        - containerPort: 8080
+          name: http
+---
+# Source: umbrella/charts/service-{index}/templates/configmap.yaml
+apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: service-{index}-config
+data:
+  application.yaml: |
+    server:
+      port: 8080
+    logging:
+      level: info
+    sidecar:
+      image: {{{{ .Values.sidecar.image }}}}
+"""
+
+
+def render(size_mb):
+    documents = []
+    length = 0
+    index = 0
+    while length < size_mb * 1024 * 1024:
+        document = DEPLOYMENT.format(index=index)
+        documents.append(document)
+        length += len(document)
+        index += 1
+    return ''.join(documents)
+
+
+def find_key_in_dictionary(input_key, wanted_type, dictionary):
+    if hasattr(dictionary, 'items'):
+        for k, v in dictionary.items():
+            if k == input_key and isinstance(v, wanted_type):
+                yield v
+            if isinstance(v, dict):
+                for result in find_key_in_dictionary(input_key, wanted_type, v):
+                    yield result
+            elif isinstance(v, list):
+                for item in v:
+                    for result in find_key_in_dictionary(input_key, wanted_type, item):
+                        yield result
+
+
+def load_and_search(helm_template):
+    images = set()
+    for template in yaml.load_all(helm_template.decode('utf-8').replace('\t', ' ').rstrip(), Loader=yaml.SafeLoader):
+        images.update(find_key_in_dictionary(input_key="image", wanted_type=str, dictionary=template))
+    in_scalar_values = [line for line in re.findall(".*image:.*", helm_template) if "{{" in line]
+    return images, bool(in_scalar_values)
+
+
+def scan(helm_template):
+    template = HelmTemplate(helm_template)
+    return template.get_all_images(), template.has_images_in_scalar_values()
+
+
+def timed(function, helm_template, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.time()
+        result = function(helm_template)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark image discovery on helm template output')
+    parser.add_argument('--size', type=int, nargs='*', default=[2, 8], help='Sizes of the renders in MB')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement, the fastest is reported')
+    args = parser.parse_args()
+
+    print('{:>8} {:>12} {:>12} {:>8}'.format('size', 'load+search', 'scanner', 'speedup'))
+    for size_mb in args.size:
+        helm_template = render(size_mb)
+        loaded, loaded_result = timed(load_and_search, helm_template, args.repeat)
+        scanned, scanned_result = timed(scan, helm_template, args.repeat)
+        if loaded_result != scanned_result:
+            raise AssertionError('Scanner and load+search disagree on a {} MB render'.format(size_mb))
+        print('{:>6}MB {:>11.2f}s {:>11.2f}s {:>7.1f}x'.format(size_mb, loaded, scanned, loaded / scanned))
+
+
+if __name__ == '__main__':
+    with parse_pool():
+        main()
@@ -88,10 +88,22 @@ fi
 sudo rm -rf ${OUTPUT}*csar
 sudo chmod +rwx ${OUTPUT}
 
+# Builds sharing the docker daemon coordinate their image pulls through this directory, shared by all users
+PULL_LEASE_DIR=/tmp/eric-oss-app-package-tool/pull-leases
+if [[ ! -d ${PULL_LEASE_DIR} ]]; then
+    (umask 0 && mkdir -p ${PULL_LEASE_DIR} && chmod 1777 $(dirname ${PULL_LEASE_DIR}) ${PULL_LEASE_DIR})
+fi
+
+# The render cache and the layer store of the tool live under this directory, it outlives the container
+CACHE_DIR="$HOME"/.cache/eric-oss-app-package-tool
+mkdir -p "${CACHE_DIR}"
+
 docker run --rm \
        -v "$OUTPUT":/target \
        -v "$HOME"/.docker:/root/.docker \
        -v /var/run/docker.sock:/var/run/docker.sock \
+       -v ${PULL_LEASE_DIR}:${PULL_LEASE_DIR} \
+       -v "${CACHE_DIR}":/root/.cache/eric-oss-app-package-tool \
        -v "$DIR_PATH":/home \
        -v "${IMAGE_PATH}":/build \
        -w /target \
@@ -185,6 +185,29 @@ def test_convert_str_to_bool_non_bool_word():
         __main__.convert_str_to_bool(letters)
 
 
+def test_convert_str_to_positive_int():
+    assert __main__.convert_str_to_positive_int('4') == 4
+    with pytest.raises(argparse.ArgumentTypeError):
+        __main__.convert_str_to_positive_int('0')
+    with pytest.raises(argparse.ArgumentTypeError):
+        __main__.convert_str_to_positive_int('four')
+
+
+def test_convert_str_to_values_profile():
+    assert __main__.convert_str_to_values_profile('small=' + VALUES_CSAR_INVALID) == ('small', [VALUES_CSAR_INVALID])
+    with pytest.raises(argparse.ArgumentTypeError):
+        __main__.convert_str_to_values_profile(VALUES_CSAR_INVALID)
+    with pytest.raises(argparse.ArgumentTypeError):
+        __main__.convert_str_to_values_profile('small=missing.yaml')
+
+
+def test_convert_str_to_registry_mirror():
+    assert __main__.convert_str_to_registry_mirror('registry.example.com=mirror.example.com:5000/proxy') == \
+        ('registry.example.com', 'mirror.example.com:5000/proxy')
+    with pytest.raises(argparse.ArgumentTypeError):
+        __main__.convert_str_to_registry_mirror('mirror.example.com')
+
+
 def test_values_csar_validity():
     with pytest.raises(ValueError) as output:
         __main__.__check_values_csar_validity(VALUES_CSAR_INVALID)
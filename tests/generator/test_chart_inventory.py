@@ -0,0 +1,46 @@
+import argparse
+import hashlib
+import os
+
+from eric_oss_app_package_tool.generator import chart_inventory
+from eric_oss_app_package_tool.generator.chart_inventory import ChartInventory
+
+
+def test_inventory_lists_helm_dir_charts_then_helm_charts(tmpdir):
+    helm_dir = tmpdir.mkdir('charts')
+    helm_dir.join('b-1.0.0.tgz').write('bb')
+    helm_dir.join('a-1.0.0.tgz').write('a')
+    helm_dir.join('README.md').write('not a chart')
+    extra = tmpdir.join('extra-1.0.0.tgz')
+    extra.write('extra')
+
+    inventory = ChartInventory([str(extra)], str(helm_dir))
+
+    assert inventory.paths() == [os.path.join(str(helm_dir), 'a-1.0.0.tgz'),
+                                 os.path.join(str(helm_dir), 'b-1.0.0.tgz'),
+                                 str(extra)]
+    assert [chart.size for chart in inventory.charts] == [1, 2, 5]
+    assert [chart.in_helm_dir for chart in inventory.charts] == [True, True, False]
+
+
+def test_digest_is_recomputed_only_when_the_file_changes(tmpdir):
+    chart = tmpdir.join('chart-1.0.0.tgz')
+    chart.write('first')
+    inventory = ChartInventory([str(chart)])
+
+    assert inventory.digest(str(chart)) == hashlib.sha256('first').hexdigest()
+    chart.write('second!')
+    assert inventory.digest(str(chart)) == hashlib.sha256('second!').hexdigest()
+
+
+def test_get_inventory_walks_once_per_run(tmpdir):
+    tmpdir.join('chart-1.0.0.tgz').write('chart')
+    args = argparse.Namespace(helm=None, helm_dir=str(tmpdir))
+    chart_inventory.clear()
+
+    inventory = chart_inventory.get_inventory(args)
+    tmpdir.join('late-1.0.0.tgz').write('late')
+
+    assert chart_inventory.get_inventory(args) is inventory
+    assert len(inventory.charts) == 1
+    chart_inventory.clear()
@@ -0,0 +1,31 @@
+import threading
+
+from mock import patch
+
+from eric_oss_app_package_tool.generator.docker_pool import DockerClientPool
+
+
+@patch('eric_oss_app_package_tool.generator.docker_pool.docker.from_env')
+def test_clients_are_reused_up_to_the_size_of_the_pool(from_env):
+    from_env.side_effect = lambda timeout: object()
+    pool = DockerClientPool(2)
+    with pool.client() as first:
+        with pool.client() as second:
+            assert first is not second
+    with pool.client() as reused:
+        assert reused in (first, second)
+    assert from_env.call_count == 2
+
+
+@patch('eric_oss_app_package_tool.generator.docker_pool.docker.from_env')
+def test_borrowers_wait_for_a_client_when_the_pool_is_exhausted(from_env):
+    pool = DockerClientPool(1)
+    borrowed = []
+    with pool.client() as client:
+        waiter = threading.Thread(target=lambda: borrowed.append(pool.client().__enter__()))
+        waiter.start()
+        waiter.join(0.1)
+        assert waiter.is_alive()
+    waiter.join(5)
+    assert borrowed == [client]
+    assert from_env.call_count == 1
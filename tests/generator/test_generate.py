@@ -1,12 +1,26 @@
 import argparse
+import json
 import os
 import shutil
+import tarfile
 import pytest
+import mock
 from mock import patch
 import logging
+import threading
+import time
+from StringIO import StringIO
 
-from eric_oss_app_package_tool.generator import generate, product_report
+from docker.errors import DockerException
+
+from eric_oss_app_package_tool.generator import chart_inventory, generate, helm_runner, image_lock, product_report
+from eric_oss_app_package_tool.generator.docker_api import DockerError
+from eric_oss_app_package_tool.generator.render_registry import REGISTRY
+from eric_oss_app_package_tool.generator.helm_template import HelmTemplate
 from eric_oss_app_package_tool.generator.image import Image
+from eric_oss_app_package_tool.generator.preflight import PreflightError
+from eric_oss_app_package_tool.generator.pull_leases import PullLeases
+from eric_oss_app_package_tool.generator.pull_scheduler import AdaptiveLimit
 
 ROOT_DIR = os.path.abspath(os.path.join((os.path.abspath(__file__)), os.pardir))
 RESOURCES = os.path.abspath(os.path.join(ROOT_DIR, os.pardir, 'resources'))
@@ -166,7 +180,7 @@ def test_images_from_helm_template_with_duplicates():
 def test_images_in_scalar_values_check():
     with open(os.path.join(RESOURCES, "helm_templates/valid_template_with_images_in_scalars.yaml"),
               "r") as helm_template:
-        assert generate.__images_in_scalar_values((helm_template.read())) is not None
+        assert HelmTemplate(helm_template.read()).has_images_in_scalar_values()
 
 
 def test_empty_images_section_generation():
@@ -303,3 +317,547 @@ def test_get_component_metadata_with_no_helm_charts(DockerApi, parse_config):
             'product_number': '',
             'package': ''} in charts
 '''
+
+
+@pytest.fixture(autouse=True)
+def clear_render_registry():
+    REGISTRY.clear()
+    chart_inventory.clear()
+    helm_runner.clear()
+    image_lock.clear()
+
+
+def __charts(directory, *names):
+    paths = []
+    for name in names:
+        directory.join(name).write(name)
+        paths.append(str(directory.join(name)))
+    return paths
+
+
+def __render_args(charts, render_jobs=2, render_cache_dir=None, product_info_images=False, values_profile=None):
+    return argparse.Namespace(helm=charts, helm_dir=None, values=None, values_profile=values_profile, set=None,
+                              helm3=True, helm_debug=False, helm_timeout=None, helm_build_timeout=None,
+                              render_jobs=render_jobs, no_render_cache=render_cache_dir is None,
+                              render_cache_dir=render_cache_dir, render_cache_size=1, parallel_parse_threshold=8,
+                              product_info_images=product_info_images)
+
+
+def __fake_helm_template(outputs):
+    def fake_popen(command, stdout=None, **kwargs):
+        process = mock.MagicMock()
+        process.returncode = 0
+        chart = command[-1]
+        output, err = outputs[chart]
+        if hasattr(stdout, 'write'):
+            stdout.write(output)
+        process.stderr = StringIO(err)
+        process.communicate.return_value = outputs[chart]
+        return process
+    return fake_popen
+
+
+@patch('eric_oss_app_package_tool.generator.helm_runner.Popen')
+def test_get_images_renders_charts_in_parallel_and_merges_images(popen, tmpdir):
+    first, second = __charts(tmpdir, 'first.tgz', 'second.tgz')
+    with open(os.path.join(RESOURCES, "helm_templates/valid_template.yaml"), "r") as helm_template:
+        template = helm_template.read()
+    with open(os.path.join(RESOURCES, "helm_templates/valid_template_with_duplicate_images.yaml"),
+              "r") as helm_template:
+        template_with_duplicates = helm_template.read()
+    popen.side_effect = __fake_helm_template({first: (template, ''),
+                                              second: (template_with_duplicates, '')})
+    image_list = generate.__get_images(__render_args([first, second]))
+    assert popen.call_count == 2
+    assert image_list == set(yaml_parsing_expected_images)
+
+
+@patch('eric_oss_app_package_tool.generator.helm_runner.Popen')
+def test_get_images_reports_chart_of_failed_render(popen, tmpdir):
+    first, second = __charts(tmpdir, 'first.tgz', 'second.tgz')
+    popen.side_effect = __fake_helm_template({first: ('', ''),
+                                              second: ('', std_err_err_helm3)})
+    with pytest.raises(EnvironmentError) as error:
+        generate.__get_images(__render_args([first, second]))
+    assert 'second.tgz' in str(error.value)
+
+
+@patch('eric_oss_app_package_tool.generator.helm_runner.Popen')
+def test_get_images_reuses_cached_render(popen, tmpdir):
+    chart = tmpdir.join('chart.tgz')
+    chart.write('chart contents')
+    with open(os.path.join(RESOURCES, "helm_templates/valid_template.yaml"), "r") as helm_template:
+        template = helm_template.read()
+    popen.side_effect = __fake_helm_template({'--short': ('v3.4.2+g23dd3af', ''),
+                                              str(chart): (template, '')})
+    args = __render_args([str(chart)], render_cache_dir=str(tmpdir.join('cache')))
+    first = generate.__get_images(args)
+    REGISTRY.clear()
+    second = generate.__get_images(args)
+    assert first == second == set(yaml_parsing_expected_images)
+    rendered = [c for c in popen.call_args_list if 'template' in c[0][0]]
+    assert len(rendered) == 1
+
+
+@patch('eric_oss_app_package_tool.generator.helm_runner.Popen')
+def test_get_images_shares_one_render_cache_between_renders(popen, tmpdir):
+    first, second = __charts(tmpdir, 'first.tgz', 'second.tgz')
+    with open(os.path.join(RESOURCES, "helm_templates/valid_template.yaml"), "r") as helm_template:
+        template = helm_template.read()
+    popen.side_effect = __fake_helm_template({'--short': ('v3.4.2+g23dd3af', ''),
+                                              first: (template, ''), second: (template, '')})
+    args = __render_args([first, second], render_cache_dir=str(tmpdir.join('cache')))
+    with mock.patch.object(generate, 'RenderCache', wraps=generate.RenderCache) as render_cache:
+        generate.__get_images(args)
+    assert render_cache.call_count == 1
+    assert len(os.listdir(str(tmpdir.join('cache')))) == 2
+
+
+@patch('eric_oss_app_package_tool.generator.helm_runner.Popen')
+def test_helm_template_is_rendered_once_per_run(popen, tmpdir):
+    chart, = __charts(tmpdir, 'chart.tgz')
+    with open(os.path.join(RESOURCES, "helm_templates/valid_template.yaml"), "r") as helm_template:
+        template = helm_template.read()
+    popen.side_effect = __fake_helm_template({chart: (template, '')})
+    args = __render_args([chart])
+    generate.__get_images(args)
+    helm_template = generate.get_helm_template(chart, args)
+    assert popen.call_count == 1
+    assert len(helm_template.get_all_images()) == 5
+    assert len(helm_template.get_all_images()) == 5
+
+
+def __package_chart(directory, files):
+    chart = directory.join('chart-1.0.0.tgz')
+    with tarfile.open(str(chart), 'w:gz') as tar:
+        for name, path in files.items():
+            tar.add(path, arcname='chart/' + name)
+    return str(chart)
+
+
+@patch('eric_oss_app_package_tool.generator.helm_runner.Popen')
+def test_images_in_scalar_values_are_read_from_values_in_chart_archive(popen, tmpdir):
+    chart = __package_chart(tmpdir, {'Chart.yaml': os.path.join(RESOURCES, 'helmdirs/eric-sec-sip-tls-crd/Chart.yaml'),
+                                     'values.yaml': os.path.join(RESOURCES, 'values.yaml')})
+    with open(os.path.join(RESOURCES, "helm_templates/valid_template_with_images_in_scalars.yaml"),
+              "r") as helm_template:
+        template = helm_template.read()
+    popen.side_effect = __fake_helm_template({chart: (template, '')})
+    image_list = generate.__get_images(__render_args([chart]))
+    assert popen.call_count == 1
+    assert all(image in image_list for image in expected_images)
+
+
+def test_images_in_scalar_values_without_values_file(tmpdir):
+    chart = __package_chart(tmpdir, {'Chart.yaml': os.path.join(RESOURCES, 'helmdirs/eric-sec-sip-tls-crd/Chart.yaml')})
+    assert generate.__handle_images_in_scalar_values(chart) == set()
+
+
+def __product_info(name, tag):
+    return ('images:\n'
+            '  {0}:\n'
+            '    registry: armdocker.rnd.ericsson.se\n'
+            '    repoPath: proj-common-assets-cd-released\n'
+            '    name: {0}\n'
+            '    tag: "{1}"\n').format(name, tag)
+
+
+def __product_info_chart(tmpdir, sub_product_info=True):
+    top = tmpdir.mkdir('top')
+    top.join('Chart.yaml').write('name: top\n')
+    top.join('eric-product-info.yaml').write(__product_info('top', '1.0.0-1'))
+    sub = tmpdir.mkdir('sub')
+    sub.join('Chart.yaml').write('name: sub\n')
+    if sub_product_info:
+        sub.join('eric-product-info.yaml').write(__product_info('sub', '2.0.0-2'))
+    with tarfile.open(str(tmpdir.join('sub-2.0.0.tgz')), 'w:gz') as tar:
+        tar.add(str(sub), arcname='sub')
+    top.mkdir('charts')
+    shutil.copy(str(tmpdir.join('sub-2.0.0.tgz')), str(top.join('charts')))
+    chart = tmpdir.join('top-1.0.0.tgz')
+    with tarfile.open(str(chart), 'w:gz') as tar:
+        tar.add(str(top), arcname='top')
+    return str(chart)
+
+
+@patch('eric_oss_app_package_tool.generator.helm_runner.Popen')
+def test_get_images_from_product_info_without_rendering(popen, tmpdir):
+    chart = __product_info_chart(tmpdir)
+    image_list = generate.__get_images(__render_args([chart], product_info_images=True))
+    assert popen.call_count == 0
+    assert image_list == {Image(repo='armdocker.rnd.ericsson.se/proj-common-assets-cd-released/top', tag='1.0.0-1'),
+                          Image(repo='armdocker.rnd.ericsson.se/proj-common-assets-cd-released/sub', tag='2.0.0-2')}
+
+
+@patch('eric_oss_app_package_tool.generator.helm_runner.Popen')
+def test_get_images_renders_chart_with_subchart_missing_product_info(popen, tmpdir):
+    chart = __product_info_chart(tmpdir, sub_product_info=False)
+    with open(os.path.join(RESOURCES, "helm_templates/valid_template.yaml"), "r") as helm_template:
+        template = helm_template.read()
+    popen.side_effect = __fake_helm_template({chart: (template, '')})
+    image_list = generate.__get_images(__render_args([chart], product_info_images=True))
+    assert popen.call_count == 1
+    assert image_list == set(yaml_parsing_expected_images)
+
+
+@patch('eric_oss_app_package_tool.generator.helm_runner.Popen')
+def test_get_images_renders_every_values_profile_and_merges_images(popen, tmpdir):
+    chart, small, large = __charts(tmpdir, 'chart.tgz', 'small.yaml', 'large.yaml')
+    with open(os.path.join(RESOURCES, "helm_templates/valid_template.yaml"), "r") as helm_template:
+        template = helm_template.read()
+    small_template = template.replace('sles-pg10:latest', 'sles-pg11:latest')
+    popen.side_effect = __fake_helm_template({small: (small_template, ''), large: (template, '')})
+    image_list = generate.__get_images(__render_args([chart], values_profile=[('small', [small]),
+                                                                                ('large', [large])]))
+    assert popen.call_count == 2
+    assert image_list == set(yaml_parsing_expected_images) | {
+        Image(repo='armdocker.rnd.ericsson.se/proj-am/sles/sles-pg11', tag='latest')}
+
+
+@patch('eric_oss_app_package_tool.generator.helm_runner.Popen')
+def test_helm_templates_of_every_values_profile_reuse_the_renders_of_discovery(popen, tmpdir):
+    chart, small, large = __charts(tmpdir, 'chart.tgz', 'small.yaml', 'large.yaml')
+    with open(os.path.join(RESOURCES, "helm_templates/valid_template.yaml"), "r") as helm_template:
+        template = helm_template.read()
+    small_template = template.replace('sles-pg10:latest', 'sles-pg11:latest')
+    popen.side_effect = __fake_helm_template({small: (small_template, ''), large: (template, '')})
+    args = __render_args([chart], values_profile=[('small', [small]), ('large', [large])])
+    generate.__get_images(args)
+    helm_templates = generate.get_helm_templates(chart, args)
+    assert popen.call_count == 2
+    images = set().union(*[helm_template.get_all_images() for helm_template in helm_templates])
+    assert {'armdocker.rnd.ericsson.se/proj-am/sles/sles-pg10:latest',
+            'armdocker.rnd.ericsson.se/proj-am/sles/sles-pg11:latest'} <= images
+
+
+def __pull_args(always_pull=False, verify_local_digests=False, pull_lease_dir=None):
+    return argparse.Namespace(always_pull=always_pull, verify_local_digests=verify_local_digests,
+                              pull_concurrency=2, max_pull_concurrency=4, registry_pull_concurrency=None,
+                              docker_config='', registry_mirror=None, images_lock=None, refresh_lock=False,
+                              no_preflight=False, pull_progress_interval=None, pull_summary=None,
+                              pull_lease_dir=pull_lease_dir, pull_lease_stale_after=120)
+
+
+def __fake_docker(from_env, local_images=(), pulled_images=None, events=()):
+    # The pulls run in parallel, so they are recorded in lists rather than counted by the mocks
+    calls = {'pull': [], 'tag': []}
+    client = from_env.return_value
+    client.api.images.return_value = list(local_images)
+    client.api.pull.side_effect = lambda repository, tag, **kwargs: calls['pull'].append(repository + ':' + tag) or \
+        iter(events)
+
+    def get(name):
+        image = (pulled_images or {}).get(name) or mock.MagicMock(attrs={'Size': 1024})
+        image.tag.side_effect = lambda *tagged: calls['tag'].append((name, ':'.join(tagged)))
+        return image
+    client.images.get.side_effect = get
+    return client, calls
+
+
+def __local_image(tags, repo_digests):
+    # The summary of an image as listed by the images API, RepoDigests is null for images that were never pulled
+    return {'Id': 'sha256:' + tags[0], 'RepoTags': tags, 'RepoDigests': repo_digests or None}
+
+
+@patch('eric_oss_app_package_tool.generator.docker_pool.docker.from_env')
+def test_images_are_tagged_after_their_pull_with_pooled_clients(from_env):
+    client, calls = __fake_docker(from_env)
+    images = [Image(repo='armdocker.rnd.ericsson.se/proj/first', tag='1.0.0'), Image(repo='local', tag='2.0.0')]
+    tagged_images = generate.__pull_discovered_images(lambda submit: submit(images), ' ', __pull_args())
+    assert tagged_images.split() == ['proj/first:1.0.0', 'local:2.0.0']
+    assert sorted(calls['pull']) == ['armdocker.rnd.ericsson.se/proj/first:1.0.0', 'local:2.0.0']
+    assert calls['tag'] == [('armdocker.rnd.ericsson.se/proj/first:1.0.0', 'proj/first:1.0.0')]
+    assert from_env.call_count <= 2
+
+
+@patch('eric_oss_app_package_tool.generator.docker_pool.docker.from_env')
+def test_images_in_the_local_daemon_are_not_pulled(from_env):
+    client, calls = __fake_docker(from_env, [__local_image(['registry/proj/local:1.0.0'], [])])
+    images = [Image(repo='registry/proj/local', tag='1.0.0'), Image(repo='registry/proj/remote', tag='1.0.0')]
+    generate.__pull_discovered_images(lambda submit: submit(images), ' ', __pull_args())
+    assert calls['pull'] == ['registry/proj/remote:1.0.0']
+    assert not client.images.list.called
+
+    del calls['pull'][:]
+    generate.__pull_discovered_images(lambda submit: submit(images), ' ', __pull_args(always_pull=True))
+    assert len(calls['pull']) == 2
+
+
+@patch('eric_oss_app_package_tool.generator.docker_pool.docker.from_env')
+def test_local_images_with_an_outdated_digest_are_pulled(from_env):
+    client, calls = __fake_docker(from_env, [
+        __local_image(['registry/proj/current:1.0.0'], ['registry/proj/current@sha256:a']),
+        __local_image(['registry/proj/outdated:1.0.0'], ['registry/proj/outdated@sha256:b'])])
+    client.images.get_registry_data.return_value.id = 'sha256:a'
+    images = [Image(repo='registry/proj/current', tag='1.0.0'), Image(repo='registry/proj/outdated', tag='1.0.0')]
+    generate.__pull_discovered_images(lambda submit: submit(images), ' ', __pull_args(verify_local_digests=True))
+    assert calls['pull'] == ['registry/proj/outdated:1.0.0']
+
+
+@patch('eric_oss_app_package_tool.generator.docker_pool.docker.from_env')
+def test_images_are_pulled_from_the_mirror_of_their_registry(from_env):
+    client, calls = __fake_docker(from_env)
+    args = __pull_args()
+    args.registry_mirror = [('armdocker.rnd.ericsson.se', 'mirror.example.com')]
+    images = [Image(repo='armdocker.rnd.ericsson.se/proj/mirrored', tag='1.0.0'),
+              Image(repo='registry/proj/direct', tag='1.0.0')]
+    tagged_images = generate.__pull_discovered_images(lambda submit: submit(images), ' ', args)
+
+    assert sorted(calls['pull']) == ['mirror.example.com/proj/mirrored:1.0.0', 'registry/proj/direct:1.0.0']
+    assert sorted(calls['tag']) == [('armdocker.rnd.ericsson.se/proj/mirrored:1.0.0', 'proj/mirrored:1.0.0'),
+                                    ('mirror.example.com/proj/mirrored:1.0.0',
+                                     'armdocker.rnd.ericsson.se/proj/mirrored:1.0.0'),
+                                    ('registry/proj/direct:1.0.0', 'proj/direct:1.0.0')]
+    assert tagged_images.split() == ['proj/mirrored:1.0.0', 'proj/direct:1.0.0']
+
+
+@patch('eric_oss_app_package_tool.generator.docker_pool.docker.from_env')
+def test_locked_images_are_pulled_by_digest_and_new_digests_are_locked(from_env, tmpdir):
+    fresh = mock.MagicMock(attrs={'RepoDigests': ['registry/proj/fresh@sha256:c']})
+    client, calls = __fake_docker(from_env, [
+        __local_image(['registry/proj/current:1.0.0'], ['registry/proj/current@sha256:a']),
+        __local_image(['registry/proj/moved:1.0.0'], ['registry/proj/moved@sha256:new'])],
+        pulled_images={'registry/proj/fresh:1.0.0': fresh})
+    lock_path = tmpdir.join('images-lock.json')
+    lock_path.write(json.dumps({'images': {'registry/proj/current:1.0.0': 'sha256:a',
+                                           'registry/proj/moved:1.0.0': 'sha256:old',
+                                           'registry/proj/gone:1.0.0': 'sha256:d'}}))
+    args = __pull_args()
+    args.images_lock = str(lock_path)
+    images = [Image(repo='registry/proj/current', tag='1.0.0'), Image(repo='registry/proj/moved', tag='1.0.0'),
+              Image(repo='registry/proj/fresh', tag='1.0.0')]
+    tagged_images = generate.__pull_discovered_images(lambda submit: submit(images), ' ', args)
+
+    assert sorted(calls['pull']) == ['registry/proj/fresh:1.0.0', 'registry/proj/moved:sha256:old']
+    assert tagged_images.split() == ['proj/current:1.0.0', 'proj/moved:1.0.0', 'proj/fresh:1.0.0']
+    assert json.loads(lock_path.read()) == {'images': {'registry/proj/current:1.0.0': 'sha256:a',
+                                                       'registry/proj/moved:1.0.0': 'sha256:old',
+                                                       'registry/proj/fresh:1.0.0': 'sha256:c'}}
+
+
+@patch('eric_oss_app_package_tool.generator.docker_pool.docker.from_env')
+def test_refresh_lock_resolves_the_tags_again(from_env, tmpdir):
+    client, calls = __fake_docker(from_env, [
+        __local_image(['registry/proj/moved:1.0.0'], ['registry/proj/moved@sha256:new'])])
+    lock_path = tmpdir.join('images-lock.json')
+    lock_path.write(json.dumps({'images': {'registry/proj/moved:1.0.0': 'sha256:old'}}))
+    args = __pull_args()
+    args.images_lock = str(lock_path)
+    args.refresh_lock = True
+    images = [Image(repo='registry/proj/moved', tag='1.0.0')]
+    generate.__pull_discovered_images(lambda submit: submit(images), ' ', args)
+
+    assert calls['pull'] == []
+    assert json.loads(lock_path.read()) == {'images': {'registry/proj/moved:1.0.0': 'sha256:new'}}
+
+
+@patch('eric_oss_app_package_tool.generator.generate.DockerApi')
+@patch('eric_oss_app_package_tool.generator.docker_pool.docker.from_env')
+def test_missing_images_fail_the_build(from_env, docker_api):
+    client, calls = __fake_docker(from_env, [__local_image(['registry/proj/local:1.0.0'], [])])
+    statuses = {'registry/proj/typo:1.0.0': 404, 'registry/proj/secret:1.0.0': 401}
+    docker_api.return_value.check_manifest.side_effect = lambda name: (statuses.get(name, 200), None)
+    docker_api.return_value.get_compressed_size.side_effect = DockerError('no size')
+    images = [Image(repo='registry/proj/found', tag='1.0.0'), Image(repo='registry/proj/typo', tag='1.0.0'),
+              Image(repo='registry/proj/secret', tag='1.0.0'), Image(repo='registry/proj/local', tag='1.0.0')]
+    with pytest.raises(PreflightError) as error:
+        generate.__pull_discovered_images(lambda submit: submit(images), ' ', __pull_args())
+
+    assert error.value.problems == {'registry/proj/typo:1.0.0': 'missing', 'registry/proj/secret:1.0.0': 'unauthorised'}
+    # Only an image whose check passed may have started to pull before a check failed
+    assert set(calls['pull']) <= {'registry/proj/found:1.0.0'}
+    checked = sorted(call[0][0] for call in docker_api.return_value.check_manifest.call_args_list)
+    assert checked == ['registry/proj/found:1.0.0', 'registry/proj/secret:1.0.0', 'registry/proj/typo:1.0.0']
+
+
+@patch('eric_oss_app_package_tool.generator.generate.DockerApi')
+@patch('eric_oss_app_package_tool.generator.docker_pool.docker.from_env')
+def test_images_are_pulled_once_their_own_check_passed(from_env, docker_api):
+    client, calls = __fake_docker(from_env)
+    docker_api.return_value.check_manifest.return_value = (200, 1)
+    pulling = threading.Event()
+    pull = client.api.pull.side_effect
+    client.api.pull.side_effect = lambda repository, tag, **kwargs: pulling.set() or pull(repository, tag)
+
+    def discover(submit):
+        # The second image is only discovered once the first one is pulling
+        submit([Image(repo='registry/proj/first', tag='1.0.0')])
+        assert pulling.wait(5)
+        submit([Image(repo='registry/proj/second', tag='1.0.0')])
+    generate.__pull_discovered_images(discover, ' ', __pull_args())
+    assert calls['pull'] == ['registry/proj/first:1.0.0', 'registry/proj/second:1.0.0']
+
+
+@patch('eric_oss_app_package_tool.generator.docker_pool.docker.from_env')
+def test_pull_progress_is_written_to_the_summary(from_env, tmpdir):
+    __fake_docker(from_env, events=[
+        {'status': 'Pulling from proj/image', 'id': '1.0.0'},
+        {'status': 'Already exists', 'id': 'base'},
+        {'status': 'Downloading', 'id': 'app', 'progressDetail': {'current': 1024, 'total': 4096}},
+        {'status': 'Downloading', 'id': 'app', 'progressDetail': {'current': 4096, 'total': 4096}},
+        {'status': 'Download complete', 'id': 'app'},
+        {'status': 'Pull complete', 'id': 'app'}])
+    args = __pull_args()
+    args.pull_summary = str(tmpdir.join('pull-summary.json'))
+    images = [Image(repo='registry/proj/image', tag='1.0.0')]
+    generate.__pull_discovered_images(lambda submit: submit(images), ' ', args)
+
+    summary = json.loads(tmpdir.join('pull-summary.json').read())
+    assert summary['bytes'] == 4096
+    image = summary['images'][0]
+    assert (image['image'], image['bytes'], image['cached_layers']) == ('registry/proj/image:1.0.0', 4096, 1)
+    assert [(layer['layer'], layer['bytes']) for layer in image['layers']] == [('base', 0), ('app', 4096)]
+
+
+@patch('eric_oss_app_package_tool.generator.docker_pool.docker.from_env')
+def test_pull_errors_in_the_progress_stream_fail_the_pull(from_env):
+    __fake_docker(from_env, events=[{'error': 'manifest for registry/proj/image:1.0.0 not found'}])
+    images = [Image(repo='registry/proj/image', tag='1.0.0')]
+    with pytest.raises(DockerException) as error:
+        generate.__pull_discovered_images(lambda submit: submit(images), ' ', __pull_args())
+    assert 'not found' in str(error.value)
+
+
+@patch('eric_oss_app_package_tool.generator.docker_pool.docker.from_env')
+def test_images_pulled_by_another_build_are_not_pulled_again(from_env, tmpdir):
+    client, calls = __fake_docker(from_env)
+    other_build = PullLeases(str(tmpdir))
+    holding = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with other_build.lease('registry/proj/shared:1.0.0'):
+            holding.set()
+            release.wait(5)
+    holder = threading.Thread(target=hold)
+    holder.start()
+    holding.wait(5)
+    images = [Image(repo='registry/proj/shared', tag='1.0.0'), Image(repo='registry/proj/own', tag='1.0.0')]
+    threading.Timer(0.2, release.set).start()
+    tagged_images = generate.__pull_discovered_images(lambda submit: submit(images), ' ',
+                                                      __pull_args(pull_lease_dir=str(tmpdir)))
+    holder.join(5)
+
+    assert calls['pull'] == ['registry/proj/own:1.0.0']
+    assert tagged_images.split() == ['proj/shared:1.0.0', 'proj/own:1.0.0']
+    assert tmpdir.listdir() == []
+
+
+@patch('eric_oss_app_package_tool.generator.docker_pool.docker.from_env')
+@patch('eric_oss_app_package_tool.generator.helm_runner.Popen')
+def test_images_are_pulled_while_other_charts_render(popen, from_env, tmpdir):
+    first, second = __charts(tmpdir, 'first.tgz', 'second.tgz')
+    client, calls = __fake_docker(from_env)
+    first_pulled = threading.Event()
+    pull = client.api.pull.side_effect
+    client.api.pull.side_effect = lambda repository, tag, **kwargs: first_pulled.set() or pull(repository, tag)
+    render = __fake_helm_template({first: ('image: registry/proj/first:1.0.0', ''),
+                                   second: ('image: registry/proj/second:1.0.0', '')})
+
+    def fake_popen(command, **kwargs):
+        if command[-1] == second:
+            assert first_pulled.wait(5)
+        return render(command, **kwargs)
+    popen.side_effect = fake_popen
+    args = __render_args([first, second])
+    args.__dict__.update(vars(__pull_args()))
+    tagged_images = generate.__pull_discovered_images(lambda submit: generate.__get_images(args, submit), ' ', args)
+    assert sorted(tagged_images.split()) == ['proj/first:1.0.0', 'proj/second:1.0.0']
+
+
+@patch('eric_oss_app_package_tool.generator.generate.DockerApi')
+@patch('eric_oss_app_package_tool.generator.docker_pool.docker.from_env')
+def test_largest_images_are_pulled_first(from_env, docker_api):
+    client, calls = __fake_docker(from_env)
+    sizes = {'registry/proj/small:1.0.0': 10, 'registry/proj/large:1.0.0': 1000, 'registry/proj/medium:1.0.0': 100}
+    docker_api.return_value.get_compressed_size.side_effect = sizes.get
+    args = __pull_args()
+    args.max_pull_concurrency = 1
+    args.no_preflight = True
+    images = [Image(repo='registry/proj/small', tag='1.0.0'), Image(repo='registry/proj/medium', tag='1.0.0'),
+              Image(repo='registry/proj/large', tag='1.0.0')]
+    pulling = threading.Event()
+    release = threading.Event()
+    pull = client.api.pull.side_effect
+    client.api.pull.side_effect = lambda repository, tag, **kwargs: pulling.set() or release.wait(5) and \
+        pull(repository, tag)
+
+    def discover(submit):
+        # The first image is pulled right away, the others queue up behind it
+        submit(images[:1])
+        pulling.wait(5)
+        submit(images[1:])
+        release.set()
+    generate.__pull_discovered_images(discover, ' ', args)
+    assert calls['pull'] == ['registry/proj/small:1.0.0', 'registry/proj/large:1.0.0', 'registry/proj/medium:1.0.0']
+
+
+@patch('eric_oss_app_package_tool.generator.generate.DockerApi')
+@patch('eric_oss_app_package_tool.generator.docker_pool.docker.from_env')
+def test_largest_images_get_a_slot_first_with_more_workers_than_slots(from_env, docker_api):
+    client, calls = __fake_docker(from_env)
+    sizes = {'registry/proj/small:1.0.0': 10, 'registry/proj/large:1.0.0': 1000, 'registry/proj/medium:1.0.0': 100,
+             'registry/proj/tiny:1.0.0': 1}
+    # The sizes come from the manifests the preflight got
+    docker_api.return_value.check_manifest.side_effect = lambda name: (200, sizes[name])
+    args = __pull_args()
+    args.registry_pull_concurrency = [('docker.io', 1)]
+    schedulers = []
+    scheduler_class = generate.PullScheduler
+    pull = client.api.pull.side_effect
+
+    def first_pull(repository, tag, **kwargs):
+        # The first pull holds the only slot until the other images wait for it
+        if not calls['pull']:
+            limit = schedulers[0].get_limit('docker.io')
+            while len(limit.waiting) < len(sizes) - 1:
+                time.sleep(0.01)
+        return pull(repository, tag)
+    client.api.pull.side_effect = first_pull
+    images = [Image(repo=name.split(':')[0], tag='1.0.0') for name in sorted(sizes)]
+    with mock.patch.object(generate, 'PullScheduler',
+                           side_effect=lambda *a: schedulers.append(scheduler_class(*a)) or schedulers[0]):
+        generate.__pull_discovered_images(lambda submit: submit(images), ' ', args)
+    assert calls['pull'][1:] == sorted(calls['pull'][1:], key=sizes.get, reverse=True)
+    assert len(calls['pull']) == len(sizes)
+    assert not docker_api.return_value.get_compressed_size.called
+
+
+@patch('eric_oss_app_package_tool.generator.generate.DockerApi')
+@patch('eric_oss_app_package_tool.generator.docker_pool.docker.from_env')
+def test_small_images_pulled_after_the_large_ones_keep_the_pull_limit(from_env, docker_api):
+    client, calls = __fake_docker(from_env)
+    sizes = dict(('registry/proj/large{0}:1.0.0'.format(i), 500 * 2 ** 20) for i in range(6))
+    sizes.update(('registry/proj/small{0}:1.0.0'.format(i), 5 * 2 ** 20) for i in range(20))
+    docker_api.return_value.get_compressed_size.side_effect = sizes.get
+    args = __pull_args()
+    args.no_preflight = True
+    schedulers = []
+    scheduler_class = generate.PullScheduler
+    pull = client.api.pull.side_effect
+    # Every pull takes as long, the small ones are bound by latency
+    client.api.pull.side_effect = lambda repository, tag, **kwargs: time.sleep(0.02) or pull(repository, tag)
+    images = [Image(repo=name.split(':')[0], tag='1.0.0') for name in sorted(sizes, reverse=True)]
+    with mock.patch.object(generate, 'PullScheduler',
+                           side_effect=lambda *a: schedulers.append(scheduler_class(*a)) or schedulers[0]):
+        generate.__pull_discovered_images(lambda submit: submit(images), ' ', args)
+    # Pulls that find a free slot at the same time may start in any order
+    assert all('large' in name for name in calls['pull'][:6 - args.max_pull_concurrency])
+    assert all('small' in name for name in calls['pull'][6 + args.max_pull_concurrency:])
+    assert schedulers[0].get_limit('docker.io').limit >= args.pull_concurrency
+
+
+@patch('eric_oss_app_package_tool.generator.generate.DockerApi')
+@patch('eric_oss_app_package_tool.generator.docker_pool.docker.from_env')
+def test_pull_throughput_is_measured_with_the_compressed_size(from_env, docker_api):
+    # Most layers are cached, only a small one is downloaded, but the pull took as long as the whole image
+    events = [{'status': 'Already exists', 'id': 'cached'},
+              {'status': 'Downloading', 'id': 'new', 'progressDetail': {'current': 1024, 'total': 1024}}]
+    __fake_docker(from_env, events=events)
+    docker_api.return_value.get_compressed_size.return_value = 100 * 2 ** 20
+    args = __pull_args()
+    args.no_preflight = True
+    with mock.patch.object(AdaptiveLimit, 'record') as record:
+        generate.__pull_discovered_images(lambda submit: submit([Image(repo='registry/proj/cached', tag='1.0.0')]),
+                                          ' ', args)
+    assert record.call_args[0][0] == 100 * 2 ** 20
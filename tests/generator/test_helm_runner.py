@@ -0,0 +1,68 @@
+import sys
+import threading
+import time
+
+import pytest
+
+from eric_oss_app_package_tool.generator.helm_runner import HelmCancelled, HelmRunner, HelmTimeout
+
+
+def __python(code):
+    return [sys.executable, '-c', code]
+
+
+def test_run_returns_output_and_records_wall_time():
+    runner = HelmRunner()
+    assert runner.run(__python('print("v3.4.2")'), 'version').strip() == 'v3.4.2'
+    assert 'version' in runner.wall_times
+
+
+def test_std_err_is_parsed_line_by_line(tmpdir):
+    lines = []
+    with open(str(tmpdir.join('output')), 'wb') as output:
+        HelmRunner().run(__python('import sys; sys.stderr.write("first\\nsecond\\n")'), 'chart', stdout=output,
+                         parse_std_err=lambda std_err: lines.extend(std_err))
+    assert lines == ['first\n', 'second\n']
+
+
+def test_failed_command_raises():
+    with pytest.raises(EnvironmentError) as error:
+        HelmRunner().run(__python('import sys; sys.exit(3)'), 'chart')
+    assert 'exited with code 3' in str(error.value)
+
+
+def test_command_is_killed_after_timeout():
+    start = time.time()
+    with pytest.raises(HelmTimeout):
+        HelmRunner(timeout=0.2).run(__python('import time; time.sleep(10)'), 'chart')
+    assert time.time() - start < 5
+
+
+def test_no_command_starts_after_the_build_deadline():
+    runner = HelmRunner(build_timeout=0.01)
+    time.sleep(0.02)
+    with pytest.raises(HelmTimeout):
+        runner.run(__python('pass'), 'chart')
+
+
+def test_cancel_kills_running_commands_and_refuses_new_ones():
+    runner = HelmRunner()
+    errors = []
+
+    def run():
+        try:
+            runner.run(__python('import time; time.sleep(10)'), 'sibling')
+        except EnvironmentError as e:
+            errors.append(e)
+
+    sibling = threading.Thread(target=run)
+    sibling.start()
+    while not runner.processes:
+        time.sleep(0.01)
+    runner.cancel(EnvironmentError('chart failed'))
+    sibling.join(5)
+
+    assert not sibling.is_alive()
+    assert isinstance(errors[0], HelmCancelled)
+    with pytest.raises(HelmCancelled):
+        runner.run(__python('pass'), 'chart')
@@ -0,0 +1,171 @@
+import os
+
+import yaml
+from mock import patch
+
+from eric_oss_app_package_tool.generator.helm_template import HelmTemplate, parse_pool, split_documents, split_file
+
+ROOT_DIR = os.path.abspath(os.path.join((os.path.abspath(__file__)), os.pardir))
+HELM_TEMPLATES = os.path.abspath(os.path.join(ROOT_DIR, os.pardir, 'resources', 'helm_templates'))
+
+ANNOTATED_TEMPLATE = b"""---
+# Source: chart/templates/service.yaml
+apiVersion: v1
+kind: Service
+metadata:
+  name: service
+  annotations:
+    ericsson.com/product-revision: 9.9.9
+---
+# Source: chart/templates/configmap.yaml
+apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: config
+  annotations:
+    ericsson.com/product-name: "Test Product"
+    ericsson.com/product-revision: 1.0.0
+    ericsson.com/replicas: 3
+data:
+  image: 1.0
+---
+"""
+
+
+def __read(name):
+    with open(os.path.join(HELM_TEMPLATES, name), 'rb') as helm_template:
+        return helm_template.read()
+
+
+def __find_key_in_dictionary(input_key, wanted_type, dictionary):
+    # The search of the loaded documents that the scanner replaced, kept as the reference for its results
+    if hasattr(dictionary, 'items'):
+        for k, v in dictionary.items():
+            if k == input_key and isinstance(v, wanted_type):
+                yield v
+            if isinstance(v, dict):
+                for result in __find_key_in_dictionary(input_key, wanted_type, v):
+                    yield result
+            elif isinstance(v, list):
+                for item in v:
+                    for result in __find_key_in_dictionary(input_key, wanted_type, item):
+                        yield result
+
+
+def __images_from_loaded_documents(helm_template):
+    images = set()
+    for document in yaml.load_all(helm_template.decode('utf-8').replace('\t', ' ').rstrip(), Loader=yaml.SafeLoader):
+        images.update(__find_key_in_dictionary(input_key="image", wanted_type=str, dictionary=document))
+    return images
+
+
+def test_scanned_images_match_loaded_documents():
+    for name in os.listdir(HELM_TEMPLATES):
+        helm_template = __read(name)
+        assert HelmTemplate(helm_template).get_all_images() == __images_from_loaded_documents(helm_template)
+
+
+def test_images_are_recorded_with_their_container_name():
+    pod = ('---\nkind: Pod\nspec:\n  initContainers:\n  - image: proj/init:1.0.0\n    name: init\n'
+           '  containers:\n  - name: main\n    image: proj/main:1.0.0\n    env:\n    - name: IMAGE\n'
+           '  - image: proj/unnamed:1.0.0\n')
+    document = HelmTemplate(pod).templates[0]
+    assert document.images == ['proj/init:1.0.0', 'proj/main:1.0.0', 'proj/unnamed:1.0.0']
+    assert document.containers == [('init', 'proj/init:1.0.0'), ('main', 'proj/main:1.0.0'),
+                                   (None, 'proj/unnamed:1.0.0')]
+
+
+def test_images_in_scalar_values_are_detected():
+    assert HelmTemplate(__read('valid_template_with_images_in_scalars.yaml')).has_images_in_scalar_values()
+    assert not HelmTemplate(__read('valid_template.yaml')).has_images_in_scalar_values()
+
+
+def test_unrendered_image_values_are_detected():
+    direct = '---\nkind: Pod\nspec:\n  containers:\n  - image: "{{ .Values.img }}"\n'
+    commented = '---\nkind: Pod\nspec:\n  containers:\n  # image: {{ .Values.img }}\n  - image: proj/image:1.0.0\n'
+    assert HelmTemplate(direct).has_images_in_scalar_values()
+    assert HelmTemplate(commented).has_images_in_scalar_values()
+    assert not HelmTemplate(commented.replace('{{ .Values.img }}', 'proj/old:1.0.0')).has_images_in_scalar_values()
+
+
+def test_annotations_of_first_template_of_kind():
+    helm_template = HelmTemplate(ANNOTATED_TEMPLATE)
+    assert helm_template.get_annotations() == {'ericsson.com/product-name': 'Test Product',
+                                               'ericsson.com/product-revision': '1.0.0',
+                                               'ericsson.com/replicas': 3}
+    assert helm_template.get_annotations(kind='Service') == {'ericsson.com/product-revision': '9.9.9'}
+    assert helm_template.get_annotations(kind='Deployment') == {}
+    assert helm_template.get_all_images() == set()
+
+
+def test_split_documents_starts_every_part_at_a_document_marker():
+    helm_template = ANNOTATED_TEMPLATE + b"kind: Secret\n"
+    parts = split_documents(helm_template, 8)
+    assert ''.join(parts) == helm_template
+    assert len(parts) == 3
+    assert all(part.startswith('---') for part in parts)
+
+
+def test_split_file_starts_every_range_at_a_document_marker(tmpdir):
+    helm_template = tmpdir.join('helm_template.yaml')
+    helm_template.write(ANNOTATED_TEMPLATE + b"kind: Secret\n", 'wb')
+    ranges = split_file(str(helm_template), 8)
+    contents = helm_template.read('rb')
+    assert [contents[start:end] for start, end in ranges] == split_documents(contents, 8)
+
+
+@patch('eric_oss_app_package_tool.generator.helm_template.cpu_count', return_value=2)
+def test_parallel_parse_gives_the_same_results(cpu_count, tmpdir):
+    for helm_template in [ANNOTATED_TEMPLATE] + [__read(name) for name in os.listdir(HELM_TEMPLATES)]:
+        path = tmpdir.join('helm_template.yaml')
+        path.write(helm_template, 'wb')
+        sequential = HelmTemplate(helm_template)
+        with parse_pool():
+            parallel_templates = [HelmTemplate(helm_template, parallel_parse_threshold=0),
+                                  HelmTemplate(parallel_parse_threshold=0, path=str(path))]
+        for parallel in parallel_templates:
+            assert parallel.get_all_images() == sequential.get_all_images()
+            assert parallel.get_annotations() == sequential.get_annotations()
+            assert parallel.has_images_in_scalar_values() == sequential.has_images_in_scalar_values()
+
+
+def test_renders_are_scanned_in_the_parse_pool_only_while_it_is_open():
+    with patch('eric_oss_app_package_tool.generator.helm_template.scan_documents_in_processes') as in_processes:
+        HelmTemplate(ANNOTATED_TEMPLATE, parallel_parse_threshold=0)
+        assert not in_processes.called
+        with patch('eric_oss_app_package_tool.generator.helm_template.cpu_count', return_value=2), parse_pool():
+            HelmTemplate(ANNOTATED_TEMPLATE, parallel_parse_threshold=0)
+        assert in_processes.call_count == 1
+        HelmTemplate(ANNOTATED_TEMPLATE, parallel_parse_threshold=0)
+        assert in_processes.call_count == 1
+
+
+def test_render_in_a_file_gives_the_same_results(tmpdir):
+    for helm_template in [ANNOTATED_TEMPLATE] + [__read(name) for name in os.listdir(HELM_TEMPLATES)]:
+        path = tmpdir.join('helm_template.yaml')
+        path.write(helm_template, 'wb')
+        in_memory = HelmTemplate(helm_template)
+        in_file = HelmTemplate(path=str(path))
+        assert in_file.get_all_images() == in_memory.get_all_images()
+        assert in_file.get_annotations() == in_memory.get_annotations()
+        assert in_file.has_images_in_scalar_values() == in_memory.has_images_in_scalar_values()
+        assert [document.load() for document in in_file.find()] == [document.load() for document in in_memory.find()]
+
+
+def test_documents_are_indexed_by_kind_name_and_source():
+    helm_template = HelmTemplate(ANNOTATED_TEMPLATE)
+    assert sorted(helm_template.get_kinds()) == ['ConfigMap', 'Service']
+    assert sorted(helm_template.get_sources()) == ['chart/templates/configmap.yaml', 'chart/templates/service.yaml']
+
+    config_map = helm_template.get(kind='ConfigMap', name='config')
+    assert config_map.source == 'chart/templates/configmap.yaml'
+    assert helm_template.find(source='chart/templates/service.yaml')[0].name == 'service'
+    assert helm_template.find(kind='ConfigMap', name='service') == []
+    assert helm_template.get(kind='Secret') is None
+    assert len(helm_template.find()) == 3
+
+
+def test_documents_are_loaded_on_demand():
+    config_map = HelmTemplate(ANNOTATED_TEMPLATE).get(kind='ConfigMap')
+    assert config_map.load()['data'] == {'image': 1.0}
+    assert config_map.load() is config_map.load()
@@ -0,0 +1,80 @@
+import json
+
+import mock
+import pytest
+from mock import patch
+
+from eric_oss_app_package_tool.generator.docker_api import DockerApi
+from eric_oss_app_package_tool.generator.image_lock import ImageLock, get_repo_digest
+
+
+def test_missing_lockfile_locks_nothing(tmpdir):
+    assert ImageLock(str(tmpdir.join('images-lock.json'))).get('registry/proj/image:1.0.0') is None
+
+
+def test_lockfile_is_written_sorted_and_read_back(tmpdir):
+    path = str(tmpdir.join('images-lock.json'))
+    image_lock = ImageLock(path)
+    image_lock.set('registry/proj/second:1.0.0', 'sha256:b')
+    image_lock.set('registry/proj/first:1.0.0', 'sha256:a')
+    image_lock.save()
+
+    assert open(path).read().index('first') < open(path).read().index('second')
+    assert ImageLock(path).get('registry/proj/first:1.0.0') == 'sha256:a'
+    assert ImageLock(path, refresh=True).get('registry/proj/first:1.0.0') is None
+    assert [p.basename for p in tmpdir.listdir()] == ['images-lock.json']
+
+
+def test_pin_prefers_the_digest_of_this_build(tmpdir):
+    path = tmpdir.join('images-lock.json')
+    path.write(json.dumps({'images': {'registry:5000/proj/image:1.0.0': 'sha256:old'}}))
+    image_lock = ImageLock(str(path))
+    assert image_lock.pin('registry:5000/proj/image:1.0.0') == 'registry:5000/proj/image@sha256:old'
+    image_lock.set('registry:5000/proj/image:1.0.0', 'sha256:new')
+    assert image_lock.pin('registry:5000/proj/image:1.0.0') == 'registry:5000/proj/image@sha256:new'
+    assert image_lock.pin('registry/proj/other:1.0.0') == 'registry/proj/other:1.0.0'
+
+
+def test_invalid_lockfile_fails(tmpdir):
+    path = tmpdir.join('images-lock.json')
+    path.write('not json')
+    with pytest.raises(ValueError):
+        ImageLock(str(path))
+
+
+def test_get_repo_digest():
+    repo_digests = ['other/proj/image@sha256:b', 'registry/proj/image@sha256:a']
+    assert get_repo_digest(repo_digests, ['registry/proj/image']) == 'sha256:a'
+    assert get_repo_digest(repo_digests, ['mirror/proj/image']) is None
+    assert get_repo_digest(None, ['registry/proj/image']) is None
+
+
+def test_split_image_path_with_digest():
+    assert DockerApi.split_image_path('registry/proj/image@sha256:a') == ('registry', 'proj/image', 'sha256:a')
+    assert DockerApi.split_image_path('registry/proj/image:1.0.0') == ('registry', 'proj/image', '1.0.0')
+
+
+@patch('eric_oss_app_package_tool.generator.docker_api.requests.Session.request')
+@patch('eric_oss_app_package_tool.generator.docker_api.DockerConfig')
+def test_labels_of_an_image_pinned_to_a_manifest_list(docker_config, request):
+    docker_config.return_value.get_credentials.return_value = ('user', 'password')
+    manifest_list = {'manifests': [
+        {'digest': 'sha256:arm', 'platform': {'os': 'linux', 'architecture': 'arm64'}},
+        {'digest': 'sha256:amd', 'platform': {'os': 'linux', 'architecture': 'amd64'}}]}
+    manifest = {'config': {'digest': 'sha256:config', 'size': 1,
+                           'mediaType': 'application/vnd.docker.container.image.v1+json'}, 'layers': [{'size': 2}]}
+    config = {'config': {'Labels': {'com.ericsson.product-number': 'CXC1234567'}}}
+    responses = {'manifests/sha256:list': manifest_list, 'manifests/sha256:amd': manifest,
+                 'blobs/sha256:config': config}
+
+    def respond(method, url, **kwargs):
+        return mock.MagicMock(status_code=200, headers={'Docker-Content-Digest': url.rpartition('/')[2]},
+                              json=lambda: responses['/'.join(url.split('/')[-2:])])
+    request.side_effect = respond
+    api = DockerApi('')
+    pinned = ImageLock(None, refresh=True)
+    pinned.set('registry.example.com/proj/image:1.0.0', 'sha256:list')
+
+    name = pinned.pin('registry.example.com/proj/image:1.0.0')
+    assert api.get_labels(name) == {'com.ericsson.product-number': 'CXC1234567'}
+    assert api.get_compressed_size(name) == 3
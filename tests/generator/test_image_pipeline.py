@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+
+from eric_oss_app_package_tool.generator.image_pipeline import ImagePipeline
+
+
+def test_each_image_is_processed_once_in_submission_order():
+    processed = []
+    pipeline = ImagePipeline(2, lambda image: processed.append(image) or image.upper())
+    pipeline.submit(['a', 'b'])
+    pipeline.submit(['b', 'c'])
+    assert pipeline.finish() == ['A', 'B', 'C']
+    assert sorted(processed) == ['a', 'b', 'c']
+
+
+def test_images_are_processed_while_discovery_goes_on():
+    started = threading.Event()
+    pipeline = ImagePipeline(1, lambda image: started.set())
+    pipeline.submit(['a'])
+    assert started.wait(5)
+    pipeline.submit(['b'])
+    assert len(pipeline.finish()) == 2
+
+
+def test_finish_raises_the_error_of_an_image():
+    def process(image):
+        if image == 'bad':
+            raise EnvironmentError('pull failed')
+    pipeline = ImagePipeline(2, process)
+    pipeline.submit(['good', 'bad'])
+    with pytest.raises(EnvironmentError):
+        pipeline.finish()
+
+
+def test_queued_images_with_the_highest_priority_are_processed_first():
+    started = threading.Event()
+    release = threading.Event()
+    processed = []
+    pipeline = ImagePipeline(1, lambda image: started.set() or release.wait(5) and processed.append(image),
+                             priority=len)
+    pipeline.submit(['first'])
+    started.wait(5)
+    pipeline.submit(['b', 'ccc', 'dd'])
+    release.set()
+    pipeline.finish()
+    assert processed == ['first', 'ccc', 'dd', 'b']
+
+
+def test_terminate_drops_queued_images():
+    started = threading.Event()
+    release = threading.Event()
+    processed = []
+    pipeline = ImagePipeline(1, lambda image: started.set() or release.wait(5) and processed.append(image))
+    pipeline.submit(['first', 'second'])
+    started.wait(5)
+    threading.Timer(0.1, release.set).start()
+    pipeline.terminate()
+    assert processed == ['first']
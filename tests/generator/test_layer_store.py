@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import threading
+
+import mock
+
+from eric_oss_app_package_tool.generator.layer_store import LayerStore
+from eric_oss_app_package_tool.generator.registry_export import RegistryExport
+
+
+def __blob(tmpdir, name, content):
+    path = tmpdir.join(name)
+    path.write(content)
+    return str(path), 'sha256:' + hashlib.sha256(content).hexdigest()
+
+
+def test_stored_blob_is_fetched_and_counted(tmpdir):
+    store = LayerStore(str(tmpdir.join('store')), 1024)
+    path, digest = __blob(tmpdir, 'downloaded', 'layer')
+    assert not store.fetch(digest, str(tmpdir.join('miss')))
+    store.put(digest, path)
+
+    assert store.fetch(digest, str(tmpdir.join('hit')))
+    assert tmpdir.join('hit').read() == 'layer'
+    assert (store.hits, store.misses, store.hit_bytes) == (1, 1, 5)
+
+
+def test_corrupt_blob_is_removed(tmpdir):
+    store = LayerStore(str(tmpdir.join('store')), 1024)
+    path, digest = __blob(tmpdir, 'downloaded', 'layer')
+    with open(store._path(digest), 'w') as corrupt:
+        corrupt.write('tampered')
+
+    assert not store.fetch(digest, str(tmpdir.join('fetched')))
+    assert not os.path.exists(store._path(digest))
+    assert not tmpdir.join('fetched').check()
+
+
+def test_least_recently_used_blobs_are_evicted(tmpdir):
+    store = LayerStore(str(tmpdir.join('store')), 10)
+    first, first_digest = __blob(tmpdir, 'first', 'aaaa')
+    second, second_digest = __blob(tmpdir, 'second', 'bbbb')
+    third, third_digest = __blob(tmpdir, 'third', 'cccc')
+    store.put(first_digest, first)
+    store.put(second_digest, second)
+    os.utime(store._path(first_digest), (1, 1))
+    os.utime(store._path(second_digest), (2, 2))
+    assert store.fetch(first_digest, str(tmpdir.join('used')))
+    store.put(third_digest, third)
+
+    assert os.path.exists(store._path(first_digest))
+    assert not os.path.exists(store._path(second_digest))
+    assert os.path.exists(store._path(third_digest))
+
+
+def test_fetched_blob_survives_eviction_by_another_build(tmpdir):
+    store = LayerStore(str(tmpdir.join('store')), 1024)
+    path, digest = __blob(tmpdir, 'downloaded', 'layer')
+    store.put(digest, path)
+    assert store.fetch(digest, str(tmpdir.join('fetched')))
+    LayerStore(str(tmpdir.join('store')), 0).evict()
+    assert tmpdir.join('fetched').read() == 'layer'
+
+
+def test_concurrent_builds_store_the_same_blob(tmpdir):
+    path, digest = __blob(tmpdir, 'downloaded', 'layer')
+    stores = [LayerStore(str(tmpdir.join('store')), 1024) for _ in range(4)]
+    threads = [threading.Thread(target=store.put, args=(digest, path)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert os.listdir(str(tmpdir.join('store'))) == [digest.replace(':', '-')]
+
+
+def test_export_downloads_only_missing_blobs(tmpdir):
+    store = LayerStore(str(tmpdir.join('store')), 1024)
+    layer, layer_digest = __blob(tmpdir, 'layer', 'layer')
+    config_content = json.dumps({'rootfs': {'type': 'layers', 'diff_ids': [layer_digest]}})
+    config, config_digest = __blob(tmpdir, 'config', config_content)
+    store.put(layer_digest, layer)
+    docker_api = mock.MagicMock()
+    docker_api.get_platform_manifest.return_value = ('sha256:manifest', {
+        'config': {'digest': config_digest, 'size': 2}, 'layers': [{'digest': layer_digest, 'size': 5}]})
+    docker_api.download_blob.side_effect = lambda reference, digest, target: open(target, 'w').write(config_content)
+
+    RegistryExport(docker_api, layer_store=store).export([('registry/proj/image:1.0.0', 'proj/image:1.0.0')],
+                                                         str(tmpdir.join('docker.tar')))
+    docker_api.download_blob.assert_called_once_with('registry/proj/image:1.0.0', config_digest, mock.ANY)
+    assert (store.hits, store.misses) == (1, 1)
+    assert store.fetch(config_digest, str(tmpdir.join('stored-config')))
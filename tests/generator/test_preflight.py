@@ -0,0 +1,154 @@
+import threading
+
+import mock
+import pytest
+from mock import patch
+
+from eric_oss_app_package_tool.generator.docker_api import DockerApi, DockerError
+from eric_oss_app_package_tool.generator.preflight import Preflight, PreflightError
+
+
+def test_all_images_are_checked_at_the_same_time():
+    docker_api = mock.MagicMock()
+    started = threading.Semaphore(0)
+    release = threading.Event()
+
+    def check_manifest(name):
+        started.release()
+        release.wait(5)
+        return 200, 1
+    docker_api.check_manifest.side_effect = check_manifest
+    preflight = Preflight(docker_api)
+    preflight.submit(['registry/proj/image{0}:1.0.0'.format(index) for index in range(8)])
+    for _ in range(8):
+        assert started.acquire(True)
+    release.set()
+    preflight.finish()
+
+
+def test_every_problem_is_reported():
+    docker_api = mock.MagicMock()
+    docker_api.check_manifest.side_effect = lambda name: {'a:1': (404, None), 'b:1': (403, None)}.get(name, (200, 1))
+    preflight = Preflight(docker_api)
+    preflight.submit(['a:1', 'b:1', 'c:1', 'a:1'])
+    with pytest.raises(PreflightError) as error:
+        preflight.finish()
+    assert error.value.problems == {'a:1': 'missing', 'b:1': 'unauthorised'}
+    assert 'a:1: missing' in str(error.value)
+    assert docker_api.check_manifest.call_count == 3
+
+
+def test_refused_anonymous_checks_are_left_to_the_pull():
+    docker_api = mock.MagicMock()
+    docker_api.check_manifest.return_value = 401, None
+    docker_api.has_credentials.side_effect = lambda name: name == 'authenticated:1'
+    preflight = Preflight(docker_api)
+    preflight.submit(['anonymous:1', 'authenticated:1'])
+    with pytest.raises(PreflightError) as error:
+        preflight.finish()
+    assert error.value.problems == {'authenticated:1': 'unauthorised'}
+
+
+@patch('eric_oss_app_package_tool.generator.docker_api.DockerConfig.parse_config')
+def test_registries_of_a_credential_helper_have_no_credentials(parse_config):
+    parse_config.return_value = {'auths': {'registry.example.com': {}}, 'credsStore': 'desktop',
+                                 'credHelpers': {'helper.example.com': 'ecr-login'}}
+    docker_api = DockerApi('')
+    assert not docker_api.has_credentials('registry.example.com/proj/image:1.0.0')
+    assert not docker_api.has_credentials('helper.example.com/proj/image:1.0.0')
+
+
+def test_sizes_of_the_images_found_are_kept():
+    docker_api = mock.MagicMock()
+    docker_api.check_manifest.side_effect = lambda name: {'a:1': (200, 3)}.get(name, (404, None))
+    preflight = Preflight(docker_api)
+    preflight.submit(['a:1', 'b:1'])
+    with pytest.raises(PreflightError):
+        preflight.finish()
+    assert preflight.sizes == {'a:1': 3}
+
+
+def test_passed_images_are_handed_on_until_a_check_fails():
+    docker_api = mock.MagicMock()
+    docker_api.check_manifest.side_effect = lambda name: {'missing:1': (404, None)}.get(name, (200, 1))
+    passed = []
+    preflight = Preflight(docker_api, concurrency=1, on_passed=passed.extend)
+    preflight.submit(['a:1', 'missing:1', 'b:1'])
+    with pytest.raises(PreflightError):
+        preflight.finish()
+    assert passed == ['a:1']
+
+
+def test_unanswered_checks_are_left_to_the_pull():
+    docker_api = mock.MagicMock()
+    docker_api.check_manifest.side_effect = DockerError('timed out')
+    preflight = Preflight(docker_api)
+    preflight.submit(['a:1'])
+    preflight.finish()
+
+
+@patch('eric_oss_app_package_tool.generator.docker_api.requests')
+@patch('eric_oss_app_package_tool.generator.docker_api.DockerConfig')
+def test_check_manifest_answers_a_bearer_token_challenge(docker_config, requests):
+    docker_config.return_value.get_credentials.side_effect = KeyError('no credentials')
+    challenge = mock.MagicMock(status_code=401, headers={
+        'WWW-Authenticate': 'Bearer realm="https://auth.docker.io/token",service="registry.docker.io",'
+                            'scope="repository:library/busybox:pull"'})
+    found = mock.MagicMock(status_code=200, headers={'Docker-Content-Digest': 'sha256:a'})
+    found.json.return_value = {'config': {'size': 1}, 'layers': [{'size': 2}]}
+    session = requests.Session.return_value
+    session.request.side_effect = [challenge, found]
+    session.get.return_value = mock.MagicMock(status_code=200, json=lambda: {'token': 'secret'})
+
+    assert DockerApi('').check_manifest('busybox:1.32') == (200, 3)
+    session.get.assert_called_once_with('https://auth.docker.io/token', auth=None, timeout=15,
+                                        params={'service': 'registry.docker.io',
+                                                'scope': 'repository:library/busybox:pull'})
+    url = session.request.call_args[0][1]
+    assert url == 'https://registry-1.docker.io/v2/library/busybox/manifests/1.32'
+    assert session.request.call_args[1]['headers']['Authorization'] == 'Bearer secret'
+
+
+@patch('eric_oss_app_package_tool.generator.docker_api.requests')
+@patch('eric_oss_app_package_tool.generator.docker_api.DockerConfig')
+def test_check_manifest_reports_the_status_of_a_missing_image(docker_config, requests):
+    docker_config.return_value.get_credentials.side_effect = KeyError('no credentials')
+    requests.Session.return_value.request.return_value = mock.MagicMock(status_code=404, headers={})
+    assert DockerApi('').check_manifest('busybox:missing') == (404, None)
+
+
+@patch('eric_oss_app_package_tool.generator.docker_api.requests')
+@patch('eric_oss_app_package_tool.generator.docker_api.DockerConfig')
+def test_bearer_tokens_are_cached_per_realm_and_scope(docker_config, requests):
+    docker_config.return_value.get_credentials.side_effect = KeyError('no credentials')
+    challenge = mock.MagicMock(status_code=401, headers={
+        'WWW-Authenticate': 'Bearer realm="https://auth.docker.io/token",service="registry.docker.io",'
+                            'scope="repository:library/busybox:pull"'})
+    found = mock.MagicMock(status_code=200, headers={'Docker-Content-Digest': 'sha256:a'})
+    found.json.return_value = {'config': {'size': 1}, 'layers': [{'size': 2}]}
+    session = requests.Session.return_value
+    session.request.side_effect = [challenge, found, found]
+    session.get.return_value = mock.MagicMock(status_code=200, json=lambda: {'token': 'secret'})
+    api = DockerApi('')
+
+    assert api.get_compressed_size('busybox:1.32') == 3
+    assert api.get_compressed_size('busybox:1.33') == 3
+    assert session.get.call_count == 1
+    assert session.request.call_count == 3
+    assert session.request.call_args[1]['headers']['Authorization'] == 'Bearer secret'
+
+
+@patch('eric_oss_app_package_tool.generator.docker_api.requests')
+@patch('eric_oss_app_package_tool.generator.docker_api.DockerConfig')
+def test_manifest_lookups_answer_a_bearer_token_challenge(docker_config, requests):
+    docker_config.return_value.get_credentials.side_effect = KeyError('no credentials')
+    challenge = mock.MagicMock(status_code=401, headers={
+        'WWW-Authenticate': 'Bearer realm="https://auth.docker.io/token",service="registry.docker.io"'})
+    found = mock.MagicMock(status_code=200, headers={'Docker-Content-Digest': 'sha256:a'})
+    found.json.return_value = {'config': {'size': 1}, 'layers': [{'size': 2}]}
+    session = requests.Session.return_value
+    session.request.side_effect = [challenge, found]
+    session.get.return_value = mock.MagicMock(status_code=200, json=lambda: {'token': 'secret'})
+
+    assert DockerApi('').get_compressed_size('busybox:1.32') == 3
+    assert session.request.call_args[1]['headers']['Authorization'] == 'Bearer secret'
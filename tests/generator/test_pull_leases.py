@@ -0,0 +1,101 @@
+import errno
+import os
+import stat
+import threading
+import time
+
+from mock import patch
+
+from eric_oss_app_package_tool.generator.pull_leases import PullLeases
+
+
+def __lease_files(tmpdir):
+    return [path.basename for path in tmpdir.listdir()]
+
+
+def test_lease_is_removed_after_the_pull(tmpdir):
+    leases = PullLeases(str(tmpdir))
+    with leases.lease('registry/proj/image:1.0.0') as waited:
+        assert not waited
+        assert len(__lease_files(tmpdir)) == 1
+    assert __lease_files(tmpdir) == []
+
+
+def test_second_build_waits_for_the_lease_of_the_first(tmpdir):
+    first = PullLeases(str(tmpdir))
+    second = PullLeases(str(tmpdir), poll_interval=0.01)
+    events = []
+    holding = threading.Event()
+
+    def pull():
+        with first.lease('registry/proj/image:1.0.0'):
+            holding.set()
+            time.sleep(0.1)
+            events.append('first pulled')
+    builder = threading.Thread(target=pull)
+    builder.start()
+    holding.wait(5)
+    with second.lease('registry/proj/image:1.0.0') as waited:
+        events.append('second holds')
+    builder.join(5)
+
+    assert waited
+    assert events == ['first pulled', 'second holds']
+
+
+def test_different_images_do_not_wait_for_each_other(tmpdir):
+    leases = PullLeases(str(tmpdir))
+    with leases.lease('registry/proj/first:1.0.0'):
+        with leases.lease('registry/proj/second:1.0.0') as waited:
+            assert not waited
+
+
+def test_stale_lease_of_a_dead_build_is_removed(tmpdir):
+    dead_build = PullLeases(str(tmpdir))
+    path = dead_build._path('registry/proj/image:1.0.0')
+    with open(path, 'w') as lease:
+        lease.write('{}')
+    stale = time.time() - 60
+    os.utime(path, (stale, stale))
+
+    with PullLeases(str(tmpdir), stale_after=30, poll_interval=0.01).lease('registry/proj/image:1.0.0') as waited:
+        assert waited
+    assert __lease_files(tmpdir) == []
+
+
+def test_fresh_lease_is_not_removed(tmpdir):
+    other_build = PullLeases(str(tmpdir))
+    path = other_build._path('registry/proj/image:1.0.0')
+    with open(path, 'w') as lease:
+        lease.write('{}')
+    PullLeases(str(tmpdir), stale_after=30)._PullLeases__remove_if_stale(path)
+    assert os.path.exists(path)
+
+
+def test_heartbeat_keeps_the_lease_fresh(tmpdir):
+    leases = PullLeases(str(tmpdir), stale_after=0.2)
+    with leases.lease('registry/proj/image:1.0.0'):
+        path = leases._path('registry/proj/image:1.0.0')
+        stale = time.time() - 60
+        os.utime(path, (stale, stale))
+        time.sleep(0.15)
+        assert time.time() - os.stat(path).st_mtime < 0.2
+
+
+def test_lease_dir_is_shared_by_all_users(tmpdir):
+    umask = os.umask(0o077)
+    try:
+        PullLeases(str(tmpdir.join('shared', 'pull-leases')))
+    finally:
+        os.umask(umask)
+    for directory in (tmpdir.join('shared'), tmpdir.join('shared', 'pull-leases')):
+        assert stat.S_IMODE(os.stat(str(directory)).st_mode) == 0o1777
+
+
+def test_pull_goes_on_without_a_lease_it_cannot_create(tmpdir):
+    leases = PullLeases(str(tmpdir))
+    with patch('eric_oss_app_package_tool.generator.pull_leases.os.open',
+               side_effect=OSError(errno.EACCES, 'Permission denied')):
+        with leases.lease('registry/proj/image:1.0.0') as waited:
+            assert not waited
+    assert __lease_files(tmpdir) == []
@@ -0,0 +1,126 @@
+import threading
+import time
+
+import mock
+import pytest
+from docker.errors import APIError
+
+from eric_oss_app_package_tool.generator import pull_scheduler
+from eric_oss_app_package_tool.generator.pull_scheduler import AdaptiveLimit, PullScheduler, Throttled, is_throttled
+
+MB = 2 ** 20
+
+
+def __simulate(limit, sizes, seconds):
+    '''Pulls images of the sizes in their order through the limit on a simulated clock, which moves to the end of
+       the next pull whenever no more pulls can start. seconds gives the duration of a pull of a size while a number
+       of pulls are active. Returns the limit after each pull.'''
+    clock = [0.0]
+    queued = list(sizes)
+    running = []
+    limits = []
+    with mock.patch.object(pull_scheduler, 'time', mock.Mock(time=lambda: clock[0])):
+        limit.ticked = 0.0
+        while queued or running:
+            while queued and limit.active < limit.limit:
+                size = queued.pop(0)
+                limit.acquire(size)
+                running.append((clock[0] + seconds(size, limit.active), size, clock[0], limit.busy()))
+            running.sort()
+            end, size, start, busy = running.pop(0)
+            clock[0] = end
+            limit.record(size, end - start, (limit.busy() - busy) / (end - start))
+            limit.release()
+            limits.append(limit.limit)
+    return limits
+
+
+def __registry(size, active):
+    # Large pulls share 200 MB/s of bandwidth and get at most 50 MB/s each, small pulls are bound by latency
+    if size < 16 * MB:
+        return 2.0
+    return float(size) / min(50 * MB, 200 * MB / active)
+
+
+def test_throttling_responses_are_recognised():
+    assert is_throttled(APIError('toomanyrequests: You have reached your pull rate limit'))
+    assert is_throttled(APIError('received unexpected HTTP status: 503 Service Unavailable'))
+    assert not is_throttled(APIError('manifest for registry/image:1.0.0-512 not found'))
+
+
+def test_limit_grows_while_throughput_holds_and_halves_when_it_drops():
+    limit = AdaptiveLimit('registry', 2, 4)
+    limit.active = 2
+    limit.record(100 * MB, 1.0, 2)
+    assert limit.limit == 3
+    for _ in range(3):
+        limit.record(20 * MB, 1.0, 2)
+    assert limit.limit == 1
+    limit.throttle('429')
+    assert limit.limit == 1
+
+
+def test_small_images_do_not_shrink_the_limit():
+    limit = AdaptiveLimit('registry', 4, 16)
+    sizes = [5 * MB, 400 * MB, 5 * MB, 5 * MB, 300 * MB, 5 * MB, 200 * MB] * 4 + [5 * MB] * 20
+    limits = __simulate(limit, sizes, __registry)
+    assert min(limits) >= 4
+    assert limits[-1] > 4
+
+
+def test_cut_limit_grows_again():
+    limit = AdaptiveLimit('registry', 4, 16)
+    limit.active = 4
+    limit.record(800 * MB, 1.0, 4)
+    for _ in range(3):
+        limit.record(200 * MB, 1.0, 1)
+    assert limit.limit == 2
+    limit.active = 2
+    limit.record(200 * MB, 1.0, 2)
+    assert limit.limit == 3
+
+
+def test_fixed_limit_does_not_adapt():
+    scheduler = PullScheduler(2, 8, {'registry': 3})
+    limit = scheduler.get_limit('registry')
+    limit.throttle('429')
+    assert limit.limit == 3
+    assert scheduler.workers() == 11
+
+
+def test_slot_halves_the_limit_when_the_registry_throttles():
+    scheduler = PullScheduler(4, 8)
+    with pytest.raises(Throttled):
+        with scheduler.slot('registry'):
+            raise APIError('toomanyrequests: You have reached your pull rate limit')
+    assert scheduler.get_limit('registry').limit == 2
+    assert scheduler.get_limit('registry').active == 0
+
+
+def test_pulls_wait_for_a_free_slot():
+    limit = AdaptiveLimit('registry', 1, 1)
+    acquired = threading.Event()
+    limit.acquire()
+    waiter = threading.Thread(target=lambda: limit.acquire() or acquired.set())
+    waiter.start()
+    assert not acquired.wait(0.1)
+    limit.release()
+    waiter.join(5)
+    assert acquired.is_set()
+    assert limit.active == 1
+
+
+def test_waiting_pulls_get_a_slot_by_priority():
+    limit = AdaptiveLimit('registry', 1, 1)
+    order = []
+    limit.acquire()
+    waiters = [threading.Thread(target=lambda p=priority: limit.acquire(p) or order.append(p) or limit.release())
+               for priority in (10, 1000, 100)]
+    for waiter in waiters:
+        waiter.start()
+    while len(limit.waiting) < len(waiters):
+        time.sleep(0.01)
+    limit.release()
+    for waiter in waiters:
+        waiter.join(5)
+    assert order == [1000, 100, 10]
@@ -0,0 +1,37 @@
+import logging
+import time
+
+import pytest
+
+from eric_oss_app_package_tool.generator.pull_telemetry import ImageProgress, PullTelemetry
+
+
+def test_layer_progress_follows_the_pull_events():
+    progress = ImageProgress('registry/proj/image:1.0.0')
+    progress.record({'status': 'Downloading', 'id': 'app', 'progressDetail': {'current': 10, 'total': 100}})
+    assert progress.downloaded() == 10
+    progress.record({'status': 'Download complete', 'id': 'app'})
+    assert progress.downloaded() == 100
+    layer = progress.summary()['layers'][0]
+    assert layer['seconds'] is not None and not layer['cached']
+
+
+def test_failed_pulls_are_left_out_of_the_summary():
+    telemetry = PullTelemetry(None)
+    with telemetry.track('registry/proj/pulled:1.0.0'):
+        pass
+    with pytest.raises(ValueError):
+        with telemetry.track('registry/proj/failed:1.0.0'):
+            raise ValueError('pull failed')
+    assert [image['image'] for image in telemetry.summary()['images']] == ['registry/proj/pulled:1.0.0']
+
+
+def test_progress_is_logged_while_pulling(caplog):
+    caplog.set_level(logging.INFO)
+    telemetry = PullTelemetry(0.01)
+    with telemetry.track('registry/proj/image:1.0.0') as progress:
+        progress.record({'status': 'Downloading', 'id': 'app',
+                         'progressDetail': {'current': 2 ** 20, 'total': 2 ** 21}})
+        time.sleep(0.1)
+    telemetry.stop()
+    assert 'Pull progress: 1 image(s) pulling, 0 pulled, 1.0 MB downloaded' in caplog.text
@@ -0,0 +1,146 @@
+import gzip
+import hashlib
+import json
+import tarfile
+from StringIO import StringIO
+
+import mock
+import pytest
+from mock import patch
+
+from eric_oss_app_package_tool.generator.docker_api import DockerApi, DockerError
+from eric_oss_app_package_tool.generator.registry_export import RegistryExport
+
+
+
+def __digest(content):
+    return 'sha256:' + hashlib.sha256(content).hexdigest()
+
+
+def __gzip(content):
+    compressed = StringIO()
+    with gzip.GzipFile(fileobj=compressed, mode='wb', mtime=0) as layer:
+        layer.write(content)
+    return compressed.getvalue()
+
+
+# The layers are compressed in the registry, the image configs list the digests of the uncompressed layers.
+# The base layer is streamed into the archive in several chunks and does not end at a tar block.
+LAYERS = {'base': 'base layer' * 300001, 'app': 'app layer'}
+DIFF_IDS = dict((name, __digest(content)) for name, content in LAYERS.items())
+BLOBS = {'config-a': json.dumps({'rootfs': {'type': 'layers', 'diff_ids': [DIFF_IDS['base']]}}),
+         'config-b': json.dumps({'rootfs': {'type': 'layers', 'diff_ids': [DIFF_IDS['base'], DIFF_IDS['app']]}}),
+         'base': __gzip(LAYERS['base']), 'app': __gzip(LAYERS['app'])}
+DIGESTS = dict((name, __digest(content)) for name, content in BLOBS.items())
+
+
+def __descriptor(name):
+    return {'digest': DIGESTS[name], 'size': len(BLOBS[name])}
+
+
+def __fake_docker_api():
+    manifests = {'registry/proj/a:1.0.0': ('sha256:manifest-a', {'config': __descriptor('config-a'),
+                                                                 'layers': [__descriptor('base')]}),
+                 'registry/proj/b@sha256:manifest-b': ('sha256:manifest-b', {
+                     'config': __descriptor('config-b'), 'layers': [__descriptor('base'), __descriptor('app')]})}
+    docker_api = mock.MagicMock()
+    docker_api.get_platform_manifest.side_effect = manifests.get
+    downloads = []
+
+    def download_blob(reference, digest, target):
+        downloads.append(digest)
+        content = [content for name, content in BLOBS.items() if DIGESTS[name] == digest][0]
+        with open(target, 'wb') as blob:
+            blob.write(content)
+    docker_api.download_blob.side_effect = download_blob
+    return docker_api, downloads
+
+
+def test_images_are_exported_in_docker_save_format(tmpdir):
+    docker_api, downloads = __fake_docker_api()
+    archive_path = str(tmpdir.join('docker.tar'))
+    digests = RegistryExport(docker_api, staging_dir=str(tmpdir)).export(
+        [('registry/proj/a:1.0.0', 'proj/a:1.0.0'), ('registry/proj/b@sha256:manifest-b', 'proj/b:2.0.0')],
+        archive_path)
+
+    assert digests == {'registry/proj/a:1.0.0': 'sha256:manifest-a',
+                       'registry/proj/b@sha256:manifest-b': 'sha256:manifest-b'}
+    assert sorted(downloads) == sorted(DIGESTS.values())
+    with tarfile.open(archive_path) as archive:
+        manifest = json.loads(archive.extractfile('manifest.json').read())
+        repositories = json.loads(archive.extractfile('repositories').read())
+        layer = archive.extractfile(manifest[1]['Layers'][1]).read()
+    assert [entry['RepoTags'] for entry in manifest] == [['proj/a:1.0.0'], ['proj/b:2.0.0']]
+    assert manifest[0]['Config'] == 'blobs/sha256/' + DIGESTS['config-a'].split(':')[1]
+    assert layer == 'app layer'
+    assert repositories == {'proj/a': {'1.0.0': DIFF_IDS['base'].split(':')[1]},
+                            'proj/b': {'2.0.0': DIFF_IDS['app'].split(':')[1]}}
+    assert [path.basename for path in tmpdir.listdir()] == ['docker.tar']
+
+
+def test_archive_has_the_structure_of_docker_save(tmpdir):
+    docker_api, _ = __fake_docker_api()
+    archive_path = str(tmpdir.join('docker.tar'))
+    RegistryExport(docker_api, staging_dir=str(tmpdir)).export(
+        [('registry/proj/a:1.0.0', 'proj/a:1.0.0'), ('registry/proj/b@sha256:manifest-b', 'proj/b:2.0.0')],
+        archive_path)
+
+    # docker load finds the config and the layer tars through manifest.json and checks the layers against the
+    # diff_ids of the config, the files are named by the digest of their content as in docker save output
+    with tarfile.open(archive_path) as archive:
+        files = dict((member.name, archive.extractfile(member).read()) for member in archive.getmembers())
+    manifest = json.loads(files['manifest.json'])
+    for entry in manifest:
+        assert sorted(entry) == ['Config', 'Layers', 'RepoTags']
+        config = json.loads(files[entry['Config']])
+        assert __digest(files[entry['Config']]).split(':')[1] == entry['Config'].split('/')[-1]
+        assert [__digest(files[layer]) for layer in entry['Layers']] == config['rootfs']['diff_ids']
+        assert all(layer.startswith('blobs/sha256/') for layer in entry['Layers'])
+    for tags in json.loads(files['repositories']).values():
+        assert all('blobs/sha256/' + layer in files for layer in tags.values())
+    assert sorted(files) == sorted(['manifest.json', 'repositories'] + [
+        'blobs/sha256/' + digest.split(':')[1]
+        for digest in [DIGESTS['config-a'], DIGESTS['config-b'], DIFF_IDS['base'], DIFF_IDS['app']]])
+
+
+def test_layers_that_do_not_match_their_diff_id_fail_the_export(tmpdir):
+    docker_api, _ = __fake_docker_api()
+    download_blob = docker_api.download_blob.side_effect
+
+    def corrupt(reference, digest, target):
+        download_blob(reference, digest, target)
+        if digest == DIGESTS['base']:
+            # A blob that matches its digest but whose uncompressed content does not match the config
+            with open(target, 'wb') as blob:
+                blob.write(__gzip('other layer'))
+    docker_api.download_blob.side_effect = corrupt
+    with pytest.raises(DockerError):
+        RegistryExport(docker_api, staging_dir=str(tmpdir)).export([('registry/proj/a:1.0.0', 'proj/a:1.0.0')],
+                                                                   str(tmpdir.join('docker.tar')))
+    assert not tmpdir.join('docker.tar').exists()
+
+
+@patch('eric_oss_app_package_tool.generator.docker_api.requests.Session.request')
+@patch('eric_oss_app_package_tool.generator.docker_api.DockerConfig')
+def test_platform_manifest_of_a_manifest_list(docker_config, request):
+    docker_config.return_value.get_credentials.return_value = ('user', 'password')
+    manifest_list = mock.MagicMock(status_code=200, headers={'Docker-Content-Digest': 'sha256:list'}, json=lambda: {
+        'manifests': [{'digest': 'sha256:arm', 'platform': {'os': 'linux', 'architecture': 'arm64'}},
+                      {'digest': 'sha256:amd', 'platform': {'os': 'linux', 'architecture': 'amd64'}}]})
+    manifest = mock.MagicMock(status_code=200, headers={}, json=lambda: {'config': {}, 'layers': []})
+    request.side_effect = [manifest_list, manifest]
+
+    assert DockerApi('').get_platform_manifest('registry.example.com/proj/image:1.0.0') == \
+        ('sha256:list', {'config': {}, 'layers': []})
+    assert request.call_args[0][1] == 'https://registry.example.com/v2/proj/image/manifests/sha256:amd'
+
+
+@patch('eric_oss_app_package_tool.generator.docker_api.requests.Session.request')
+@patch('eric_oss_app_package_tool.generator.docker_api.DockerConfig')
+def test_downloaded_blobs_are_verified(docker_config, request, tmpdir):
+    request.return_value = mock.MagicMock(status_code=200, headers={}, iter_content=lambda size: ['app layer'])
+    target = str(tmpdir.join('blob'))
+    DockerApi('').download_blob('registry/proj/image:1.0.0', DIFF_IDS['app'], target)
+    assert open(target).read() == 'app layer'
+    with pytest.raises(DockerError):
+        DockerApi('').download_blob('registry/proj/image:1.0.0', DIFF_IDS['base'], target)
@@ -0,0 +1,48 @@
+import mock
+from mock import patch
+
+from eric_oss_app_package_tool.generator.docker_api import DockerApi
+from eric_oss_app_package_tool.generator.image import get_registry
+from eric_oss_app_package_tool.generator.registry_mirror import mirror_name, mirror_server
+
+MIRRORS = {'armdocker.rnd.ericsson.se': 'https://mirror.example.com:5000/proxy', 'docker.io': 'hub-mirror.example.com'}
+
+
+def test_registry_of_image_repositories():
+    assert get_registry('armdocker.rnd.ericsson.se/proj/image') == 'armdocker.rnd.ericsson.se'
+    assert get_registry('localhost:5000/image') == 'localhost:5000'
+    assert get_registry('library/busybox') == 'docker.io'
+    assert get_registry('busybox') == 'docker.io'
+
+
+def test_images_of_a_mirrored_registry_are_renamed():
+    assert mirror_name('armdocker.rnd.ericsson.se/proj/image:1.0.0', MIRRORS) == \
+        'mirror.example.com:5000/proxy/proj/image:1.0.0'
+    assert mirror_name('armdocker.rnd.ericsson.se/proj/image', MIRRORS) == 'mirror.example.com:5000/proxy/proj/image'
+
+
+def test_docker_hub_images_get_their_library_path():
+    assert mirror_name('busybox:1.32', MIRRORS) == 'hub-mirror.example.com/library/busybox:1.32'
+    assert mirror_name('bitnami/redis:6', MIRRORS) == 'hub-mirror.example.com/bitnami/redis:6'
+
+
+def test_images_of_other_registries_keep_their_name():
+    assert mirror_name('registry.example.com/proj/image:1.0.0', MIRRORS) == 'registry.example.com/proj/image:1.0.0'
+    assert mirror_name('registry.example.com/proj/image:1.0.0', None) == 'registry.example.com/proj/image:1.0.0'
+
+
+def test_mirror_server():
+    assert mirror_server('https://mirror.example.com:5000/proxy') == 'mirror.example.com:5000'
+
+
+@patch('eric_oss_app_package_tool.generator.docker_api.requests.Session.request')
+@patch('eric_oss_app_package_tool.generator.docker_api.DockerConfig')
+def test_docker_api_calls_the_mirror_anonymously_without_credentials(docker_config, request):
+    docker_config.return_value.get_credentials.side_effect = KeyError('no credentials')
+    request.return_value = mock.MagicMock(status_code=200, headers={}, content=b'{}')
+    request.return_value.json.return_value = {'config': {'size': 1}, 'layers': [{'size': 2}]}
+    api = DockerApi('', mirrors=MIRRORS)
+
+    assert api.get_compressed_size('armdocker.rnd.ericsson.se/proj/image:1.0.0') == 3
+    request.assert_called_once_with('GET', 'https://mirror.example.com:5000/v2/proxy/proj/image/manifests/1.0.0',
+                                    auth=None, headers=mock.ANY, timeout=15, stream=False)
@@ -0,0 +1,55 @@
+import os
+import time
+
+from eric_oss_app_package_tool.generator.render_cache import RenderCache
+
+
+def __write(directory, name, contents):
+    path = directory.join(name)
+    path.write(contents)
+    return str(path)
+
+
+def test_key_depends_on_all_render_inputs(tmpdir):
+    cache = RenderCache(str(tmpdir.join('cache')), 1024, 'v3.4.2')
+    chart = __write(tmpdir, 'chart.tgz', 'chart')
+    values = __write(tmpdir, 'values.yaml', 'a: b')
+    key = cache.key(chart, [values], ['x=y'], False)
+
+    assert key == cache.key(chart, [values], ['x=y'], False)
+    assert key != cache.key(chart, [values], ['x=z'], False)
+    assert key != cache.key(chart, [values], ['x=y'], True)
+    assert key != cache.key(chart, None, ['x=y'], False)
+    assert key != RenderCache(str(tmpdir.join('cache')), 1024, 'v2.15.1').key(chart, [values], ['x=y'], False)
+
+    __write(tmpdir, 'values.yaml', 'a: c')
+    assert key != cache.key(chart, [values], ['x=y'], False)
+
+
+def test_least_recently_used_entries_are_evicted(tmpdir):
+    cache_dir = tmpdir.join('cache')
+    cache = RenderCache(str(cache_dir), 20, 'v3.4.2')
+    output = __write(tmpdir, 'output.yaml', '0123456789')
+    copy = str(tmpdir.join('copy.yaml'))
+    cache.put_file('first', output)
+    cache.put_file('second', output)
+    past = time.time() - 60
+    os.utime(str(cache_dir.join('second.yaml')), (past, past))
+    os.utime(str(cache_dir.join('first.yaml')), (past - 60, past - 60))
+    assert cache.get_file('first', copy)
+
+    cache.put_file('third', output)
+
+    assert cache.get_file('first', copy)
+    assert not cache.get_file('second', copy)
+    assert cache.get_file('third', copy)
+
+
+def test_get_file_copies_stored_output(tmpdir):
+    cache = RenderCache(str(tmpdir.join('cache')), 1024, 'v3.4.2')
+    output = __write(tmpdir, 'output.yaml', 'kind: ConfigMap')
+    copy = str(tmpdir.join('copy.yaml'))
+    assert not cache.get_file('present', copy)
+    cache.put_file('present', output)
+    assert cache.get_file('present', copy)
+    assert open(copy).read() == 'kind: ConfigMap'
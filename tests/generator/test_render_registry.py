@@ -0,0 +1,55 @@
+import threading
+
+import pytest
+
+from eric_oss_app_package_tool.generator.render_registry import RenderRegistry
+
+
+def test_render_is_shared_between_lookups():
+    registry = RenderRegistry()
+    renders = []
+
+    def render():
+        renders.append(1)
+        return object()
+
+    assert registry.get('chart', render) is registry.get('chart', render)
+    assert len(renders) == 1
+
+
+def test_concurrent_lookups_wait_for_the_running_render():
+    registry = RenderRegistry()
+    started = threading.Event()
+    release = threading.Event()
+    template = object()
+    results = []
+
+    def slow_render():
+        started.set()
+        release.wait()
+        return template
+
+    def unexpected_render():
+        raise AssertionError('chart rendered twice')
+
+    owner = threading.Thread(target=lambda: results.append(registry.get('chart', slow_render)))
+    owner.start()
+    started.wait()
+    waiter = threading.Thread(target=lambda: results.append(registry.get('chart', unexpected_render)))
+    waiter.start()
+    release.set()
+    owner.join()
+    waiter.join()
+
+    assert results == [template, template]
+
+
+def test_failed_render_is_not_kept():
+    registry = RenderRegistry()
+
+    def failing_render():
+        raise EnvironmentError('helm failed')
+
+    with pytest.raises(EnvironmentError):
+        registry.get('chart', failing_render)
+    assert registry.get('chart', lambda: 'rendered') == 'rendered'
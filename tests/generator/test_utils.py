@@ -0,0 +1,36 @@
+import tarfile
+
+from eric_oss_app_package_tool.generator.utils import read_chart_file, read_chart_tree
+
+
+def test_read_chart_file_from_archive_and_directory(tmpdir):
+    chart_dir = tmpdir.mkdir('chart')
+    chart_dir.join('values.yaml').write('global: {}\n')
+    chart_dir.mkdir('charts').mkdir('sub').join('values.yaml').write('sub: {}\n')
+    chart = tmpdir.join('chart-1.0.0.tgz')
+    with tarfile.open(str(chart), 'w:gz') as tar:
+        tar.add(str(chart_dir), arcname='chart')
+
+    assert read_chart_file(str(chart), 'values.yaml') == b'global: {}\n'
+    assert read_chart_file(str(chart_dir), 'values.yaml') == b'global: {}\n'
+    assert read_chart_file(str(chart), 'Chart.yaml') is None
+    assert read_chart_file(str(chart_dir), 'Chart.yaml') is None
+
+
+def test_read_chart_tree_walks_nested_subchart_archives(tmpdir):
+    sub_dir = tmpdir.mkdir('sub')
+    sub_dir.join('Chart.yaml').write('name: sub\n')
+    sub_dir.join('values.yaml').write('sub: {}\n')
+    with tarfile.open(str(tmpdir.join('sub-1.0.0.tgz')), 'w:gz') as tar:
+        tar.add(str(sub_dir), arcname='sub')
+    chart_dir = tmpdir.mkdir('chart')
+    chart_dir.join('Chart.yaml').write('name: chart\n')
+    chart_dir.join('values.yaml').write('global: {}\n')
+    chart_dir.mkdir('charts').join('sub-1.0.0.tgz').write(tmpdir.join('sub-1.0.0.tgz').read('rb'), 'wb')
+    chart = tmpdir.join('chart-1.0.0.tgz')
+    with tarfile.open(str(chart), 'w:gz') as tar:
+        tar.add(str(chart_dir), arcname='chart')
+
+    assert read_chart_tree(str(chart), ['values.yaml']) == {'chart': {'values.yaml': b'global: {}\n'},
+                                                            'chart/charts/sub': {'values.yaml': b'sub: {}\n'}}
+    assert read_chart_tree(str(chart), ['eric-product-info.yaml']) == {'chart': {}, 'chart/charts/sub': {}}